@@ -1,3 +1,6 @@
+import time
+STARTUP_TIME=time.perf_counter() # 起動時間(import~最初のUDP送信)の計測用. importより前に取る
+
 from pathlib import Path
 ROOT=Path(__file__).parent.parent
 import sys
@@ -6,18 +9,24 @@ import traceback
 
 from enum import Enum
 from socket import socket,AF_INET,SOCK_DGRAM
-import pandas as pd
 import yaml
 import json
-import time
 from math import ceil
 
 from src.reader.card_state_analyzer import CardStateAnalyzer
 from src.reader.card_reader_manager import CardReaderManager, PhotoDiodeReadType, ColorSensorIRReadType
+from src.reader.uid_cache import UIDCache
+from src.reader.nfc_scheduler import NFCScheduler
+from src.reader.reader_group import ReaderGroup
+from src.reader.mux_tuning import load_settle_times, save_settle_times
 from src.module.tc4052b import TC4052B
+from src.module.gpio_backend import create_gpio_backend
 from src.module.rc_s660s.src.rcs660s import RCS660S
+from src.module.rc_s660s.src.capture import UARTCapture
+from src.module.rc_s660s.src.metrics import summarize
 from src.module.rc_s660s.src.rcs660s_manager import RCS660SManager
 from src.module.rc_s660s.src.manager.rcs660s_manager_typeA_14443_3A import RCS660SManagerTypeA144433A
+from src.module.rc_s660s.src.manager.rcs660s_manager_mixed import RCS660SManagerMixed
 from src.module.color_sensor import ColorSensor, ColorSensorRGBReadType
 from src.module.photo_diode import PhotoDiode
 from src.utils.sleep import sleep
@@ -28,9 +37,41 @@ from src.utils.raspi2unity_adapter import Raspi2UnityAdapter
 class TagType(Enum):
     FELICA="Felica"
     TYPEA_14443_3A="TypeA_14443-3A"
+    MIXED="Mixed"
+
+
+def create_rcs660s_manager(rcs660s:RCS660S, tag_type:TagType, conf_rcs660s:dict) -> RCS660SManager:
+    # RCS660SManagerのインスタンス化. Tagによってコマンドとか違う
+    if tag_type==TagType.TYPEA_14443_3A:
+        print("[Init] rcs660s_manager_typeA_14443_3A")
+        return RCS660SManagerTypeA144433A(
+            rcs660s=rcs660s,is_debug=False,
+            is_pipelined=conf_rcs660s["is_pipelined"],
+            is_persistent_session=conf_rcs660s["is_persistent_session"]
+        )
+    elif tag_type==TagType.FELICA:
+        print("[Init] rcs660s_manager_felica")
+        return RCS660SManager(
+            rcs660s=rcs660s,is_debug=False,
+            is_pipelined=conf_rcs660s["is_pipelined"],
+            is_persistent_session=conf_rcs660s["is_persistent_session"],
+            is_fast_polling=conf_rcs660s["is_fast_polling"],
+            time_slots=conf_rcs660s["time_slots"]
+        )
+    elif tag_type==TagType.MIXED:
+        print("[Init] rcs660s_manager_mixed")
+        return RCS660SManagerMixed(
+            rcs660s=rcs660s,is_debug=False,
+            is_pipelined=conf_rcs660s["is_pipelined"],
+            is_persistent_session=conf_rcs660s["is_persistent_session"],
+            channel_overrides=conf_rcs660s["channel_tag_types"]
+        )
+    else:
+        raise ValueError(f"Invalid tag type: {tag_type}")
 
 
 def main():
+    print(f"[Startup] import: {time.perf_counter()-STARTUP_TIME:.3f}s")
     config_yaml=yaml.safe_load(open(Path(__file__).parent / "conf.yaml"))
 
 
@@ -44,28 +85,45 @@ def main():
     sock.settimeout(1.0/frequency*10**3)
 
     # MUXとrcs660sのインスタンス化
+    # groupsが空なら, portの1台のRCS660Sでmappingの全チャンネルを読む
+    # groupsを指定すると, UARTごとにRCS660S/MUX/担当チャンネルを分け, グループごとのスレッドで並列に読む
     print("[Init] rcs660s")
     conf_rcs660s=config_yaml["rcs660s"]
-    mapping_rcs660s=pd.DataFrame(conf_rcs660s["mapping"]).T
-
-    tc4052b=TC4052B(mapping=mapping_rcs660s)
-    rcs660s=RCS660S(
-        port=conf_rcs660s["port"], 
-        baudrate=conf_rcs660s["baudrate"], 
-        timeout_fps=conf_rcs660s["timeout_fps"]
-    )
+    tag_type=TagType(config_yaml["tag_type"])
+    conf_groups=conf_rcs660s["groups"]
+    if len(conf_groups)==0:
+        conf_groups=[{
+            "port":conf_rcs660s["port"], "mapping":conf_rcs660s["mapping"], "channels":config_yaml["reader_channels"]
+        }]
 
+    conf_gpio=config_yaml["gpio"]
+    print(f"[Init] gpio: {conf_gpio['backend']}")
+    gpio=create_gpio_backend(conf_gpio["backend"], **conf_gpio.get("options", {})) # 全グループのMUXで共有する
 
-    # RCS660SManagerのインスタンス化. Tagによってコマンドとか違う
-    tag_type=TagType(config_yaml["tag_type"])
-    if tag_type==TagType.TYPEA_14443_3A:
-        print("[Init] rcs660s_manager_typeA_14443_3A")
-        rcs660s_manager=RCS660SManagerTypeA144433A(rcs660s=rcs660s,is_debug=False)
-    elif tag_type==TagType.FELICA:
-        print("[Init] rcs660s_manager_felica")
-        rcs660s_manager=RCS660SManager(rcs660s=rcs660s,is_debug=False)
-    else:
-        raise ValueError(f"Invalid tag type: {tag_type}")
+    reader_groups=[]
+    for conf_group in conf_groups:
+        print(f"[Init] rcs660s group: {conf_group['port']}")
+        tc4052b=TC4052B(mapping=conf_group["mapping"], gpio=gpio) if conf_group["mapping"] is not None else None
+        conf_capture=conf_rcs660s["capture"]
+        capture=None
+        if conf_capture["enable"]:
+            capture_dir=ROOT / conf_capture["dir"]
+            capture_dir.mkdir(parents=True, exist_ok=True)
+            capture=UARTCapture(
+                path=capture_dir / f"{Path(conf_group['port']).name}.rcscap", # グループ(UART)ごとに1ファイル
+                size=conf_capture["size_mb"]*1024*1024
+            )
+            print(f"[Init] rcs660s capture: {capture.path}")
+        rcs660s=RCS660S(
+            port=conf_group["port"], 
+            baudrate=conf_rcs660s["baudrate"], 
+            timeout_fps=conf_rcs660s["timeout_fps"],
+            capture=capture,
+            command_timeout=conf_rcs660s["command_timeout"]
+        )
+        rcs660s_manager=create_rcs660s_manager(rcs660s, tag_type, conf_rcs660s)
+        channel_names=[ch_name for ch_name in conf_group["channels"] if ch_name in config_yaml["reader_channels"]]
+        reader_groups.append(ReaderGroup(tc4052b, rcs660s_manager, channel_names))
 
 
     # ColorSensorのインスタンス化
@@ -91,18 +149,56 @@ def main():
         channel_mapping=conf_photo_diode["mapping"] # mappingは辞書とする
     )
 
+    conf_uid_cache=config_yaml["uid_cache"]
+    uid_cache=UIDCache(
+        channel_names=config_yaml["reader_channels"],
+        ir_band=conf_uid_cache["ir_band"],
+        photo_diode_band=conf_uid_cache["photo_diode_band"],
+        max_age=conf_uid_cache["max_age"]
+    ) if conf_uid_cache["enable"] else None
+
+    conf_nfc_scheduler=config_yaml["nfc_scheduler"]
+    nfc_scheduler=NFCScheduler(
+        channel_names=config_yaml["reader_channels"],
+        frequency=frequency,
+        min_poll_rate=conf_nfc_scheduler["min_poll_rate"],
+        budget_ratio=conf_nfc_scheduler["budget_ratio"],
+        ir_band=conf_nfc_scheduler["ir_band"],
+        photo_diode_band=conf_nfc_scheduler["photo_diode_band"]
+    ) if conf_nfc_scheduler["enable"] else None
+
     print("[Init] cardreader_manager")
     cardreader_manager=CardReaderManager(
-        tc4052b=tc4052b,
-        rcs660s_manager=rcs660s_manager,
         color_sensor=color_sensor,
         photo_diode=photo_diode,
         channel_names=config_yaml["reader_channels"], # 検出するチャンネル名をここで指定する
         photo_diode_read_type=PhotoDiodeReadType(conf_photo_diode["read_type"]),
         color_sensor_ir_read_type=ColorSensorIRReadType(conf_color_sensor["ir_read_type"]),
-        delta_time=1/1000 # チャンネルごとのサンプリング間隔 [s]
+        delta_time=1/1000, # チャンネルごとのサンプリング間隔 [s]
+        is_presence_gated=config_yaml["is_presence_gated"],
+        presence_ir_threshold=conf_color_sensor["threshold"]["ir"],
+        uid_cache=uid_cache,
+        nfc_scheduler=nfc_scheduler,
+        reader_groups=reader_groups
     )
 
+    # MUXの切り替え順と待ち時間
+    conf_mux=conf_rcs660s["mux"]
+    settle_times_path=ROOT / conf_mux["settle_times_path"]
+    settle_times=load_settle_times(settle_times_path)
+    for conf_group, reader_group in zip(conf_groups, reader_groups):
+        if conf_mux["optimize_scan_order"]:
+            print(f"[Init] rcs660s scan order ({conf_group['port']}): {reader_group.optimize_scan_order()}")
+        if conf_mux["calibrate_settle_times"]:
+            settle_times.update(reader_group.calibrate_settle_times())
+        else:
+            reader_group.settle_times.update({
+                ch_name:settle_time for ch_name, settle_time in settle_times.items() if ch_name in reader_group.channel_names
+            })
+        print(f"[Init] rcs660s settle times ({conf_group['port']}): {reader_group.settle_times}")
+    if conf_mux["calibrate_settle_times"]:
+        save_settle_times(settle_times_path, settle_times)
+
 
     card_state_analyzer=CardStateAnalyzer(
         color_sensor_threshold=config_yaml["color-sensor"]["threshold"],
@@ -126,6 +222,8 @@ def main():
     sleep_time=1/frequency*10**9
     cnt=0
     elapsed_time=0
+    metrics_interval=conf_rcs660s["metrics_interval"]
+    metrics_time=elapsed_time
     while True:
         try:
             previous_time=time.time_ns()
@@ -145,7 +243,17 @@ def main():
                 json.dumps(card_states).encode(),
                 (server,port)
             )
+            if cnt==0: print(f"[Startup] first packet: {time.perf_counter()-STARTUP_TIME:.3f}s")
             print(f"[{cnt}] {elapsed_time:.3f}s\n",sensor_values,"\n",card_states)
+            if metrics_interval>0 and elapsed_time-metrics_time>=metrics_interval:
+                for snapshot, mux_metrics in zip(cardreader_manager.get_rcs660s_metrics(), cardreader_manager.get_mux_metrics()):
+                    print(f"[Metrics]\n{summarize(snapshot)}")
+                    if mux_metrics is not None:
+                        print(
+                            f"mux: switch {mux_metrics['switch_count']} (skip {mux_metrics['skip_count']}), "
+                            f"pin writes {mux_metrics['pin_write_count']}, {mux_metrics['switch_time']['mean']*1e6:.1f}us/switch"
+                        )
+                metrics_time=elapsed_time
             sleep(previous_time,sleep_time)
             cnt+=1
             elapsed_time=(time.time_ns()-start_time)*10**-9
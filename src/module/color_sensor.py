@@ -5,7 +5,6 @@ MUX+カラーセンサを制御するクラス
 """
 
 from enum import Enum
-from smbus2 import SMBus
 
 class ColorSensorRGBReadType(Enum):
     DEFAULT="raw" # センサ値をそのまま帰す
@@ -17,7 +16,7 @@ class ColorSensor():
     """
 
     BUS_NUM=1 #バス番号. 基本は1
-    I2C_BUS=SMBus(BUS_NUM) #クラスで共通のバスを使う
+    I2C_BUS=None #クラスで共通のバスを使う. 最初のインスタンスを作るときに開く
 
     def __init__(self, 
         mux_address,slave_address, channel_mapping:dict, 
@@ -35,6 +34,10 @@ class ColorSensor():
             }
         :param read_type: 読み取りタイプ
         """
+        if ColorSensor.I2C_BUS is None:
+            from smbus2 import SMBus
+            ColorSensor.I2C_BUS=SMBus(ColorSensor.BUS_NUM)
+
         self.master_addr=mux_address
         self.slave_addr=slave_address
         self.channel_mapping=channel_mapping
@@ -0,0 +1,106 @@
+"""
+RPi.GPIOの代わりに使うメモリ上のGPIO
+実機なしでTC4052Bを動かし, ピンの状態をシミュレータなどに渡すためのもの
+変化したピンを時刻付きで記録するので, ベンチマークで切り替えの回数やピンの変化の間隔を確かめられる
+"""
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+
+from .gpio_backend import GPIOBackendAbc, to_pin_values
+
+
+DEFAULT_MAX_TIMELINE=100000 # 覚えておくピンの変化の数. 古いものから捨てる
+
+
+class FakeGPIO(GPIOBackendAbc):
+    """
+    RPi.GPIOと同じ名前の定数/関数を持つ. TC4052B(mapping, gpio=FakeGPIO())のように渡す
+    出力したピンの状態を覚えておき, 変化したピンをtimelineに記録する. output()のたびにlistenerを呼ぶ
+    """
+
+    def __init__(self, max_timeline:int=DEFAULT_MAX_TIMELINE):
+        """
+        :param max_timeline: timelineに残すピンの変化の数
+        """
+        self.mode:int|None=None
+        self.pin_states:dict[int,int]={} # {pin: HIGH/LOW}
+        self.listeners:list[Callable[[dict[int,int]], None]]=[]
+        self.lock=threading.Lock()
+
+        self.timeline:deque[tuple[float,int,int]]=deque(maxlen=max_timeline) # (time.perf_counter, pin, HIGH/LOW)
+        self.output_count=0 # output()の呼び出し回数
+        self.transition_count=0 # 値が変わったピンの延べ数
+        self.last_change_time:float|None=None # 最後にピンが変わった時刻 (time.perf_counter)
+
+
+    def add_listener(self, listener:Callable[[dict[int,int]], None]) -> None:
+        """
+        :param listener: output()のたびに呼ばれる関数. 引数は書いた後の{pin: HIGH/LOW}
+        """
+        self.listeners.append(listener)
+
+
+    def get_metrics(self) -> dict:
+        """
+        output()の回数と, 変わったピンの延べ数
+        """
+        return {
+            "output_count":self.output_count,
+            "transition_count":self.transition_count,
+        }
+
+
+    def get_change_intervals(self) -> list[float]:
+        """
+        timelineの, ピンが変わった時刻どうしの間隔 [s]. 同じoutput()で変わったピンは1回の変化とする
+        """
+        change_times=sorted({timestamp for timestamp, _, _ in list(self.timeline)})
+        return [t1-t0 for t0, t1 in zip(change_times, change_times[1:])]
+
+
+    def reset_timeline(self) -> None:
+        with self.lock:
+            self.timeline.clear()
+            self.output_count=0
+            self.transition_count=0
+
+
+    # -------------------------------------- RPi.GPIO互換 --------------------------------------
+    def setmode(self, mode:int) -> None:
+        self.mode=mode
+
+    def setup(self, pin:int, direction:int, initial:int=GPIOBackendAbc.LOW) -> None:
+        with self.lock:
+            self.pin_states.setdefault(int(pin), initial)
+
+    def output(self, pins:int|list[int], values:int|list[int]) -> None:
+        """
+        RPi.GPIOと同じく, ピン/値はそれぞれ1つでもリストでも良い
+        """
+        pin_values=to_pin_values(pins, values)
+        timestamp=time.perf_counter()
+        with self.lock:
+            self.output_count+=1
+            is_changed=False
+            for pin, value in pin_values:
+                if self.pin_states.get(pin)!=value:
+                    self.timeline.append((timestamp, pin, value))
+                    self.transition_count+=1
+                    is_changed=True
+                self.pin_states[pin]=value
+            if is_changed: self.last_change_time=timestamp
+            pin_states=dict(self.pin_states)
+        for listener in self.listeners:
+            listener(pin_states)
+
+    def input(self, pin:int) -> int:
+        return self.pin_states.get(int(pin), self.LOW)
+
+    def cleanup(self, pin:int|None=None) -> None:
+        with self.lock:
+            if pin is None:
+                self.pin_states.clear()
+            else:
+                self.pin_states.pop(int(pin), None)
@@ -0,0 +1,195 @@
+"""
+TC4052BなどのGPIOを書くバックエンド
+RPi.GPIOと同じ名前の定数/関数(setmode, setup, output, input, cleanup)を持つので, そのままTC4052B(mapping, gpio=...)に渡せる
+- RPiGPIOBackend: RPi.GPIO (Raspberry Pi 4まで)
+- LibgpiodBackend: libgpiod v2 (/dev/gpiochipN. RPi.GPIOが動かないRaspberry Pi 5など)
+- FakeGPIO: メモリ上のGPIO (fake_gpio.py). 実機なしでの動作確認/ベンチマーク用
+
+どれもimportしただけでは実機のライブラリを読まないので, RPi以外でもimportできる
+"""
+import abc
+import threading
+
+
+HIGH=1
+LOW=0
+
+RPI="rpi"
+LIBGPIOD="libgpiod"
+FAKE="fake"
+
+
+class GPIOBackendAbc(abc.ABC):
+    """
+    RPi.GPIOのうちTC4052Bが使う部分
+    ピン番号はBCM (GPIOxxの番号) で指定する
+    """
+
+    BCM=11
+    BOARD=10
+    OUT=0
+    IN=1
+    HIGH=HIGH
+    LOW=LOW
+
+    def setmode(self, mode:int) -> None:
+        pass
+
+    def setwarnings(self, flag:bool) -> None:
+        pass
+
+    @abc.abstractmethod
+    def setup(self, pin:int, direction:int, initial:int=LOW) -> None:
+        return NotImplementedError
+
+    @abc.abstractmethod
+    def output(self, pins:int|list[int], values:int|list[int]) -> None:
+        """
+        RPi.GPIOと同じく, ピン/値はそれぞれ1つでもリストでも良い
+        """
+        return NotImplementedError
+
+    @abc.abstractmethod
+    def input(self, pin:int) -> int:
+        return NotImplementedError
+
+    @abc.abstractmethod
+    def cleanup(self, pin:int|None=None) -> None:
+        return NotImplementedError
+
+
+def to_pin_values(pins:int|list[int], values:int|list[int]) -> list[tuple[int,int]]:
+    """
+    output()の引数を[(pin, HIGH/LOW), ...]にそろえる
+    """
+    if not isinstance(pins, (list, tuple)): pins=[pins]
+    if not isinstance(values, (list, tuple)): values=[values]*len(pins)
+    return [(int(pin), int(bool(value))) for pin, value in zip(pins, values)]
+
+
+class RPiGPIOBackend(GPIOBackendAbc):
+    """
+    RPi.GPIOへそのまま渡す. RPi.GPIOはインスタンスを作るときに読む
+    """
+
+    def __init__(self):
+        from RPi import GPIO
+        self.gpio=GPIO
+        self.BCM=GPIO.BCM
+        self.BOARD=GPIO.BOARD
+        self.OUT=GPIO.OUT
+        self.IN=GPIO.IN
+
+
+    def setmode(self, mode:int) -> None:
+        self.gpio.setmode(mode)
+
+    def setwarnings(self, flag:bool) -> None:
+        self.gpio.setwarnings(flag)
+
+    def setup(self, pin:int, direction:int, initial:int=LOW) -> None:
+        self.gpio.setup(pin, direction, initial=initial)
+
+    def output(self, pins:int|list[int], values:int|list[int]) -> None:
+        self.gpio.output(pins, values)
+
+    def input(self, pin:int) -> int:
+        return self.gpio.input(pin)
+
+    def cleanup(self, pin:int|None=None) -> None:
+        if pin is None:
+            self.gpio.cleanup()
+        else:
+            self.gpio.cleanup(pin)
+
+
+class LibgpiodBackend(GPIOBackendAbc):
+    """
+    libgpiod v2 (pip install gpiod) で/dev/gpiochipNのラインを書く
+    setupしたピンをまとめて1つのリクエストにし, outputは変わるピンだけを1回のset_valuesで書く.
+    ピンの番号はチップのライン番号 (Raspberry PiのgpiochipではBCMの番号と同じ)
+    """
+
+    def __init__(self, chip:str="/dev/gpiochip0", consumer:str="svs-client"):
+        """
+        :param chip: GPIOチップのパス. Raspberry Pi 5のヘッダピンは/dev/gpiochip4 (新しいカーネルでは/dev/gpiochip0)
+        :param consumer: gpioinfoに表示されるラインの使用者名
+        """
+        import gpiod
+        from gpiod.line import Direction, Value
+        self.gpiod=gpiod
+        self.Direction=Direction
+        self.Value=Value
+        self.chip=chip
+        self.consumer=consumer
+        self.pin_states:dict[int,int]={} # setupしたピン → 最後に書いた値
+        self.request=None # setupしたピンをまとめたgpiod.LineRequest
+        self.lock=threading.Lock()
+
+
+    def setup(self, pin:int, direction:int, initial:int=LOW) -> None:
+        if direction!=self.OUT:
+            raise ValueError(f"LibgpiodBackend supports output pins only: {pin}")
+        with self.lock:
+            self.pin_states.setdefault(int(pin), initial)
+            self.__request_lines() # ピンが増えたので取り直す
+
+    def output(self, pins:int|list[int], values:int|list[int]) -> None:
+        pin_values=to_pin_values(pins, values)
+        with self.lock:
+            for pin, _ in pin_values:
+                if pin not in self.pin_states:
+                    raise ValueError(f"Pin {pin} is not set up")
+            self.request.set_values({pin:self.__to_value(value) for pin, value in pin_values})
+            for pin, value in pin_values:
+                self.pin_states[pin]=value
+
+    def input(self, pin:int) -> int:
+        return self.pin_states.get(int(pin), self.LOW)
+
+    def cleanup(self, pin:int|None=None) -> None:
+        with self.lock:
+            if pin is None:
+                self.pin_states.clear()
+            else:
+                self.pin_states.pop(int(pin), None)
+            self.__request_lines()
+
+
+    def __request_lines(self) -> None:
+        """
+        今のpin_statesのピンを, 今の値のままリクエストし直す
+        """
+        if self.request is not None:
+            self.request.release()
+            self.request=None
+        if len(self.pin_states)==0:
+            return
+        self.request=self.gpiod.request_lines(
+            self.chip,
+            consumer=self.consumer,
+            config={
+                pin:self.gpiod.LineSettings(direction=self.Direction.OUTPUT, output_value=self.__to_value(value))
+                for pin, value in self.pin_states.items()
+            },
+        )
+
+    def __to_value(self, value:int):
+        return self.Value.ACTIVE if value==HIGH else self.Value.INACTIVE
+
+
+def create_gpio_backend(backend:str=RPI, **kwargs) -> GPIOBackendAbc:
+    """
+    conf.yamlのgpio.backendからバックエンドを作る
+    :param backend: rpi/libgpiod/fake
+    :param kwargs: LibgpiodBackendのchip, consumerなど
+    """
+    if backend==RPI:
+        return RPiGPIOBackend()
+    elif backend==LIBGPIOD:
+        return LibgpiodBackend(**kwargs)
+    elif backend==FAKE:
+        from .fake_gpio import FakeGPIO # fake_gpioがこのモジュールを読むので, ここで読む
+        return FakeGPIO()
+    else:
+        raise ValueError(f"Invalid gpio backend: {backend} (supported: {[RPI, LIBGPIOD, FAKE]})")
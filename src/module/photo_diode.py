@@ -4,8 +4,6 @@ ADコンバータ+photo-diodeを制御するクラス
 ・photo-diode : 503PDD2E-3A
 """
 
-from spidev import SpiDev
-
 class PhotoDiode():
     """
     SPIバス1つにつき、1つインスタンスを作成する
@@ -28,6 +26,7 @@ class PhotoDiode():
             }
         """
 
+        from spidev import SpiDev
         self.spi=SpiDev()
         self.spi.open(bus, device)  # bus0,cs0
         self.spi.max_speed_hz = max_speed_hz  # kHz 必ず指定する
@@ -0,0 +1,199 @@
+import asyncio
+from collections import deque
+
+from .metrics import TIMEOUTS, STALE_FRAMES
+from .rcs660s import RCS660S, RCS660STimeoutError, PIPELINED
+from .command_frame import CommandFrame
+from .response import RCS660SResponse, SEQ_INDEX
+
+
+class AsyncRCS660S:
+    """
+    RCS660Sのasyncio版の送受信
+    uartのfdをloop.add_readerで監視し, 読めるようになった分だけFrameParserに流し込む.
+    レスポンス待ちの間はイベントループを止めないので, 同じループでソケットやタイマも回せる.
+    レスポンスは送信したb_seqで対応付け, 期限切れのコマンドの応答は届くのを待ってから捨てる.
+
+    uartとパーサはRCS660Sのものを共有する.
+    reset/setupなどの同期コマンドはRCS660S側で済ませてから, イベントループの中で使う
+    """
+
+    def __init__(self, rcs660s: RCS660S, timeout: float|None=None):
+        """
+        :param timeout: 1コマンドのレスポンス待ちの上限 [s]. 超えたらRCS660STimeoutError. Noneならrcs660s.command_timeout
+        """
+        self.rcs660s = rcs660s
+        self.timeout = timeout if timeout is not None else rcs660s.command_timeout
+
+        self.loop: asyncio.AbstractEventLoop|None = None
+        self.frame_waiters: deque[asyncio.Future] = deque() # レスポンスフレーム待ち. 古い順にフレームを渡す
+        self.ack_waiters: list[tuple[int, asyncio.Future]] = [] # (待っているack_count, future)
+
+
+    # -------------------------------------- public methods --------------------------------------
+    def open(self) -> None:
+        """
+        実行中のイベントループにuartのfdを登録する. 最初のコマンドで自動的に呼ばれる
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self.loop is not None:
+            self.close()
+        self.loop = loop
+        self.loop.add_reader(self.rcs660s.uart.fileno(), self.__on_readable)
+
+    def close(self) -> None:
+        """
+        fdの監視をやめ, 待っているコマンドをキャンセルする
+        """
+        if self.loop is None:
+            return
+        self.loop.remove_reader(self.rcs660s.uart.fileno())
+        for future in self.frame_waiters:
+            future.cancel()
+        for _, future in self.ack_waiters:
+            future.cancel()
+        self.frame_waiters.clear()
+        self.ack_waiters.clear()
+        self.loop = None
+
+    async def transceive(self, command_frame: CommandFrame) -> RCS660SResponse:
+        """
+        コマンドフレームを送信し, 送信したb_seqのレスポンスを待つ
+        """
+        self.open()
+        seq = self.rcs660s.send_frame(command_frame)
+        try:
+            response = await self.__next_response({seq})
+        except RCS660STimeoutError:
+            await self.__drain({seq})
+            raise
+        self.rcs660s.record_response(type(command_frame.ccid_command).__name__, [response.frame])
+        return response
+
+    async def transceive_batch(self, command_frames: list[CommandFrame]) -> list[RCS660SResponse]:
+        """
+        RCS660S.transceive_batchのasyncio版
+        前のコマンドのACKを待って次のフレームを書き込み, レスポンスはこのバッチで振ったb_seqで送信順に並べて返す
+        """
+        self.open()
+        seqs: list[int] = []
+        waiting_seqs: set[int] = set()
+        responses: dict[int, RCS660SResponse] = {}
+        ack_count = self.rcs660s.frame_parser.ack_count
+        try:
+            for i, command_frame in enumerate(command_frames):
+                if i > 0:
+                    await self.__wait_ack(ack_count + i)
+                seqs.append(self.rcs660s.send_frame(command_frame))
+                waiting_seqs.add(seqs[-1])
+
+            while waiting_seqs:
+                response = await self.__next_response(waiting_seqs)
+                waiting_seqs.discard(response.seq)
+                responses[response.seq] = response
+        except RCS660STimeoutError:
+            await self.__drain(waiting_seqs)
+            raise
+        self.rcs660s.response = responses[seqs[-1]].frame
+        self.rcs660s.record_response(PIPELINED, [response.frame for response in responses.values()])
+
+        return [responses[seq] for seq in seqs]
+
+
+    # -------------------------------------- private methods --------------------------------------
+    async def __next_response(self, seqs: set[int]) -> RCS660SResponse:
+        """
+        b_seqがseqsのどれかのレスポンスを待って返す
+        それ以外のフレーム(期限切れになったコマンドの遅れた応答など)は捨てる
+        """
+        while True:
+            response = RCS660SResponse(await self.__next_frame())
+            if response.seq in seqs:
+                return response
+            self.rcs660s.metrics.count(STALE_FRAMES)
+
+    async def __drain(self, seqs: set[int]) -> None:
+        """
+        期限切れになったコマンドの応答を, 全部届くかもう1回分の期限まで待ってから捨てる
+        待たずに次へ進むと, 遅れて届いた応答を次のコマンド(MUXなら次のチャンネル)が受け取ってしまう
+        """
+        frame_parser = self.rcs660s.frame_parser
+        waiting_seqs = set(seqs)
+        deadline = self.loop.time() + self.timeout
+        try:
+            while waiting_seqs:
+                frame = frame_parser.pop_frame()
+                if frame is None:
+                    future = self.loop.create_future()
+                    self.frame_waiters.append(future)
+                    try:
+                        frame = await asyncio.wait_for(future, max(deadline - self.loop.time(), 0.0))
+                    except asyncio.TimeoutError:
+                        return
+                waiting_seqs.discard(frame[SEQ_INDEX])
+                self.rcs660s.metrics.count(STALE_FRAMES)
+        finally:
+            self.rcs660s.flush_buffer()
+
+    async def __next_frame(self) -> bytes:
+        """
+        パーサに完成済みのフレームがあればそれを, 無ければ次に完成するフレームを待って返す
+        """
+        frame = self.rcs660s.frame_parser.pop_frame()
+        if frame is not None:
+            return frame
+        future = self.loop.create_future()
+        self.frame_waiters.append(future)
+        return await self.__wait_for(future)
+
+    async def __wait_ack(self, ack_count: int) -> None:
+        if self.rcs660s.frame_parser.ack_count >= ack_count:
+            return
+        future = self.loop.create_future()
+        self.ack_waiters.append((ack_count, future))
+        await self.__wait_for(future)
+
+    async def __wait_for(self, future: asyncio.Future):
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.rcs660s.metrics.count(TIMEOUTS)
+            raise RCS660STimeoutError(f"no response within {self.timeout}s") from None
+
+    def __on_readable(self) -> None:
+        """
+        uartのfdが読めるようになったときにイベントループから呼ばれる
+        """
+        uart = self.rcs660s.uart
+        n_waiting = uart.in_waiting
+        if n_waiting == 0:
+            return
+        self.rcs660s.feed(uart.read(n_waiting))
+        self.__dispatch()
+
+    def __dispatch(self) -> None:
+        """
+        完成したフレームとACKを, 待っているコマンドに渡す
+        タイムアウトでキャンセル済みのfutureは飛ばす
+        """
+        frame_parser = self.rcs660s.frame_parser
+        while self.frame_waiters and frame_parser.frames:
+            future = self.frame_waiters.popleft()
+            if future.done():
+                continue
+            future.set_result(frame_parser.pop_frame())
+        while self.frame_waiters and self.frame_waiters[0].done():
+            self.frame_waiters.popleft()
+
+        if self.ack_waiters:
+            waiting = []
+            for ack_count, future in self.ack_waiters:
+                if future.done():
+                    continue
+                if frame_parser.ack_count >= ack_count:
+                    future.set_result(None)
+                else:
+                    waiting.append((ack_count, future))
+            self.ack_waiters = waiting
@@ -0,0 +1,225 @@
+"""
+UARTの送受信バイト列のキャプチャとリプレイ
+- UARTCapture: 送信フレーム/受信バイト列を時刻付きで, 事前に確保したmmapのリングファイルに書く
+    書き込みはmmapへのコピーだけなので, pollingの途中でディスク待ちにならない
+- ReplayUART: キャプチャをserial.Serialの代わりにRCS660Sへ流し込む (記録時の速度 or 最速)
+"""
+import fcntl
+import mmap
+import os
+import select
+import struct
+import termios
+import threading
+import time
+from pathlib import Path
+
+
+MAGIC = b"RCSCAP01"
+HEADER_FORMAT = "<8sIIQd" # magic, slot_size, n_slots, 書いたレコード数, 記録開始のunix時刻
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+COUNT_OFFSET = 16 # ヘッダ中のレコード数の位置
+RECORD_FORMAT = "<dBH" # 記録開始からの経過時間[s], 方向, データ長
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_FORMAT)
+SLOT_SIZE = 64 # 1レコードの大きさ. ACK/レスポンスフレームの多くが1スロットに収まる
+SLOT_DATA_SIZE = SLOT_SIZE - RECORD_HEADER_SIZE
+
+TX = 0 # RCS660Sへの送信
+RX = 1 # RCS660Sからの受信
+RX_CONTINUED = 2 # 1スロットに収まらなかった受信データの続き
+TX_CONTINUED = 3 # 1スロットに収まらなかった送信データの続き
+
+
+class CaptureRecord:
+    __slots__ = ("timestamp", "direction", "data")
+
+    def __init__(self, timestamp: float, direction: int, data: bytes):
+        self.timestamp = timestamp # 記録開始からの経過時間 [s]
+        self.direction = direction # TX/RX
+        self.data = data
+
+    def __repr__(self) -> str:
+        hexstr = ' '.join(f'{b:02X}' for b in self.data)
+        return f"CaptureRecord({self.timestamp:.6f}, {'tx' if self.direction == TX else 'rx'}: {hexstr})"
+
+
+class UARTCapture:
+    """
+    固定長スロットのリングバッファをmmapしたファイルに, 送受信を追記する
+    ファイルがいっぱいになったら古いレコードから上書きする
+    """
+
+    def __init__(self, path: str|Path, size: int=4*1024*1024):
+        """
+        :param path: キャプチャファイル. 起動時に作り直す
+        :param size: ファイルの大きさ [byte]. 64byte/レコード
+        """
+        self.path = Path(path)
+        self.n_slots = max(1, (size - HEADER_SIZE) // SLOT_SIZE)
+        self.count = 0
+        self.lock = threading.Lock() # 別グループ/非同期のスレッドからも書かれうる
+
+        with open(self.path, "wb") as f:
+            f.truncate(HEADER_SIZE + self.n_slots*SLOT_SIZE) # 事前に確保しておく
+        self.file = open(self.path, "r+b")
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.start_time = time.perf_counter()
+        struct.pack_into(HEADER_FORMAT, self.mmap, 0, MAGIC, SLOT_SIZE, self.n_slots, 0, time.time())
+
+
+    def record_tx(self, data: bytes) -> None:
+        self.__record(TX, data)
+
+    def record_rx(self, data: bytes) -> None:
+        self.__record(RX, data)
+
+    def close(self) -> None:
+        self.mmap.flush()
+        self.mmap.close()
+        self.file.close()
+
+
+    def __record(self, direction: int, data: bytes) -> None:
+        timestamp = time.perf_counter() - self.start_time
+        continued = RX_CONTINUED if direction == RX else TX_CONTINUED
+        with self.lock:
+            for idx in range(0, max(len(data), 1), SLOT_DATA_SIZE):
+                chunk = data[idx:idx+SLOT_DATA_SIZE]
+                offset = HEADER_SIZE + (self.count % self.n_slots)*SLOT_SIZE
+                struct.pack_into(RECORD_FORMAT, self.mmap, offset, timestamp, direction if idx == 0 else continued, len(chunk))
+                self.mmap[offset+RECORD_HEADER_SIZE:offset+RECORD_HEADER_SIZE+len(chunk)] = chunk
+                self.count += 1
+            struct.pack_into("<Q", self.mmap, COUNT_OFFSET, self.count)
+
+
+def read_capture(path: str|Path) -> list[CaptureRecord]:
+    """
+    キャプチャファイルを古い順のレコードのリストにする
+    スロットに分割された送受信は1つのレコードにまとめ直す. リングで上書きされて途中から始まるレコードは捨てる
+    """
+    with open(path, "rb") as f:
+        buffer = f.read()
+    magic, slot_size, n_slots, count, _ = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Invalid capture file: {path}")
+
+    records: list[CaptureRecord] = []
+    for i in range(max(0, count - n_slots), count):
+        offset = HEADER_SIZE + (i % n_slots)*slot_size
+        timestamp, direction, length = struct.unpack_from(RECORD_FORMAT, buffer, offset)
+        data = buffer[offset+RECORD_HEADER_SIZE:offset+RECORD_HEADER_SIZE+length]
+        if direction in (RX_CONTINUED, TX_CONTINUED):
+            if records and records[-1].direction == direction - 2:
+                records[-1].data += data
+            continue
+        records.append(CaptureRecord(timestamp, direction, data))
+    return records
+
+
+class ReplayUART:
+    """
+    キャプチャを再生するserial.Serial互換のuart. RCS660S(..., uart=ReplayUART(records))で使う
+    RCS660Sが送信する(write)たびに, キャプチャ中の次の送信までの受信データを読めるようにする.
+    is_realtimeなら記録時の間隔で, そうでなければすぐに受信データを出す.
+    fileno()はos.pipeの読み出し側なので, selectやloop.add_readerでも待てる.
+    キャプチャを最後まで再生し終えたら, 実機の切断と同じように以降の送受信でEOFErrorを投げる
+    """
+
+    def __init__(self, records: list[CaptureRecord], is_realtime: bool=False, timeout: float=0.005):
+        """
+        :param records: read_captureの戻り値
+        :param is_realtime: Trueなら記録時の送信→受信の間隔を再現する. Falseなら最速で流す
+        :param timeout: read()で待つ時間の上限 [s] (serial.Serialのtimeoutと同じ)
+        """
+        self.records = records
+        self.is_realtime = is_realtime
+        self.timeout = timeout
+        self.index = 0 # 次に見るレコード
+        self.mismatch_count = 0 # キャプチャと違うフレームが送信された回数
+        self.read_fd, self.write_fd = os.pipe()
+        self.timers: list[threading.Timer] = []
+
+        self.__release_rx(time.perf_counter(), None) # 最初の送信より前に受信していた分
+
+
+    # -------------------------------------- serial.Serial互換 --------------------------------------
+    @property
+    def in_waiting(self) -> int:
+        n_waiting = self.__n_buffered()
+        if n_waiting == 0 and self.is_finished:
+            raise EOFError("end of capture")
+        return n_waiting
+
+    @property
+    def is_finished(self) -> bool:
+        """
+        キャプチャの受信データをすべて出し終えたか
+        """
+        return self.index >= len(self.records) and not any(timer.is_alive() for timer in self.timers)
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def write(self, data: bytes) -> int:
+        """
+        キャプチャの次の送信レコードまで進め, それに続く受信データを出す
+        """
+        while self.index < len(self.records) and self.records[self.index].direction != TX:
+            self.index += 1
+        if self.index >= len(self.records):
+            raise EOFError("end of capture")
+
+        tx_record = self.records[self.index]
+        if tx_record.data != bytes(data):
+            self.mismatch_count += 1
+        self.index += 1
+        self.__release_rx(time.perf_counter(), tx_record.timestamp)
+        return len(data)
+
+    def read(self, size: int=1) -> bytes:
+        out = b""
+        deadline = time.perf_counter() + self.timeout
+        while len(out) < size:
+            remaining = deadline - time.perf_counter()
+            readable, _, _ = select.select([self.read_fd], [], [], max(remaining, 0))
+            if not readable:
+                break
+            out += os.read(self.read_fd, size - len(out))
+        return out
+
+    def reset_input_buffer(self) -> None:
+        n_buffered = self.__n_buffered()
+        if n_buffered > 0:
+            os.read(self.read_fd, n_buffered)
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+    def close(self) -> None:
+        for timer in self.timers:
+            timer.cancel()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+    # -------------------------------------- private methods --------------------------------------
+    def __n_buffered(self) -> int:
+        buffer = bytearray(4)
+        fcntl.ioctl(self.read_fd, termios.FIONREAD, buffer)
+        return int.from_bytes(buffer, 'little')
+
+    def __release_rx(self, now: float, tx_timestamp: float|None) -> None:
+        """
+        次の送信レコードまでの受信レコードをpipeに書く
+        """
+        self.timers = [timer for timer in self.timers if timer.is_alive()]
+        while self.index < len(self.records) and self.records[self.index].direction == RX:
+            record = self.records[self.index]
+            self.index += 1
+            delay = record.timestamp - tx_timestamp if self.is_realtime and tx_timestamp is not None else 0.0
+            if delay <= 0:
+                os.write(self.write_fd, record.data)
+            else:
+                timer = threading.Timer(delay - (time.perf_counter() - now), os.write, (self.write_fd, record.data))
+                timer.start()
+                self.timers.append(timer)
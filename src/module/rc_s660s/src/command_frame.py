@@ -0,0 +1,70 @@
+from .ccid_command.ccid_command_abc import CCIDCommandAbc
+from .response import SEQ_INDEX
+
+
+PREAMBLE = b"\x00"
+START_CODE = b"\x00\xFF"
+POSTAMBLE = b"\x00"
+
+
+def calculate_checksum(bytes_data) -> int:
+    """
+    CCIDコマンドの汎用チェックサム計算
+    (合計との和が256の倍数になる値. 256*ceil(sum/256)-sumと同じ)
+    """
+    return -sum(bytes_data) & 0xFF
+
+
+class CommandFrame:
+    """
+    コンパイル済みのコマンドフレーム
+    送信するbytesと, レスポンスの解釈に使うccid_commandの組を保持する
+    固定のコマンドは一度だけコンパイルして使い回す
+    """
+
+    __slots__ = ("frame", "ccid_command", "seq", "seq_frames")
+
+    def __init__(self, frame: bytes, ccid_command: CCIDCommandAbc, seq: int=0):
+        self.frame = frame
+        self.ccid_command = ccid_command
+        self.seq = seq # コンパイル時のCCIDのb_seq. 送信時はRCS660Sがコマンドごとに振り直す
+        self.seq_frames: dict[int, bytes] = {seq: frame} # b_seq → そのb_seqにしたフレーム
+
+    def with_seq(self, seq: int) -> bytes:
+        """
+        b_seqとパケットデータチェックサムだけを差し替えたフレーム. 一度作ったものは覚えておく
+        """
+        frame = self.seq_frames.get(seq)
+        if frame is None:
+            frame = self.frame
+            checksum = (frame[-2] + self.seq - seq) & 0xFF # b_seqが増えた分だけチェックサムを減らす
+            frame = frame[:SEQ_INDEX] + bytes((seq,)) + frame[SEQ_INDEX+1:-2] + bytes((checksum,)) + frame[-1:]
+            self.seq_frames[seq] = frame
+        return frame
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def __repr__(self) -> str:
+        hexstr = ' '.join(f'{b:02X}' for b in self.frame)
+        return f"CommandFrame({type(self.ccid_command).__name__}: {hexstr})"
+
+
+def compile_command_frame(ccid_command: CCIDCommandAbc, seq: int=0) -> CommandFrame:
+    """
+    ccid_commandからuartで送信するコマンドフレームを作成する
+    :param seq: CCIDのb_seq(0~255). 送信時にRCS660Sが振り直すので, 普通は指定しなくて良い
+    """
+    ccid_command.b_seq = [seq]
+    packet_data = bytes(ccid_command.get_ccid_command())
+    packet_length = len(packet_data).to_bytes(2, 'big')
+    frame = b"".join((
+        PREAMBLE,
+        START_CODE,
+        packet_length,
+        bytes((calculate_checksum(packet_length),)),
+        packet_data,
+        bytes((calculate_checksum(packet_data),)),
+        POSTAMBLE,
+    ))
+    return CommandFrame(frame, ccid_command, seq)
@@ -0,0 +1,133 @@
+from collections import deque
+from enum import Enum
+
+from .command_frame import START_CODE
+
+
+FRAME_START = b"\x00" + START_CODE # プリアンブル + スタートコード
+HEADER_SIZE = 6 # プリアンブル, スタートコード(3バイト) + パケット長(2バイト) + パケット長チェックサム(1バイト)
+ACK_SIZE = 7 # パケット長0のフレーム. ヘッダ + ポストアンブル
+
+
+class FrameParserState(Enum):
+    HUNT="hunt" # スタートコードを探している
+    HEADER="header" # パケット長の受信待ち
+    BODY="body" # パケットデータの受信待ち
+
+
+class FrameParser:
+    """
+    RCS660Sからの受信バイト列を逐次パースするステートマシン
+    受信バッファ(bytearray)を使い回し, 完成したレスポンスフレームを順に取り出せるようにする.
+
+    スタートコード(00 00 FF)を探し, ACK・パケット長チェックサム・パケットデータチェックサムを検証する.
+    不正なバイトやチェックサム異常があれば1バイト読み捨てて次のスタートコードを探し直す(resync).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = FrameParserState.HUNT
+        self.packet_length = 0
+        self.is_synced = True # Falseの間に読み捨てたバイトは1回のresyncとして数える
+        self.frames: deque[bytes] = deque()
+
+        self.ack_count = 0 # 受信したACKの数
+        self.resync_count = 0 # スタートコードを探し直した回数
+        self.corruption_count = 0 # チェックサムなどが不正だったフレームの数
+
+
+    # -------------------------------------- public methods --------------------------------------
+    def feed(self, data: bytes) -> None:
+        """
+        受信したバイト列を追加してパースする
+        """
+        self.buffer += data
+        self.__parse()
+
+    def pop_frame(self) -> bytes|None:
+        """
+        完成したレスポンスフレーム(プリアンブル~ポストアンブル)を古い順に取り出す. 無ければNone
+        """
+        if self.frames:
+            return self.frames.popleft()
+        return None
+
+    def reset(self) -> None:
+        """
+        受信途中のバイト列と, 取り出されていないフレームを捨てる
+        """
+        self.buffer.clear()
+        self.frames.clear()
+        self.state = FrameParserState.HUNT
+        self.is_synced = True
+
+
+    # -------------------------------------- private methods --------------------------------------
+    def __parse(self) -> None:
+        buffer = self.buffer
+        while True:
+            if self.state == FrameParserState.HUNT:
+                idx = buffer.find(FRAME_START)
+                if idx == -1:
+                    # スタートコードの途中かもしれない末尾2バイトだけ残す
+                    n_discard = len(buffer) - (len(FRAME_START) - 1)
+                    if n_discard > 0:
+                        del buffer[:n_discard]
+                        self.__lose_sync()
+                    return
+                if idx > 0:
+                    del buffer[:idx]
+                    self.__lose_sync()
+                self.is_synced = True
+                self.state = FrameParserState.HEADER
+
+            elif self.state == FrameParserState.HEADER:
+                if len(buffer) < HEADER_SIZE:
+                    return
+                self.packet_length = (buffer[3] << 8) | buffer[4]
+
+                if self.packet_length == 0:
+                    # ACK: 00 00 FF 00 00 XX 00
+                    if len(buffer) < ACK_SIZE:
+                        return
+                    if buffer[ACK_SIZE-1] != 0x00:
+                        self.__drop_corrupted()
+                        continue
+                    del buffer[:ACK_SIZE]
+                    self.ack_count += 1
+                    self.state = FrameParserState.HUNT
+                    continue
+
+                if (buffer[3] + buffer[4] + buffer[5]) & 0xFF != 0:
+                    # パケット長チェックサム異常
+                    self.__drop_corrupted()
+                    continue
+                self.state = FrameParserState.BODY
+
+            elif self.state == FrameParserState.BODY:
+                frame_size = HEADER_SIZE + self.packet_length + 2 # + パケットデータチェックサム, ポストアンブル
+                if len(buffer) < frame_size:
+                    return
+                data_end = HEADER_SIZE + self.packet_length
+                is_valid_checksum = (sum(buffer[HEADER_SIZE:data_end]) + buffer[data_end]) & 0xFF == 0
+                if not is_valid_checksum or buffer[data_end+1] != 0x00:
+                    self.__drop_corrupted()
+                    continue
+                self.frames.append(bytes(buffer[:frame_size]))
+                del buffer[:frame_size]
+                self.state = FrameParserState.HUNT
+
+
+    def __drop_corrupted(self) -> None:
+        """
+        不正なフレームの先頭1バイトを捨ててスタートコードを探し直す
+        """
+        del self.buffer[:1]
+        self.corruption_count += 1
+        self.__lose_sync()
+        self.state = FrameParserState.HUNT
+
+    def __lose_sync(self) -> None:
+        if self.is_synced:
+            self.resync_count += 1
+        self.is_synced = False
@@ -1,6 +1,8 @@
 import time
 
 from ..rcs660s import RCS660S
+from ..async_rcs660s import AsyncRCS660S
+from ..command_frame import compile_command_frame
 
 from ..ccid_command.reset_device import ResetDevice
 from ..ccid_command.manage_session import ManageSession, ManageSessionDataObjectTag
@@ -15,11 +17,37 @@ class RCS660SManager:
     一連のコマンドを実行し, 使用者にバイト列の通信を意識させない.
     """
 
-    def __init__(self,rcs660s:RCS660S,is_debug:bool=False):
+    def __init__(
+        self,rcs660s:RCS660S,is_debug:bool=False,is_pipelined:bool=False,is_persistent_session:bool=False
+    ):
+        """
+        :param is_pipelined: (実験的) Trueならpollingの一連のコマンドをACKごとに続けて送信し, レスポンスをまとめて受け取る.
+            リーダはコマンドを1つずつ処理するので, 省けるのはホストの折り返しだけ (シミュレータでは速くならなかった)
+        :param is_persistent_session: Trueならtransparent sessionをチャンネルごとに開いたままにし, 
+            セッションが有効な間はSTART/SWITCH_PROTOCOL/ENDを省略する
+        """
         self.rcs660s = rcs660s
+        self.async_rcs660s = AsyncRCS660S(rcs660s) # poll()用. イベントループで使うまでfdは登録しない
         self.is_debug = is_debug
+        self.is_pipelined = is_pipelined
+        self.is_persistent_session = is_persistent_session
         self.is_setup=False
 
+        # transparent sessionが開いたままのチャンネル名
+        # (MUXの先のリーダはチャンネルごとに別なので, セッション状態もチャンネルごとに持つ)
+        self.session_channels:set[str]=set()
+
+        # 固定のコマンドフレームは一度だけコンパイルしておく (b_seqは送信時にRCS660Sが振る)
+        self.start_transparent_session_frame=compile_command_frame(
+            ManageSession(data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION)
+        )
+        self.end_session_frame=compile_command_frame(
+            ManageSession(
+                # 同じ manage sessionなので, いっぺんにコマンドを送信する
+                data_object_tag=ManageSessionDataObjectTag.RF_OFF+ManageSessionDataObjectTag.END_TRANSPARENT_SESSION
+            )
+        )
+
 
     def reset_device(self):
         if self.is_debug: print("RESET DEVICE")
@@ -28,7 +56,9 @@ class RCS660SManager:
         )
         self.rcs660s.send_command_frame()
         time.sleep(50/1000) #response返るまでちょっと待つ
-        self.rcs660s.uart.read(128)
+        self.rcs660s.read_raw(128)
+        self.rcs660s.frame_parser.reset() # 読み捨てた分, パーサの途中状態も捨てる
+        self.invalidate_session() # どのチャンネルのリーダがresetされたかは分からないので全部やり直す
 
     
     def setup_device(self):
@@ -61,12 +91,8 @@ class RCS660SManager:
 
 
         # 1) Start Transparent Session
-        self.rcs660s.create_command_frame(
-            ccid_command=ManageSession(
-                data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION
-            ), is_debug=self.is_debug
-        )
-        self.rcs660s.send_command_frame()
+        if self.is_debug: print(self.start_transparent_session_frame)
+        self.rcs660s.send_frame(self.start_transparent_session_frame)
 
         response = self.rcs660s.read_response(is_debug=False) # readしとかないと, 次のコマンドで前コマンドの結果が返ってきちゃう
         if self.is_debug: self.debug_response(response)
@@ -81,14 +107,10 @@ class RCS660SManager:
         """
         t0 = time.perf_counter()
 
-        self.rcs660s.create_command_frame(
-            ccid_command=ManageSession(
-                data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION
-            )
-        )
+        command_frame=self.start_transparent_session_frame
         t1 = time.perf_counter()
 
-        self.rcs660s.send_command_frame()
+        self.rcs660s.send_frame(command_frame)
         t2 = time.perf_counter()
 
         response = self.rcs660s.read_response(is_debug=False)
@@ -101,26 +123,35 @@ class RCS660SManager:
             f"total={(t3-t0)*1e3:.2f} ms"
         )
 
-    def polling(self) -> dict:
+    def invalidate_session(self, channel_name:str|None=None) -> None:
+        """
+        開いたままのセッションを無効にし, 次のpollingで一連のコマンドからやり直させる
+        :param channel_name: Noneなら全チャンネル
+        """
+        if channel_name is None:
+            self.session_channels.clear()
+        else:
+            self.session_channels.discard(channel_name)
+
+    def polling(self, channel_name:str|None=None) -> dict:
         """
         読み取りループ
+        :param channel_name: MUXのチャンネル名. is_persistent_sessionのとき, セッション状態の管理に使う
         """
         return NotImplementedError("polling is not implemented")
 
+    async def poll(self, channel_name:str|None=None) -> dict:
+        """
+        polling()のasyncio版. レスポンス待ちの間はイベントループを止めない
+        :param channel_name: MUXのチャンネル名
+        """
+        raise NotImplementedError("poll is not implemented")
+
     def end_session(self) -> None:
         if self.is_debug: print("RF OFF/ END TRANSPARENT SESSION")
+        if self.is_debug: print(self.end_session_frame)
 
-
-        # 同じ manage sessionなので, いっぺんにコマンドを送信する
-        rf_off=ManageSessionDataObjectTag.RF_OFF
-        end_transparent_session=ManageSessionDataObjectTag.END_TRANSPARENT_SESSION
-
-        self.rcs660s.create_command_frame(
-            ccid_command=ManageSession(
-                data_object_tag=rf_off+end_transparent_session
-            ), is_debug=self.is_debug
-        )
-        self.rcs660s.send_command_frame()
+        self.rcs660s.send_frame(self.end_session_frame)
         response = self.rcs660s.read_response(is_debug=False)
         if self.is_debug: self.debug_response(response)
         # self.rcs660s.flush_buffer()
@@ -0,0 +1,159 @@
+from collections import Counter, OrderedDict
+from enum import Enum
+
+from .rcs660s_manager_base import RCS660SManager
+from .rcs660s_manager_typeA_14443_3A import RCS660SManagerTypeA144433A
+from ..rcs660s_manager import RCS660SManager as RCS660SManagerFelica
+from ..rcs660s import RCS660S
+
+
+MAX_UID_TECHNOLOGIES=1024 # 技術を覚えておくUIDの数. 古く読んだものから忘れる
+
+
+class TagTechnology(Enum):
+    FELICA="Felica"
+    TYPEA_14443_3A="TypeA_14443-3A"
+
+
+class RCS660SManagerMixed(RCS660SManager):
+    """
+    TypeA(14443-3A)とFeliCaのカードが混在するテーブル用のクラス
+    チャンネルごとに, 最後に読んだカード(UID)が応答した技術から先に試し, 読めなければもう一方を試す.
+    応答した技術はチャンネルごと/UIDごとに覚えておく. UIDは最近読んだmax_uid_technologies個だけ覚える.
+    conf.yamlでチャンネルごとに技術を固定することもできる(固定したチャンネルはもう一方を試さない)
+
+    FeliCaはTypeAのSWITCH_PROTOCOLの後でも読めるよう, SWITCH_TO_FELICA_POLLING(is_fast_polling)で読む
+    """
+
+    def __init__(
+        self,rcs660s:RCS660S,is_debug:bool=False,is_pipelined:bool=False,is_persistent_session:bool=False,
+        channel_overrides:dict[str,str]|None=None, max_uid_technologies:int=MAX_UID_TECHNOLOGIES
+    ):
+        """
+        :param channel_overrides: {ch_name: TagTechnologyの値}. 技術を固定するチャンネル
+        :param max_uid_technologies: 技術を覚えておくUIDの数
+        """
+        self.typeA_manager=RCS660SManagerTypeA144433A(rcs660s,is_debug,is_pipelined,is_persistent_session)
+        self.felica_manager=RCS660SManagerFelica(
+            rcs660s,is_debug,is_pipelined,is_persistent_session,is_fast_polling=True
+        )
+        self.managers={
+            TagTechnology.TYPEA_14443_3A:self.typeA_manager,
+            TagTechnology.FELICA:self.felica_manager,
+        }
+        super().__init__(rcs660s,is_debug,is_pipelined,is_persistent_session)
+        for manager in self.managers.values():
+            manager.async_rcs660s=self.async_rcs660s # 同じfdを2つのtransportでadd_readerしないよう共有する
+
+        self.channel_overrides={
+            ch_name:TagTechnology(technology) for ch_name, technology in (channel_overrides or {}).items()
+        }
+        self.channel_technology:dict[str,TagTechnology]={} # チャンネルごとに最後に応答した技術
+        self.channel_uid:dict[str,str]={} # チャンネルごとに最後に読んだUID(16進数表記の文字列)
+        self.max_uid_technologies=max_uid_technologies
+        self.uid_technology:OrderedDict[str,TagTechnology]=OrderedDict() # UIDごとに応答した技術. 最近読んだものが末尾
+        self.technology_counts:Counter[TagTechnology]=Counter() # uid_technologyの技術ごとのUIDの数
+
+
+    def setup_device(self)->None:
+        """
+        FeliCaの通信設定(送受信フラグ, 通信速度, RF ON)をしておく. TypeAは特に設定することはない
+        """
+        self.reset_device()
+        self.felica_manager.setup_device()
+        self.is_setup=True
+
+
+    def invalidate_session(self, channel_name:str|None=None) -> None:
+        super().invalidate_session(channel_name)
+        for manager in self.managers.values():
+            manager.invalidate_session(channel_name)
+
+
+    def polling(self, channel_name:str|None=None) -> dict:
+        """
+        :param channel_name: MUXのチャンネル名. 技術の記憶とoverrideに使う
+        :return {"id":id, "technology":技術名, ...(各managerの戻り値)}, カードが無いときはid/technologyがNoneになる
+        """
+        response={"id":None}
+        technology=None
+        for technology in self.__probe_order(channel_name):
+            response=self.managers[technology].polling(channel_name)
+            if response["id"] is not None: break
+            # 読めなかった技術のセッションは, 次に試す技術のSWITCH_PROTOCOLと混ざらないよう捨てておく
+            self.managers[technology].invalidate_session(channel_name)
+        else:
+            technology=None
+
+        return self.__record_technology(channel_name, technology, response)
+
+
+    async def poll(self, channel_name:str|None=None) -> dict:
+        """
+        polling()のasyncio版. 技術の順番と記憶はpolling()と同じ
+        """
+        response={"id":None}
+        technology=None
+        for technology in self.__probe_order(channel_name):
+            response=await self.managers[technology].poll(channel_name)
+            if response["id"] is not None: break
+        else:
+            technology=None
+
+        return self.__record_technology(channel_name, technology, response)
+
+
+    def get_technology(self, id_hex:list[str]) -> TagTechnology|None:
+        """
+        このUIDのカードが応答した技術. まだ読んだことが無ければNone
+        """
+        return self.uid_technology.get("".join(id_hex))
+
+
+    def __record_technology(self, channel_name:str|None, technology:TagTechnology|None, response:dict) -> dict:
+        """
+        応答した技術をチャンネル/UIDごとに覚え, responseにtechnologyを付けて返す
+        """
+        if technology is not None:
+            uid="".join(response["id"])
+            if channel_name is not None:
+                self.channel_technology[channel_name]=technology
+                self.channel_uid[channel_name]=uid
+            self.__remember_uid(uid, technology)
+
+        response["technology"]=technology.value if technology is not None else None
+        return response
+
+
+    def __remember_uid(self, uid:str, technology:TagTechnology) -> None:
+        """
+        UIDの技術を覚える. 覚えきれないときは一番古く読んだUIDを忘れる
+        """
+        previous=self.uid_technology.pop(uid, None)
+        if previous is not None: self.technology_counts[previous]-=1
+        self.uid_technology[uid]=technology
+        self.technology_counts[technology]+=1
+        while len(self.uid_technology)>self.max_uid_technologies:
+            _, forgotten=self.uid_technology.popitem(last=False)
+            self.technology_counts[forgotten]-=1
+
+
+    def __probe_order(self, channel_name:str|None) -> list[TagTechnology]:
+        """
+        試す技術の順番.
+        1. overrideがあればその技術だけ
+        2. チャンネルで最後に読んだUIDの技術を覚えていれば, それを先に (カードは置いたままのことが多い)
+        3. UIDを忘れていれば, チャンネルで最後に応答した技術を先に
+        4. まだ何も読めていないチャンネルは, これまで読んだカードに多い技術を先に
+        """
+        if channel_name in self.channel_overrides:
+            return [self.channel_overrides[channel_name]]
+
+        first=self.uid_technology.get(self.channel_uid.get(channel_name))
+        if first is None:
+            first=self.channel_technology.get(channel_name)
+        if first is None and len(self.uid_technology)>0:
+            first=max(self.managers, key=lambda technology: self.technology_counts[technology])
+        if first is None:
+            return list(self.managers)
+        return [first]+[technology for technology in self.managers if technology!=first]
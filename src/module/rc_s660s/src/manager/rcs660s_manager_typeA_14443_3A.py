@@ -1,6 +1,9 @@
 from .rcs660s_manager_base import RCS660SManager
 
 from ..rcs660s import RCS660S
+from ..command_frame import compile_command_frame
+from ..metrics import RETRIES
+from ..response import RCS660SResponse
 from ..ccid_command.transparent_exchange import TransparentExchange, TransparentExchangeDataObjectTag
 from ..ccid_command.switch_protocol import SwitchProtocol, SwitchProtocolDataObjectTag
 
@@ -12,8 +15,17 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
     (TypeAでも, 14443-4Aの場合はまた別のクラスが必要)
     """
 
-    def __init__(self,rcs660s:RCS660S,is_debug:bool=False):
-        super().__init__(rcs660s,is_debug)
+    def __init__(
+        self,rcs660s:RCS660S,is_debug:bool=False,is_pipelined:bool=False,is_persistent_session:bool=False
+    ):
+        super().__init__(rcs660s,is_debug,is_pipelined,is_persistent_session)
+
+        self.switch_protocol_frame=compile_command_frame(
+            SwitchProtocol(data_object_tag=SwitchProtocolDataObjectTag.SWITCH_TO_TYPEA_LAYER3)
+        )
+        self.transceive_frame=compile_command_frame(
+            TransparentExchange(data_object_tag=self.__create_transceive_data_object())
+        )
 
 
     def setup_device(self)->None:
@@ -26,10 +38,11 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
         self.is_setup=True
 
 
-    def polling(self) -> dict:
+    def polling(self, channel_name:str|None=None) -> dict:
         """
         直列度1で17Hzが限度. 6port直列では2~3Hz程度が限度. まあ十分でしょ.
 
+        :param channel_name: MUXのチャンネル名. is_persistent_sessionのとき, セッション状態の管理に使う
         :return {"id":id}, カードが無いときはNoneになる
             id:16進数表記のリスト. ISO 14443-3AのUID
         """
@@ -37,6 +50,12 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
         # パフォーマンス測定用関数
         # return self.__polling_performance_check()
 
+        if self.is_persistent_session and channel_name is not None:
+            return self.__polling_persistent(channel_name)
+
+        if self.is_pipelined:
+            return self.__polling_pipelined()
+
         self.start_transparent_session() 
         self.__switch_protocol()
 
@@ -48,24 +67,91 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
         response=self.__transceive()   
         self.end_session()
 
-        response={"id":self.__extract_uid(response["apdu"]["response"])}
+        response={"id":self.__extract_uid(response)}
 
         return response
         
     
 
+    async def poll(self, channel_name:str|None=None) -> dict:
+        """
+        polling()のasyncio版. レスポンス待ちの間はイベントループを止めない
+        is_persistent_sessionは使わず, 毎回START~ENDの一連のコマンドを送る
+
+        :return {"id":id}, カードが無いときはNoneになる
+        """
+        transport=self.async_rcs660s
+        if self.is_pipelined:
+            responses=await transport.transceive_batch([
+                self.start_transparent_session_frame,
+                self.switch_protocol_frame,
+                self.transceive_frame,
+                self.end_session_frame,
+            ])
+            return {"id":self.__extract_uid(responses[2])}
+
+        await transport.transceive(self.start_transparent_session_frame)
+        await transport.transceive(self.switch_protocol_frame)
+        uid=self.__extract_uid(await transport.transceive(self.transceive_frame))
+        await transport.transceive(self.end_session_frame)
+
+        return {"id":uid}
+
+
+    def __polling_persistent(self, channel_name:str) -> dict:
+        """
+        セッションが開いたままのチャンネルはTRANSCEIVEだけを送る.
+        UIDが読めなければ(カードが外れた/入れ替わった, セッションが切れた), 一連のコマンドでやり直す.
+        カードが無いときはセッションを閉じておき, 次回は最初から一連のコマンドを送る.
+        """
+        if channel_name in self.session_channels:
+            uid=self.__extract_uid(self.__transceive())
+            if uid is not None:
+                return {"id":uid}
+            self.end_session() # リーダ側のセッションも閉じる. 開いたままSTARTすると69 8A(重複セッション)になる
+            self.invalidate_session(channel_name)
+            self.rcs660s.metrics.count(RETRIES) # 一連のコマンドで読み直す
+
+        if self.is_pipelined:
+            response=self.rcs660s.transceive_batch([
+                self.start_transparent_session_frame,
+                self.switch_protocol_frame,
+                self.transceive_frame,
+            ])[-1]
+        else:
+            self.start_transparent_session()
+            self.__switch_protocol()
+            response=self.__transceive()
+
+        uid=self.__extract_uid(response)
+        if uid is None:
+            self.end_session()
+        else:
+            self.session_channels.add(channel_name)
+
+        return {"id":uid}
+    
+
+    def __polling_pipelined(self) -> dict:
+        """
+        START/SWITCH_PROTOCOL/TRANSCEIVE/ENDを, 各コマンドのACKを待つだけで続けて送信する
+        """
+        responses=self.rcs660s.transceive_batch([
+            self.start_transparent_session_frame,
+            self.switch_protocol_frame,
+            self.transceive_frame,
+            self.end_session_frame,
+        ])
+        if self.is_debug:
+            for response in responses: self.debug_response(response)
+
+        return {"id":self.__extract_uid(responses[2])}
+    
+
     def __switch_protocol(self)->None:
         if self.is_debug: print("switch protocol")
 
-
-        self.rcs660s.create_command_frame(
-            ccid_command=SwitchProtocol(
-                data_object_tag=(
-                    SwitchProtocolDataObjectTag.SWITCH_TO_TYPEA_LAYER3
-                )
-            ), is_debug=False
-        )
-        self.rcs660s.send_command_frame()
+        self.rcs660s.send_frame(self.switch_protocol_frame)
 
         response = self.rcs660s.read_response(is_debug=False)
 
@@ -75,9 +161,23 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
         if self.is_debug: self.debug_response(response)
 
 
-    def __transceive(self)->dict:
+    def __transceive(self)->RCS660SResponse:
         if self.is_debug: print("transceive")
 
+        # --- I/O ---
+        self.rcs660s.send_frame(self.transceive_frame)
+        # response=self.rcs660s.uart.read(128)
+        response = self.rcs660s.read_response(is_debug=False) # Trueだとloop問い合わせの中身をprintする
+
+        if self.is_debug: self.debug_response(response)
+
+        return response
+
+    def __create_transceive_data_object(self)->list[int]:
+        """
+        TIMER + TRANSCEIVE(READ page0)のデータオブジェクトを作成する
+        固定値なので, 初期化時に一度だけフレームにコンパイルする
+        """
 
         # --- 通信速度設定 ---
         # speed_ccid=[]#[0x05, 0x01, 0b10011011] # 通信速度設定 848bps (最速)
@@ -90,37 +190,20 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
         # --- SELECTコマンド ---
         polling_command=[0x30, 0x00] # ISO 14443-3AのSELECTコマンド(0x30), 0x00でページバイト指定, UIDは0x00ページにある
         polling_ccid=TransparentExchangeDataObjectTag.TRANSCEIVE(polling_command)
-        
-        # --- コマンドフレーム作成 ---
-        self.rcs660s.create_command_frame(
-            ccid_command=TransparentExchange(
-                data_object_tag=timer_ccid + polling_ccid
-            ), is_debug=self.is_debug
-        )
-
-        # --- I/O ---
-        self.rcs660s.send_command_frame()
-        # response=self.rcs660s.uart.read(128)
-        response = self.rcs660s.read_response(is_debug=False) # Trueだとloop問い合わせの中身をprintする
 
-        if self.is_debug: self.debug_response(response)
+        return timer_ccid + polling_ccid
 
-        return response
-
-    def __extract_uid(self, resp: bytes) -> list[int]:
+    def __extract_uid(self, response: RCS660SResponse) -> list[str]|None:
         """
-        resp: Transparent Exchange のレスポンスを想定。
+        response: Transparent Exchange のレスポンスを想定。
             ... 92 01 00 96 02 00 00 97 10 <16-byte page0/1/2/3> 90 00
         戻り値: UID を 16進数表記 リスト（7バイト）で返す。
         見つからない場合はNoneを返す。
         """
-        marker = b"\x97\x10"  # ICC Response + length=0x10 (READ 0x30 0x00 の16B)
-        idx = resp.find(marker)
-        if idx == -1 or idx + 2 + 16 > len(resp):
+        data = response.find_data_object(0x97) # ICC Response (READ 0x30 0x00 の16B)
+        if data is None or len(data) < 16:
             return None
 
-        data = resp[idx + 2 : idx + 2 + 16]
-
         # Type2 page0 layoutに従い UID 抜き出し (UID0-2, UID3-6)
         index_list=[0, 1, 2, 4, 5, 6, 7]
         # uid_bytes = [data[0], data[1], data[2], data[4], data[5], data[6], data[7]]
@@ -152,6 +235,6 @@ class RCS660SManagerTypeA144433A(RCS660SManager):
                 f"total: {(t3-t0)*1e3:.2f} ms"
             )
 
-        response = {"id": self.__extract_uid(response["apdu"]["response"])}
+        response = {"id": self.__extract_uid(response)}
         return response
 
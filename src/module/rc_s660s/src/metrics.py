@@ -0,0 +1,141 @@
+"""
+RCS660Sの送受信の計測
+コマンドの種類とMUXのチャンネルごとに, build/send/wait/parseの時間を固定バケットのヒストグラムに数え,
+タイムアウト/resync/成功以外のステータス/リトライなどの回数を数える.
+
+書き込むのはRCS660Sを使うスレッド(ReaderGroupのスレッド)だけなので, 計測の経路にロックは無い.
+snapshot()は別スレッドから呼んで良い. dict/listのコピーはGILの下で1回の操作なので壊れないが,
+同時に数えていた1回分がヒストグラムの合計とずれることはある
+"""
+import time
+from bisect import bisect_left
+
+
+# ヒストグラムのバケットの上限 [s]. 最後はそれより大きいもの全部
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.0002, 0.0005,
+    0.001, 0.002, 0.005,
+    0.01, 0.02, 0.05,
+    0.1, 0.2, float("inf"),
+)
+
+# 計測する区間
+BUILD = "build" # コマンドフレームの組み立て
+SEND = "send" # uartへの書き込み
+WAIT = "wait" # 送信してからレスポンスフレームが揃うまで (parseを除く)
+PARSE = "parse" # 受信バイト列のパースとステータスの確認
+
+# 数える回数
+TIMEOUTS = "timeouts" # コマンドの期限切れ (RCS660STimeoutError)
+RESYNCS = "resyncs" # スタートコードを探し直した回数
+CORRUPTIONS = "corruptions" # チェックサムなどが不正だったフレーム
+NON_SUCCESS = "non_success" # apduのステータスが成功(90 00)以外だったレスポンス
+RETRIES = "retries" # 読めなかったのでコマンドを送り直した回数
+RECOVERIES = "recoveries" # 応答しないチャンネルの復旧を試みた回数
+STALE_FRAMES = "stale_frames" # 送信したコマンドとb_seqが合わずに捨てたレスポンス (期限切れのコマンドの遅れた応答など)
+
+
+class LatencyHistogram:
+    """
+    固定バケットのヒストグラム
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0]*len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def to_dict(self) -> dict:
+        count = self.count
+        return {
+            "count": count,
+            "mean": self.total/count if count > 0 else 0.0,
+            "max": self.max,
+            "buckets": list(self.counts),
+        }
+
+
+class RCS660SMetrics:
+    """
+    1台のRCS660Sの計測値
+    channelはReaderGroup.switch_channelで切り替わり, 以降の計測はそのチャンネルの値として数える
+    """
+
+    def __init__(self):
+        self.channel: str|None = None
+        self.histograms: dict[tuple[str, str, str|None], LatencyHistogram] = {} # (区間, コマンド名, チャンネル名)
+        self.counters: dict[tuple[str, str|None], int] = {} # (名前, チャンネル名)
+        self.start_time = time.perf_counter()
+
+
+    def observe(self, stage: str, command: str, seconds: float) -> None:
+        key = (stage, command, self.channel)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def count(self, name: str, n: int=1) -> None:
+        key = (name, self.channel)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def snapshot(self) -> dict:
+        """
+        :return {
+            "elapsed": 計測開始からの時間[s],
+            "buckets": LATENCY_BUCKETS,
+            "latency": {チャンネル名: {コマンド名: {区間: {"count", "mean", "max", "buckets"}}}},
+            "counters": {チャンネル名: {名前: 回数}},
+        }
+        チャンネルを切り替える前(MUXなし)の値はチャンネル名Noneにまとまる
+        """
+        latency: dict = {}
+        for (stage, command, channel), histogram in dict(self.histograms).items():
+            latency.setdefault(channel, {}).setdefault(command, {})[stage] = histogram.to_dict()
+        counters: dict = {}
+        for (name, channel), n in dict(self.counters).items():
+            counters.setdefault(channel, {})[name] = n
+        return {
+            "elapsed": time.perf_counter() - self.start_time,
+            "buckets": LATENCY_BUCKETS,
+            "latency": latency,
+            "counters": counters,
+        }
+
+    def reset(self) -> None:
+        """
+        計測値を捨てる. 入れ替えるだけなので, 書き込み中のスレッドがあっても壊れない
+        """
+        self.histograms = {}
+        self.counters = {}
+        self.start_time = time.perf_counter()
+
+
+def summarize(snapshot: dict) -> str:
+    """
+    snapshot()を1チャンネル1行の文字列にする
+    ex) ch0: ManageSession wait 10.8ms parse 0.03ms (n=40) | ... | non_success=12
+    """
+    lines = []
+    channels = list(snapshot["latency"]) + [ch for ch in snapshot["counters"] if ch not in snapshot["latency"]]
+    for channel in channels:
+        items = []
+        for command, stages in snapshot["latency"].get(channel, {}).items():
+            if WAIT not in stages: continue
+            items.append(
+                f"{command} wait {stages[WAIT]['mean']*1e3:.1f}ms parse {stages[PARSE]['mean']*1e3:.2f}ms (n={stages[WAIT]['count']})"
+            )
+        counters = snapshot["counters"].get(channel, {})
+        if counters:
+            items.append(" ".join(f"{name}={n}" for name, n in sorted(counters.items())))
+        lines.append(f"{channel}: " + " | ".join(items))
+    return "\n".join(lines)
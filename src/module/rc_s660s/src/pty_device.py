@@ -0,0 +1,121 @@
+"""
+RCS660Sの代わりにptyで応答する疑似デバイス (実機なしでの動作確認用)
+"""
+import os
+import pty
+import select
+import threading
+import tty
+from collections.abc import Callable
+
+from .command_frame import PREAMBLE, START_CODE, POSTAMBLE, calculate_checksum
+from .frame_parser import FrameParser
+
+
+ACK_FRAME = bytes([0x00, 0x00, 0xFF, 0x00, 0x00, 0x00, 0x00])
+RDR_TO_PC_ESCAPE = 0x83 # PC_to_RDR_Escape(0x6B)へのレスポンス
+SUCCESS_APDU_RESPONSE = bytes([0xC0, 0x03, 0x00, 0x90, 0x00, 0x90, 0x00])
+
+COMMAND_SEQ_INDEX = 12 # コマンドフレームのb_seqの位置 (レスポンスと同じ)
+COMMAND_APDU_INDEX = 16 # コマンドフレームのapdu(CLA INS P1 P2 Lc ...)の位置
+
+
+def build_response_frame(seq: int, apdu_response: bytes) -> bytes:
+    """
+    apduレスポンス(... SW1 SW2)をRDR_to_PC_Escapeのレスポンスフレームにする
+    """
+    packet_data = (
+        bytes([RDR_TO_PC_ESCAPE])
+        + len(apdu_response).to_bytes(4, 'little')
+        + bytes([0x00, seq, 0x00, 0x00, 0x00]) # bSlot, bSeq, bStatus, bError, bRFU
+        + apdu_response
+    )
+    packet_length = len(packet_data).to_bytes(2, 'big')
+    return b"".join((
+        PREAMBLE,
+        START_CODE,
+        packet_length,
+        bytes((calculate_checksum(packet_length),)),
+        packet_data,
+        bytes((calculate_checksum(packet_data),)),
+        POSTAMBLE,
+    ))
+
+
+class PtyRCS660S:
+    """
+    ptyの片側をRCS660Sのように振る舞わせる
+    コマンドフレームを受け取るとACKを返し, 続けてb_seqを合わせたレスポンスフレームを返す.
+    portをRCS660S(port=...)に渡せば, 実機と同じようにserial経由で通信できる
+
+    apduレスポンスはresponse_handler(コマンドのapdu)で差し替えられる. デフォルトは常に成功(C0 03 00 90 00 90 00)
+    """
+
+    def __init__(self, response_handler: Callable[[bytes], bytes]|None=None):
+        """
+        :param response_handler: コマンドのapdu(CLA INS P1 P2 Lc Data Le)を受け取り, apduレスポンスを返す関数
+        """
+        self.response_handler = response_handler or (lambda apdu: SUCCESS_APDU_RESPONSE)
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd) # エコーや改行変換をさせない
+        self.port = os.ttyname(self.slave_fd)
+
+        self.frame_parser = FrameParser()
+        self.command_count = 0
+        self.is_running = False
+        self.thread: threading.Thread|None = None
+
+
+    def start(self) -> "PtyRCS660S":
+        self.is_running = True
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def __enter__(self) -> "PtyRCS660S":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+    def handle_command(self, frame: bytes) -> bytes:
+        """
+        コマンドフレーム1つに対して返すバイト列 (ACK + レスポンスフレーム)
+        """
+        self.command_count += 1
+        seq = frame[COMMAND_SEQ_INDEX]
+        apdu_response = self.response_handler(frame[COMMAND_APDU_INDEX:-2])
+        return ACK_FRAME + build_response_frame(seq, apdu_response)
+
+    def respond(self, frame: bytes) -> None:
+        """
+        コマンドフレーム1つに応答する. 遅延などを入れる場合はoverrideする
+        """
+        self.write(self.handle_command(frame))
+
+    def write(self, data: bytes) -> None:
+        os.write(self.master_fd, data)
+
+    def __run(self) -> None:
+        while self.is_running:
+            readable, _, _ = select.select([self.master_fd], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master_fd, 1024)
+            except OSError:
+                return
+            self.frame_parser.feed(data)
+            frame = self.frame_parser.pop_frame()
+            while frame is not None:
+                self.respond(frame)
+                frame = self.frame_parser.pop_frame()
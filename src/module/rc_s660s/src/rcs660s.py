@@ -1,9 +1,28 @@
-from math import ceil
+import select
 import serial
 import time
 
+from .capture import UARTCapture
 from .ccid_command.ccid_command_abc import CCIDCommandAbc
-from .utils import print_hex, extract_bytes
+from .ccid_command.get_firmware_version import GetFirmwareVersion
+from .command_frame import CommandFrame, compile_command_frame
+from .frame_parser import FrameParser
+from .metrics import (
+    RCS660SMetrics, BUILD, SEND, WAIT, PARSE, TIMEOUTS, RESYNCS, CORRUPTIONS, NON_SUCCESS, STALE_FRAMES
+)
+from .response import RCS660SResponse, SUCCESS, APDU_RESPONSE_INDEX, SEQ_INDEX
+from .utils import print_hex
+
+
+PIPELINED = "Pipelined" # transceive_batchの計測値のコマンド名
+DEFAULT_COMMAND_TIMEOUT = 0.2 # [s] 1コマンドのレスポンス待ちの上限. 一番遅いSWITCH_PROTOCOLでも35ms程度
+
+
+class RCS660STimeoutError(TimeoutError):
+    """
+    コマンドのレスポンスが期限までに返らなかった (ケーブルの抜け, リーダの電源断など)
+    """
+
 
 class RCS660S:
     """
@@ -11,36 +30,41 @@ class RCS660S:
     これをuartで送信する
     """
 
-    def __init__(self, port: str, baudrate: int, timeout_fps: int):
-        self.uart = self.__set_uart(port, baudrate, timeout_fps)
+    def __init__(
+        self, port: str, baudrate: int, timeout_fps: int, uart=None, capture: UARTCapture|None=None,
+        command_timeout: float=DEFAULT_COMMAND_TIMEOUT
+    ):
+        """
+        :param command_timeout: 送信してからレスポンスが返るまでの上限 [s]. 超えたらRCS660STimeoutError
+        :param uart: serial.Serialの代わりに使うuart (ReplayUARTなど). 指定したらport/baudrateは使わない
+        :param capture: 指定すると送受信したバイト列をすべて記録する
+        """
+        self.uart = uart if uart is not None else self.__set_uart(port, baudrate, timeout_fps)
+        self.frame_parser = FrameParser() # 受信バイト列のパーサ. resync/破損の回数もここで数える
+        self.capture = capture
+        self.command_timeout = command_timeout
+        self.deadline = 0.0 # 最後に送信したコマンドのレスポンスの期限 (time.perf_counter)
+        self.seq = 0 # 次に送信するコマンドのb_seq. 送信ごとに1つずつ進め, レスポンスとの対応付けに使う
+        self.sent_seq = 0 # 最後に送信したコマンドのb_seq
+
+        self.metrics = RCS660SMetrics() # コマンド/チャンネルごとの時間と回数
+        self.wait_start = 0.0 # レスポンス待ちを始めた時刻 (最初の送信の直後)
+        self.parse_time = 0.0 # レスポンス待ちの間にパースにかかった時間 [s]
+        self.resync_count = 0 # metricsに数えたframe_parser.resync_count
+        self.corruption_count = 0 # metricsに数えたframe_parser.corruption_count
 
         self.ccid_command: CCIDCommandAbc
-        self.preamble = [0x00]
-        self.start_code = [0x00, 0xFF]
-        self.packet_length: list[int]
-        self.packet_length_checksum: list[int]
-        self.packet_data_checksum: list[int]
-        self.postamble = [0x00]
-        self.command_frame: list[int]
+        self.command_frame: CommandFrame
 
         self.response: bytes
 
 
     # -------------------------------------- public methods --------------------------------------
     def create_command_frame(self, ccid_command: CCIDCommandAbc, is_debug: bool=False) -> None:
+        build_start = time.perf_counter()
+        self.command_frame = compile_command_frame(ccid_command)
         self.ccid_command = ccid_command
-        self.__set_packet_length()
-        self.__set_packet_length_checksum()
-        self.__set_packet_data_checksum()
-        self.command_frame = (
-            self.preamble 
-            + self.start_code 
-            + self.packet_length 
-            + self.packet_length_checksum 
-            + self.ccid_command.get_ccid_command() 
-            + self.packet_data_checksum 
-            + self.postamble
-        )        
+        self.metrics.observe(BUILD, type(ccid_command).__name__, time.perf_counter() - build_start)
 
         # デバッグ用
         if is_debug: self.__debug_command_frame()
@@ -52,38 +76,139 @@ class RCS660S:
         """
         self.uart.reset_input_buffer()
         self.uart.reset_output_buffer()
+        self.frame_parser.reset()
         return "flush buffer"
 
     def send_command_frame(self) -> None:
-        self.uart.write(bytes(self.command_frame))
+        self.send_frame(self.command_frame)
+
+    def send_frame(self, command_frame: CommandFrame) -> int:
+        """
+        コンパイル済みのコマンドフレームを, b_seqだけ次の値に差し替えて送信する
+        固定のコマンドはmanager側でキャッシュしておき, 毎回のフレーム組み立てを省く
+        :return: 送信したb_seq
+        """
+        self.ccid_command = command_frame.ccid_command
+        seq = self.__write(command_frame)
+        self.wait_start = time.perf_counter()
+        self.parse_time = 0.0
+        return seq
 
-    def read_response(self, is_debug: bool=False) -> dict:
-        size = 512
-        self.response=bytes()
-        sleep_time=1.0/100000 # -> 1000Hz近辺まで周波数を上げなければ, 問題なし. 現状の目標は30Hz.
+    def read_response(self, is_debug: bool=False) -> RCS660SResponse:
+        # 受信バイト列をパーサに流し込み, チェックサムまで検証済みのレスポンスフレームを1つ取り出す
+        # 送信からcommand_timeoutまでに返らなければRCS660STimeoutError
+        # b_seqが最後に送信したコマンドと違うフレーム(前のコマンドの遅れた応答など)は捨てる
+        # 期限切れのときは, 遅れて届く応答を次のコマンドが受け取らないよう読み捨ててから投げる
+        try:
+            self.response = self.__read_frame({self.sent_seq}, is_debug)
+        except RCS660STimeoutError:
+            self.__drain({self.sent_seq})
+            raise
+        self.record_response(type(self.ccid_command).__name__, [self.response])
+        return RCS660SResponse(self.response)
 
-        # コマンドが返ってくるまでloopで問い合わせる. 
-        # 全パケットが返ってきているかを, パケット長をもとに判定する
-        cnt=0
-        while not self.__is_full_response(self.response):
-            time.sleep(sleep_time)
-            self.response += bytes(self.uart.read(size))
-            if is_debug: print_hex(f"[{cnt}]"+f"{cnt*sleep_time:.3f}s "+f"{len(self.response)}bytes "+"response:", self.response)
-            cnt+=1
+    def transceive_batch(self, command_frames: list[CommandFrame], is_debug: bool=False) -> list[RCS660SResponse]:
+        """
+        複数のコマンドフレームをパイプラインで送信し, レスポンスを送信順に返す
+        前のコマンドのACKが返ってきた時点で次のフレームを書き込み, レスポンスの受信を待たない.
+        レスポンスは, このバッチで振ったCCIDのb_seqで送信したフレームと対応付ける.
+        それ以外のb_seqのフレーム(前のバッチの遅れた応答など)は捨てる
+        ACKもレスポンスも, 最後の送信からcommand_timeout*フレーム数までに揃わなければRCS660STimeoutError
+        (揃わなかった分の応答は読み捨ててから投げる)
+        """
+        seqs: list[int] = []
+        waiting_seqs: set[int] = set()
+        responses: dict[int, RCS660SResponse] = {}
+        ack_count = self.frame_parser.ack_count
+        try:
+            for i, command_frame in enumerate(command_frames):
+                if i > 0:
+                    # 前のフレームのACKを待つ. その間に届いたレスポンスはパーサに溜まる
+                    while self.frame_parser.ack_count < ack_count + i:
+                        self.__check_deadline()
+                        self.__receive(is_debug)
+                seqs.append(self.__write(command_frame))
+                waiting_seqs.add(seqs[-1])
+                if i == 0:
+                    self.wait_start = time.perf_counter()
+                    self.parse_time = 0.0
+            self.ccid_command = command_frames[-1].ccid_command
+            self.deadline = time.perf_counter() + self.command_timeout*len(command_frames) # デバイスは1つずつ処理する
+
+            while waiting_seqs:
+                response = RCS660SResponse(self.__read_frame(waiting_seqs, is_debug))
+                waiting_seqs.discard(response.seq)
+                responses[response.seq] = response
+        except RCS660STimeoutError:
+            self.__drain(waiting_seqs)
+            raise
+        self.response = responses[seqs[-1]].frame
+        self.record_response(PIPELINED, [response.frame for response in responses.values()])
+
+        return [responses[seq] for seq in seqs]
+
+
+    def ping(self, timeout: float) -> bool:
+        """
+        Get Firmware Versionを1回だけ, command_timeoutより短いtimeoutで往復させる (応答しないリーダの復旧用)
+        期限切れでも遅れた応答は待たずにflushする. 後から届いてもb_seqが合わないので次のコマンドには渡らない
+        """
+        self.flush_buffer()
+        self.send_frame(compile_command_frame(GetFirmwareVersion()))
+        self.deadline = time.perf_counter() + timeout
+        try:
+            frame = self.__read_frame({self.sent_seq})
+        except RCS660STimeoutError:
+            self.flush_buffer()
+            return False
+        return RCS660SResponse(frame).ccid_status[0] == SUCCESS
 
-        ack = extract_bytes(self.response, 0, 7)
-        ccid_response = extract_bytes(self.response, 7, len(self.response)-2)
-        apdu_response = extract_bytes(self.response, 23, len(self.response)-2) # パケットデータチェックサムとポストアンブルを除く
+    def feed(self, data: bytes) -> None:
+        """
+        uartから読んだバイト列をパーサに渡す (キャプチャ中なら記録もする)
+        """
+        if self.capture is not None: self.capture.record_rx(data)
+        parse_start = time.perf_counter()
+        frame_parser = self.frame_parser
+        frame_parser.feed(data)
+        self.parse_time += time.perf_counter() - parse_start
 
-        response = self.ccid_command.read_ccid_response(ccid_response, apdu_response)
-        return response
+        if frame_parser.resync_count != self.resync_count:
+            self.metrics.count(RESYNCS, frame_parser.resync_count - self.resync_count)
+            self.resync_count = frame_parser.resync_count
+        if frame_parser.corruption_count != self.corruption_count:
+            self.metrics.count(CORRUPTIONS, frame_parser.corruption_count - self.corruption_count)
+            self.corruption_count = frame_parser.corruption_count
 
+    def record_response(self, command_name: str, frames: list[bytes]) -> None:
+        """
+        レスポンスが揃ったときに, 送信からの待ち時間とパース時間, 成功以外のステータスをmetricsに数える
+        """
+        metrics = self.metrics
+        elapsed = time.perf_counter() - self.wait_start
+        metrics.observe(WAIT, command_name, elapsed - self.parse_time)
+        metrics.observe(PARSE, command_name, self.parse_time)
+        for frame in frames:
+            # apduの先頭がgeneric error status(C0 03 XX B1 B2)のレスポンスだけ見る
+            if frame[APDU_RESPONSE_INDEX] == 0xC0 and (
+                frame[APDU_RESPONSE_INDEX+3] != 0x90 or frame[APDU_RESPONSE_INDEX+4] != 0x00
+            ):
+                metrics.count(NON_SUCCESS)
+
+    def read_raw(self, size: int) -> bytes:
+        """
+        パーサを通さずにuartから読む (キャプチャ中なら記録もする)
+        """
+        data = self.uart.read(size)
+        if self.capture is not None: self.capture.record_rx(data)
+        return data
 
     def read_discard(self) -> None:
         """
         バッファの残りを読み出して捨てる
         """
         sleep_time=1.0/1000
+        self.frame_parser.reset()
         while self.uart.in_waiting > 0:
             res=self.uart.read(self.uart.in_waiting)
             print_hex("read_discard", res)
@@ -102,51 +227,87 @@ class RCS660S:
         )
         return uart
     
-    def __set_packet_length(self) -> None:
-        self.packet_length = list(len(
-            self.ccid_command.get_ccid_command()
-        ).to_bytes(2, 'big'))
-
-
-    def __calculate_checksum(self, bytes_data: list[int]) -> list[int]:
-        # CCIDコマンドの汎用チェックサム計算
-        checksum = (16**2) * ceil(sum(bytes_data) / (16**2)) - sum(bytes_data)
-        return list(checksum.to_bytes(1, 'big'))
-    
-
-    def __set_packet_length_checksum(self) -> None:
-        self.packet_length_checksum = self.__calculate_checksum(
-            self.packet_length
-        )
-
-    def __set_packet_data_checksum(self) -> None:
-        self.packet_data_checksum = self.__calculate_checksum(
-            self.ccid_command.get_ccid_command()
-        )
+    def __read_frame(self, seqs: set[int], is_debug: bool=False) -> bytes:
+        """
+        b_seqがseqsのどれかのレスポンスフレームが1つ完成するまで受信する
+        それ以外のフレームは, 期限切れになったコマンドの遅れた応答などなので捨てる
+        """
+        while True:
+            frame = self.frame_parser.pop_frame()
+            while frame is None:
+                self.__check_deadline()
+                self.__receive(is_debug)
+                frame = self.frame_parser.pop_frame()
+            if frame[SEQ_INDEX] in seqs:
+                return frame
+            self.metrics.count(STALE_FRAMES)
+            if is_debug: print_hex(f"discard response (seq={frame[SEQ_INDEX]})", frame)
 
+    def __drain(self, seqs: set[int]) -> bool:
+        """
+        期限切れになったコマンドの応答を, 全部届くかもう1回分の期限(command_timeout)まで待ってから捨てる
+        待たずに次へ進むと, 遅れて届いた応答を次のコマンド(MUXなら次のチャンネル)が受け取ってしまう
+        :return: 応答が全部届いたか
+        """
+        waiting_seqs = set(seqs)
+        drain_deadline = time.perf_counter() + self.command_timeout
+        try:
+            while waiting_seqs:
+                frame = self.frame_parser.pop_frame()
+                while frame is None:
+                    if time.perf_counter() >= drain_deadline:
+                        return False
+                    self.__receive()
+                    frame = self.frame_parser.pop_frame()
+                waiting_seqs.discard(frame[SEQ_INDEX])
+                self.metrics.count(STALE_FRAMES)
+            return True
+        finally:
+            self.flush_buffer()
 
-    def __is_full_response(self,response: bytes) -> bool:
+    def __receive(self, is_debug: bool=False) -> None:
         """
-        応答データが全部返ってきているか判定する
+        受信済みのバイトだけを読んでパーサに渡す
+        何も届いていなければ, sleepではなくselectでfdが読めるようになるまで待つ
         """
-        is_full = False
-        if len(response) < 12:
-            #パケット長さが返ってきてない
-            return False
-        
-        # パケット長さをチェック
-        packet_length = int.from_bytes(response[10:12], 'big') # 10,11番目にbigエンディアンでパケット長が入ってる
-        if len(response[12:]) == packet_length + 3: # 3足してるのはpacket + チェックサム2バイト, ポストアンブル1バイト
-            is_full = True
+        n_waiting = self.uart.in_waiting
+        if n_waiting == 0:
+            select.select([self.uart.fileno()], [], [], self.uart.timeout)
+            return
+        data = self.uart.read(n_waiting)
+        if is_debug: print_hex(f"{len(data)}bytes response:", data)
+        self.feed(data)
 
-        return is_full
+    def __write(self, command_frame: CommandFrame) -> int:
+        """
+        b_seqを次の値にして書き込む
+        :return: 送信したb_seq
+        """
+        seq = self.seq
+        self.seq = (seq + 1) & 0xFF
+        frame = command_frame.with_seq(seq)
+        if self.capture is not None: self.capture.record_tx(frame)
+        send_start = time.perf_counter()
+        self.uart.write(frame)
+        send_end = time.perf_counter()
+        self.metrics.observe(SEND, type(command_frame.ccid_command).__name__, send_end - send_start)
+        self.deadline = send_end + self.command_timeout
+        self.sent_seq = seq
+        return seq
 
+    def __check_deadline(self) -> None:
+        if time.perf_counter() >= self.deadline:
+            self.metrics.count(TIMEOUTS)
+            raise RCS660STimeoutError(
+                f"no response within {self.command_timeout}s ({type(self.ccid_command).__name__})"
+            )
 
     def __debug_command_frame(self) -> None:
         print("\033[33mdebug Input command frame: =============================================================\033[0m")
-        print_hex("packet_length", self.packet_length)
-        print_hex("packet_length_checksum", self.packet_length_checksum)
-        print_hex("packet_data_checksum", self.packet_data_checksum)
-        print_hex("ccid_command", self.ccid_command.get_ccid_command())
-        print_hex("command_frame", self.command_frame)
+        frame = self.command_frame.frame
+        print_hex("packet_length", frame[3:5])
+        print_hex("packet_length_checksum", frame[5:6])
+        print_hex("packet_data_checksum", frame[-2:-1])
+        print_hex("ccid_command", frame[6:-2])
+        print_hex("command_frame", frame)
         print("\033[33m==================================================================================\033[0m\n")
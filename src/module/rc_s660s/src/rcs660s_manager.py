@@ -1,6 +1,11 @@
+import math
 import time
+from collections.abc import Iterator
 
 from .rcs660s import RCS660S
+from .async_rcs660s import AsyncRCS660S
+from .command_frame import compile_command_frame
+from .response import RCS660SResponse
 
 from .ccid_command.reset_device import ResetDevice
 from .ccid_command.manage_session import ManageSession, ManageSessionDataObjectTag
@@ -8,6 +13,11 @@ from .ccid_command.switch_protocol import SwitchProtocol, SwitchProtocolDataObje
 from .ccid_command.transparent_exchange import TransparentExchange, TransparentExchangeDataObjectTag
 
 
+FELICA_POLLING_RESPONSE_CODE = 0x01 # pollingレスポンスのレスポンスコード
+FELICA_POLLING_RESPONSE_SIZE = 18 # 長さ(1) + レスポンスコード(1) + IDm(8) + PMm(8)
+FELICA_TIME_SLOTS = (1, 2, 4, 8, 16) # pollingで指定できるタイムスロット数
+ICC_RESPONSE_TAG = 0x97
+
 
 class RCS660SManager:
     """
@@ -15,11 +25,49 @@ class RCS660SManager:
     一連のコマンドを実行し, 使用者にバイト列の通信を意識させない.
     """
 
-    def __init__(self,rcs660s:RCS660S,is_debug:bool=False):
+    def __init__(
+        self,rcs660s:RCS660S,is_debug:bool=False,is_pipelined:bool=False,is_persistent_session:bool=False,
+        is_fast_polling:bool=False, time_slots:int=1
+    ):
+        """
+        :param is_pipelined: (実験的) Trueならpollingの一連のコマンドをACKごとに続けて送信し, レスポンスをまとめて受け取る.
+            シミュレータではTIMER+TRANSCEIVE(polling)の前に送るのがSTARTだけなので, 速くならなかった
+        :param is_persistent_session: Trueならカードが読めている間はSTART_TRANSPARENT_SESSIONを省略する
+        :param is_fast_polling: TrueならTIMER+TRANSCEIVE(polling)の代わりにSWITCH_TO_FELICA_POLLINGを送り,
+            プロトコル切り替えとpollingを1コマンドで済ませる. 速くはならない
+            (シミュレータの2チャンネルで110.8 ms/frame, 従来のpollingは87.6 ms/frame).
+            TypeAのSWITCH_PROTOCOLの後でもFeliCaを読めるので, Mixedのmanagerで使う
+        :param time_slots: pollingのタイムスロット数(1,2,4,8,16). 2以上にすると, 重なった複数枚のカードを
+            1回のpollingで読める. SWITCH_TO_FELICA_POLLINGではタイムスロット数を指定できないので,
+            is_fast_pollingとは併用できない
+        """
+        if time_slots not in FELICA_TIME_SLOTS:
+            raise ValueError(f"time_slots must be one of {FELICA_TIME_SLOTS}: {time_slots}")
+        if is_fast_polling and time_slots>1:
+            raise ValueError(f"time_slots is not supported with is_fast_polling: {time_slots}")
         self.rcs660s = rcs660s
+        self.async_rcs660s = AsyncRCS660S(rcs660s) # poll()用. イベントループで使うまでfdは登録しない
         self.is_debug = is_debug
+        self.is_pipelined = is_pipelined
+        self.is_persistent_session = is_persistent_session
+        self.is_fast_polling = is_fast_polling
+        self.time_slots = time_slots
         self.is_setup=False
 
+        # transparent sessionが開いたままのチャンネル名
+        self.session_channels:set[str]=set()
+
+        # 固定のコマンドフレームは一度だけコンパイルしておく (b_seqは送信時にRCS660Sが振る)
+        self.start_transparent_session_frame=compile_command_frame(
+            ManageSession(data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION)
+        )
+        self.polling_frame=compile_command_frame(
+            TransparentExchange(data_object_tag=self.__create_polling_data_object())
+        )
+        self.switch_polling_frame=compile_command_frame(
+            SwitchProtocol(data_object_tag=SwitchProtocolDataObjectTag.SWITCH_TO_FELICA_POLLING)
+        )
+
 
     def reset_device(self):
         self.rcs660s.create_command_frame(
@@ -27,7 +75,9 @@ class RCS660SManager:
         )
         self.rcs660s.send_command_frame()
         time.sleep(10/1000) #response返るまでちょっと待つ
-        self.rcs660s.uart.read(128)
+        self.rcs660s.read_raw(128)
+        self.rcs660s.frame_parser.reset() # 読み捨てた分, パーサの途中状態も捨てる
+        self.invalidate_session()
 
     
     def setup_device(self):
@@ -129,64 +179,122 @@ class RCS660SManager:
         (SwitchProtocolは必要ない)
         """
         # 1) Start Transparent Session
-        self.rcs660s.create_command_frame(
-            ccid_command=ManageSession(
-                data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION
-            ), is_debug=self.is_debug
-        )
-        self.rcs660s.send_command_frame()
+        self.rcs660s.send_frame(self.start_transparent_session_frame)
         response = self.rcs660s.read_response(is_debug=False) # readしとかないと, 次のコマンドで前コマンドの結果が返ってきちゃう
 
 
 
 
-    def polling(self) -> dict:
+    def invalidate_session(self, channel_name:str|None=None) -> None:
+        """
+        開いたままのセッションを無効にし, 次のpollingでSTART_TRANSPARENT_SESSIONからやり直させる
+        :param channel_name: Noneなら全チャンネル
+        """
+        if channel_name is None:
+            self.session_channels.clear()
+        else:
+            self.session_channels.discard(channel_name)
+
+
+    def polling(self, channel_name:str|None=None) -> dict:
         """
         開発メモ)
         【チャンネル数と最大周波数】
         - 1チャンネル: 26Hz程度
         - 2チャンネル: 13Hz程度 (かなり線形に落ちてるなぁ)
 
-        :reuturn {"id":id, "pmm":pmm}, カードが無いときはNoneになる
+        :reuturn {"id":id, "pmm":pmm, "ids":ids, "pmms":pmms}, カードが無いときはNone(ids/pmmsは空リスト)になる
             ここで, 識別に使う数値のキーは'id'とする.(それ以外はぶっちゃけなんでもいい)
-            id:16進数表記のリスト. felica固有のID
+            id:16進数表記のリスト. felica固有のID (複数枚あるときは最初に応答したカード)
             pmm:16進数8つの製造工場ID
+            ids/pmms:応答した全カードのid/pmmのリスト (time_slotsが1なら最大1枚)
+        :param channel_name: MUXのチャンネル名. is_persistent_sessionのとき, セッション状態の管理に使う
         """
 
+        is_persistent=self.is_persistent_session and channel_name is not None
+        polling_frame=self.switch_polling_frame if self.is_fast_polling else self.polling_frame
 
         # マルチチャンネルの場合は, これを毎pooling前に実行する必要あり
         # しかし, これを毎poolingで実行すると26Hz程度が限界となる (ないときは35Hz程度まで出せる)
-        self.__strart_transparent_session() 
-
-        # タイムアウト時間 設定 (公式ドキュメントによると精度は1ms)
-        timeout_ms = 5 # ms, 3ms未満はIDmを読み取れない. そのため3msが最速設定.
-        timer_command=list((timeout_ms*1000).to_bytes(4, 'little')) # 待機時間[μs], リトルエンディアン
-        timer_ccid=TransparentExchangeDataObjectTag.TIMER(timer_command)
-
-        polling_command=[0x06,0x00,0xff,0xff,0x00,0x00] # idm取得コマンド, 謎の0x06が必須(バイト長さではない...)
-        polling_ccid=TransparentExchangeDataObjectTag.TRANSCEIVE(polling_command)
-        self.rcs660s.create_command_frame(
-            ccid_command=TransparentExchange(
-                data_object_tag=timer_ccid + polling_ccid
-            ), is_debug=self.is_debug
-        )
-        self.rcs660s.send_command_frame()
-
-
-        response = self.rcs660s.read_response(is_debug=False) # Trueだとloop問い合わせの中身をprintする
+        if is_persistent and channel_name in self.session_channels:
+            # 前回カードが読めたチャンネルはセッションを開いたままにしているので, pollingだけ送る
+            self.rcs660s.send_frame(polling_frame)
+            response = self.rcs660s.read_response(is_debug=False)
+        elif self.is_pipelined:
+            # START_TRANSPARENT_SESSIONのACKを待つだけで, pollingコマンドを続けて送信する
+            response = self.rcs660s.transceive_batch([
+                self.start_transparent_session_frame, polling_frame
+            ])[-1]
+        else:
+            self.__strart_transparent_session() 
+
+            if self.is_debug: print(polling_frame)
+            self.rcs660s.send_frame(polling_frame)
+
+            response = self.rcs660s.read_response(is_debug=False) # Trueだとloop問い合わせの中身をprintする
         if self.is_debug: 
             print("polling")
             print(response)
         
         # バイト列からidmと工場番号に変換
-        response_dict=self.__bite2idm(response)
+        response_dict=self.__parse_polling_response(response)
 
+        # 読めなかったとき(カードが無い, セッションが切れた)は次回START_TRANSPARENT_SESSIONからやり直す
+        if is_persistent:
+            if response_dict["id"] is None:
+                self.invalidate_session(channel_name)
+            else:
+                self.session_channels.add(channel_name)
 
 
 
         return response_dict
 
 
+    async def poll(self, channel_name:str|None=None) -> dict:
+        """
+        polling()のasyncio版. レスポンス待ちの間はイベントループを止めない
+        is_persistent_sessionは使わず, 毎回START_TRANSPARENT_SESSIONから送る
+        :return polling()と同じ
+        """
+        polling_frame=self.switch_polling_frame if self.is_fast_polling else self.polling_frame
+        if self.is_pipelined:
+            response=(await self.async_rcs660s.transceive_batch([
+                self.start_transparent_session_frame, polling_frame
+            ]))[-1]
+        else:
+            await self.async_rcs660s.transceive(self.start_transparent_session_frame)
+            response=await self.async_rcs660s.transceive(polling_frame)
+        if self.is_debug: 
+            print("poll")
+            print(response)
+
+        return self.__parse_polling_response(response)
+
+
+    def __parse_polling_response(self, response:RCS660SResponse) -> dict:
+        if self.is_fast_polling:
+            return self.__polling_response2idm(response)
+        return self.__bite2idm(response)
+
+
+    def __create_polling_data_object(self) -> list[int]:
+        """
+        TIMER + TRANSCEIVE(polling)のデータオブジェクトを作成する
+        固定値なので, 初期化時に一度だけフレームにコンパイルする
+        """
+        # タイムアウト時間 設定 (公式ドキュメントによると精度は1ms)
+        timeout_ms = 5 # ms, 3ms未満はIDmを読み取れない. そのため3msが最速設定.
+        timeout_ms += math.ceil(1.208*(self.time_slots-1)) # タイムスロット1つにつき約1.2ms応答が遅れうる
+        timer_command=list((timeout_ms*1000).to_bytes(4, 'little')) # 待機時間[μs], リトルエンディアン
+        timer_ccid=TransparentExchangeDataObjectTag.TIMER(timer_command)
+
+        # idm取得コマンド, 謎の0x06が必須(バイト長さではない...). 最後のバイトはタイムスロット数-1
+        polling_command=[0x06,0x00,0xff,0xff,0x00,self.time_slots-1]
+        polling_ccid=TransparentExchangeDataObjectTag.TRANSCEIVE(polling_command)
+        return timer_ccid + polling_ccid
+
+
     def close(self):
         # 通信終了
 
@@ -217,28 +325,73 @@ class RCS660SManager:
         self.rcs660s.uart.close()
 
 
-    def __bite2idm(self,response)->dict:
+    def __bite2idm(self,response:RCS660SResponse)->dict:
         """
         rcs660sからのresponseからidmとpmmを取得する
-        :return:out:{"idm":idm, "pmm":pmm}, カードが無いときはNoneになる
+        :return:out:{"id":idm, "pmm":pmm, "ids":[idm,...], "pmms":[pmm,...]}, カードが無いときはNoneになる
             idm:16進数8つのfelica固有のID
             pmm:16進数8つの製造工場ID
         """
-        out={}
-        
-        ccid_response = response["ccid"] # ccidのresponse：idm/pmmはccidで判断
-        apdu_response = response["apdu"] # apduのresponse：カードが有無はapduで判断
-
-        apdu_success_key="success" 
-        if apdu_response["status"] != apdu_success_key: # カードが無い or 何らかのエラー
-            out["id"] = None
-            out["pmm"] = None
-        elif apdu_response["status"] == apdu_success_key: # カードがある
-            ccid_hex=[f"{b:02X}" for b in ccid_response["response"]]
-            byte_size=8
-            pmm_tail=2
-            idm_tail=byte_size+pmm_tail
-            out["id"] = ccid_hex[-(idm_tail+byte_size):-(idm_tail)]
-            out["pmm"] = ccid_hex[-(pmm_tail+byte_size):-(pmm_tail)]
-
-        return out
+        # カードの有無はapduのstatusで判断, idm/pmmはccidのresponseで判断
+        if not response.is_success: # カードが無い or 何らかのエラー
+            return self.__pairs2out([])
+
+        if self.time_slots>1:
+            # 複数スロットの場合, ICC responseにpollingレスポンスが応答したカードの数だけ並ぶ
+            data=response.find_data_object(ICC_RESPONSE_TAG)
+            return self.__pairs2out(list(self.__iter_polling_responses(data)) if data is not None else [])
+
+        ccid_response = response.ccid_response
+        byte_size=8
+        pmm_tail=2
+        idm_tail=byte_size+pmm_tail
+        return self.__pairs2out([(
+            ccid_response[-(idm_tail+byte_size):-(idm_tail)],
+            ccid_response[-(pmm_tail+byte_size):-(pmm_tail)]
+        )])
+
+
+    def __polling_response2idm(self,response:RCS660SResponse)->dict:
+        """
+        SWITCH_TO_FELICA_POLLINGのresponseからidmとpmmを取得する
+        データオブジェクトの中から, pollingレスポンス(長さ 01 IDm PMm)を探し, memoryviewのまま切り出す
+        :return:out: __bite2idmと同じ
+        """
+        if not response.is_success: # カードが無い or 何らかのエラー
+            return self.__pairs2out([])
+
+        for _, value in response.iter_data_objects():
+            pairs=list(self.__iter_polling_responses(value))
+            if len(pairs)>0:
+                return self.__pairs2out(pairs)
+
+        return self.__pairs2out([])
+
+
+    @staticmethod
+    def __iter_polling_responses(data:memoryview) -> Iterator[tuple[memoryview, memoryview]]:
+        """
+        pollingレスポンス(長さ 01 IDm PMm [リクエストデータ])が並んだバイト列から, (IDm, PMm)を順に返す
+        """
+        idx=0
+        while idx+FELICA_POLLING_RESPONSE_SIZE<=len(data):
+            length=data[idx]
+            if length<FELICA_POLLING_RESPONSE_SIZE or data[idx+1]!=FELICA_POLLING_RESPONSE_CODE:
+                return # pollingレスポンスではない
+            yield data[idx+2:idx+10], data[idx+10:idx+18]
+            idx+=length
+
+
+    @staticmethod
+    def __pairs2out(pairs:list[tuple[memoryview, memoryview]]) -> dict:
+        """
+        (IDm, PMm)のリストを16進数表記のリストにして, polling()の戻り値の形にする
+        """
+        ids=[[f"{b:02X}" for b in idm] for idm, _ in pairs]
+        pmms=[[f"{b:02X}" for b in pmm] for _, pmm in pairs]
+        return {
+            "id":ids[0] if len(ids)>0 else None,
+            "pmm":pmms[0] if len(pmms)>0 else None,
+            "ids":ids,
+            "pmms":pmms,
+        }
@@ -0,0 +1,114 @@
+from collections.abc import Iterator
+
+from .response_status.response_status import ResponseStatus
+
+
+APDU_RESPONSE_INDEX = 16 # ヘッダ(6バイト) + CCIDヘッダ(10バイト)
+SEQ_INDEX = 12 # CCIDのb_seqの位置. ヘッダ(6) + bMessageType(1) + dwLength(4) + bSlot(1)
+SUCCESS = "success"
+
+
+class RCS660SResponse:
+    """
+    RCS660Sのレスポンスフレーム1つ分のビュー
+    受信したフレーム(プリアンブル~ポストアンブル)をmemoryviewで参照し,
+    ccid/apduの切り出しやステータスの解釈は, 使われたときに初めて行う.
+
+    ccid_response: ヘッダ~パケットデータ末尾(SW1 SW2)まで. パケットデータチェックサムとポストアンブルを除く
+    apdu_response: ccid_responseからヘッダとCCIDヘッダを除いたもの
+        ex) C0 03 00 90 00 92 01 00 96 02 00 00 97 10 <16byte> 90 00
+    """
+
+    __slots__ = ("frame", "view", "__ccid_status", "__apdu_status")
+
+    def __init__(self, frame: bytes):
+        self.frame = frame
+        self.view = memoryview(frame)
+        self.__ccid_status: tuple[str, str]|None = None
+        self.__apdu_status: tuple[str, str]|None = None
+
+
+    # -------------------------------------- payload --------------------------------------
+    @property
+    def ccid_response(self) -> memoryview:
+        return self.view[:-2]
+
+    @property
+    def apdu_response(self) -> memoryview:
+        return self.view[APDU_RESPONSE_INDEX:-2]
+
+    @property
+    def seq(self) -> int:
+        return self.frame[SEQ_INDEX]
+
+
+    # -------------------------------------- status --------------------------------------
+    @property
+    def ccid_status(self) -> tuple[str, str]:
+        """
+        パケットデータ末尾のSW1 SW2から (status, message) を返す
+        """
+        if self.__ccid_status is None:
+            self.__ccid_status = ResponseStatus.get_ccid_status(self.frame[-4], self.frame[-3])
+        return self.__ccid_status
+
+    @property
+    def apdu_status(self) -> tuple[str, str]:
+        """
+        apdu_responseの先頭のデータオブジェクト(C0 03 XX B1 B2)から (status, message) を返す
+        """
+        if self.__apdu_status is None:
+            self.__apdu_status = ResponseStatus.get_apdu_status(
+                self.frame[APDU_RESPONSE_INDEX+3], self.frame[APDU_RESPONSE_INDEX+4]
+            )
+        return self.__apdu_status
+
+    @property
+    def is_success(self) -> bool:
+        return self.apdu_status[0] == SUCCESS
+
+
+    # -------------------------------------- data object --------------------------------------
+    def iter_data_objects(self) -> Iterator[tuple[int, memoryview]]:
+        """
+        apdu_responseのデータオブジェクト(BER-TLV)を (tag, value) で順に返す. 末尾のSW1 SW2は含めない
+        ex) C0(generic error status), 92(ICC response status), 96(RF status), 97(ICC response)
+        tagは2バイトタグ(5F 46など)の場合, 2バイト分を1つのintにする
+        """
+        data = self.view[APDU_RESPONSE_INDEX:-4]
+        idx = 0
+        size = len(data)
+        while idx < size:
+            tag = data[idx]
+            idx += 1
+            if tag & 0x1F == 0x1F: # 2バイトタグ
+                if idx >= size: return
+                tag = (tag << 8) | data[idx]
+                idx += 1
+
+            if idx >= size: return
+            length = data[idx]
+            idx += 1
+            if length & 0x80: # 長さが複数バイト (81 XX / 82 XX XX)
+                n_bytes = length & 0x7F
+                if idx + n_bytes > size: return
+                length = int.from_bytes(data[idx:idx+n_bytes], 'big')
+                idx += n_bytes
+
+            if idx + length > size: return
+            yield tag, data[idx:idx+length]
+            idx += length
+
+    def find_data_object(self, tag: int) -> memoryview|None:
+        """
+        最初に見つかったtagのデータオブジェクトの値を返す. 無ければNone
+        """
+        for do_tag, value in self.iter_data_objects():
+            if do_tag == tag:
+                return value
+        return None
+
+
+    def __repr__(self) -> str:
+        hexstr = ' '.join(f'{b:02X}' for b in self.frame)
+        return f"RCS660SResponse(apdu_status={self.apdu_status[0]}, ccid_status={self.ccid_status[0]}: {hexstr})"
@@ -1,79 +1,62 @@
 from pathlib import Path
 PARENT_DIR = Path(__file__).parent
 
-import pandas as pd
+import csv
 
-class ResponseStatus:
 
-    # -------------------------------------- CCID Response Status --------------------------------------
-    CCID_STATUS_DF=None
+INVALID_LE_SW1 = 0x6C # invalid_leの場合はsw1だけ見ればいい (sw2には正しいleが入る)
+UNKNOWN_STATUS = "unknown"
 
-    @classmethod
-    def get_ccid_status(cls, sw1: int, sw2: int) -> str:
 
-        if cls.CCID_STATUS_DF is None:
-            cls.__init_ccid_status_df()
-        
-        status:str
-        message:str
-        if cls.__is_invalid_le(sw1):
-            where=cls.CCID_STATUS_DF["sw1"]==sw1
-            status=cls.CCID_STATUS_DF.loc[where]["status"].values[0]
-            message=cls.CCID_STATUS_DF.loc[where]["message"].values[0]
-        else:
-            where=(cls.CCID_STATUS_DF["sw1"]==sw1) & (cls.CCID_STATUS_DF["sw2"]==sw2)
-            status=cls.CCID_STATUS_DF.loc[where]["status"].values[0]
-            message=cls.CCID_STATUS_DF.loc[where]["message"].values[0]
+class ResponseStatus:
+    """
+    レスポンスのステータスワードから (status, message) を引く
+    csvは初回に (sw1<<8)|sw2 をキーとするdictにコンパイルし, 以降はdictを1回引くだけにする
+    """
 
-        return status, message
+    # -------------------------------------- CCID Response Status --------------------------------------
+    CCID_STATUS_TABLE: dict[int, tuple[str, str]]|None = None
 
     @classmethod
-    def __init_ccid_status_df(cls):
-        if cls.CCID_STATUS_DF is None:
-            cls.CCID_STATUS_DF = pd.read_csv(PARENT_DIR / "ccid_response_status.csv")
-
-            # 16進数を整数に
-            cls.CCID_STATUS_DF["sw1"]=cls.CCID_STATUS_DF["sw1"].apply(lambda x: int(x, 16))
-            cls.CCID_STATUS_DF["sw2"]=cls.CCID_STATUS_DF["sw2"].apply(lambda x: int(x, 16))
+    def get_ccid_status(cls, sw1: int, sw2: int) -> tuple[str, str]:
+        if cls.CCID_STATUS_TABLE is None:
+            cls.CCID_STATUS_TABLE = cls.__load_status_table("ccid_response_status.csv", "sw1", "sw2")
+        return cls.__lookup(cls.CCID_STATUS_TABLE, sw1, sw2)
 
-    @classmethod
-    def __is_invalid_le(cls,sw1: int) -> bool:
-        """
-        invalid_leの場合はsw1だけ見ればいい
-        """
-        result=False
-        if sw1 == 0x6C:
-            result=True
-        return result
-    
 
     # -------------------------------------- APDU Response Status --------------------------------------
-    APDU_STATUS_DF=None
-    @classmethod
-    def get_apdu_status(cls, b1: int, b2: int) -> str:
-
-        if cls.APDU_STATUS_DF is None:
-            cls.__init_apdu_status_df()
-        
-        status:str
-        message:str
-        if cls.__is_invalid_le(b1):
-            where=cls.APDU_STATUS_DF["B1"]==b1
-            status=cls.APDU_STATUS_DF.loc[where]["status"].values[0]
-            message=cls.APDU_STATUS_DF.loc[where]["message"].values[0]
-        else:
-            where=(cls.APDU_STATUS_DF["B1"]==b1) & (cls.APDU_STATUS_DF["B2"]==b2)
-            status=cls.APDU_STATUS_DF.loc[where]["status"].values[0]
-            message=cls.APDU_STATUS_DF.loc[where]["message"].values[0]
-
-        return status, message
+    APDU_STATUS_TABLE: dict[int, tuple[str, str]]|None = None
 
     @classmethod
-    def __init_apdu_status_df(cls):
-        if cls.APDU_STATUS_DF is None:
-            cls.APDU_STATUS_DF = pd.read_csv(PARENT_DIR / "apdu_response_status.csv")
-
-            # 16進数を整数に
-            cls.APDU_STATUS_DF["B1"]=cls.APDU_STATUS_DF["B1"].apply(lambda x: int(x, 16))
-            cls.APDU_STATUS_DF["B2"]=cls.APDU_STATUS_DF["B2"].apply(lambda x: int(x, 16))
-
+    def get_apdu_status(cls, b1: int, b2: int) -> tuple[str, str]:
+        if cls.APDU_STATUS_TABLE is None:
+            cls.APDU_STATUS_TABLE = cls.__load_status_table("apdu_response_status.csv", "B1", "B2")
+        return cls.__lookup(cls.APDU_STATUS_TABLE, b1, b2)
+
+
+    # -------------------------------------- private methods --------------------------------------
+    @staticmethod
+    def __lookup(table: dict[int, tuple[str, str]], sw1: int, sw2: int) -> tuple[str, str]:
+        status = table.get((sw1 << 8) | sw2)
+        if status is None:
+            return UNKNOWN_STATUS, f"未定義のステータス: {sw1:02X} {sw2:02X}"
+        return status
+
+    @staticmethod
+    def __load_status_table(file_name: str, sw1_key: str, sw2_key: str) -> dict[int, tuple[str, str]]:
+        """
+        csvを (sw1<<8)|sw2 -> (status, message) のdictにする
+        invalid_leの行はsw2に依らず引けるよう, sw2の全256通りを展開しておく
+        """
+        table = {}
+        with open(PARENT_DIR / file_name, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                sw1 = int(row[sw1_key], 16) # 16進数を整数に
+                sw2 = int(row[sw2_key], 16)
+                status = (row["status"], row["message"])
+                if sw1 == INVALID_LE_SW1:
+                    for any_sw2 in range(0x100):
+                        table[(sw1 << 8) | any_sw2] = status
+                else:
+                    table[(sw1 << 8) | sw2] = status
+        return table
@@ -0,0 +1,405 @@
+"""
+RCS660Sのシミュレータ (実機なしでのベンチマーク/動作確認用)
+ptyの片側でCCID over UARTのフレームを話し, ManageSession/SwitchProtocol/TransparentExchangeに応答する.
+- コマンドごとの処理時間 (実機の計測値に合わせたおおよその値)
+- ボーレートから計算したUARTの転送時間
+- MUX(TC4052B)のチャンネルごとのカードの有無 (FakeGPIOのピン状態からチャンネルを追従する)
+- MUXを切り替えてから信号が落ち着くまでの時間 (その間に届いたコマンドには応答しない)
+を再現する.
+
+usage:
+    gpio=FakeGPIO()
+    simulator=RCS660SSimulator(mapping=conf["mapping"], gpio=gpio, baudrate=115200).start()
+    simulator.set_cards("ch0", [SimulatedCard.typeA("04A1B2C3D4E5F6")])
+    tc4052b=TC4052B(mapping=conf["mapping"], gpio=gpio)
+    rcs660s=RCS660S(port=simulator.port, baudrate=115200, timeout_fps=200)
+
+単体のプロセスとして起動する場合 (MUXは追従せず, 全チャンネル同じリーダとして振る舞う):
+    python -m src.module.rc_s660s.src.simulator --card TypeA_14443-3A:04A1B2C3D4E5F6 (リポジトリのルートで)
+"""
+import threading
+import time
+from collections.abc import Iterator
+
+from .pty_device import PtyRCS660S, ACK_FRAME, COMMAND_SEQ_INDEX, COMMAND_APDU_INDEX, build_response_frame
+from .manager.rcs660s_manager_mixed import TagTechnology
+from ...tc4052b import CHECK_HIGH_LOW
+
+
+# コマンドごとの処理時間 [s]. 実機の計測(START 16ms, SWITCH_PROTOCOL 35ms, TRANSCEIVE 23ms)からUART転送分を引いたおおよその値
+# reset_deviceはFeliCaのmanagerが10ms待って読み捨てるので, それに間に合う値にしている
+DEFAULT_LATENCIES = {
+    "reset_device": 0.005,
+    "manage_session": 0.011,
+    "switch_protocol": 0.030,
+    "transparent_exchange": 0.017,
+}
+BITS_PER_BYTE = 10 # start bit + 8bit + stop bit
+DEFAULT_CHANNEL = "ch0" # mappingが無いときのチャンネル名
+
+RESET_DEVICE_APDU = bytes([0xFF, 0x55, 0x00, 0x00])
+INS_TRANSPARENT = 0xC2
+P2_MANAGE_SESSION = 0x00
+P2_TRANSPARENT_EXCHANGE = 0x01
+P2_SWITCH_PROTOCOL = 0x02
+
+# C0 03 XX B1 B2 のB1 B2
+STATUS_SUCCESS = (0x90, 0x00)
+STATUS_INVALID_PROCESS_ORDER = (0x63, 0x01)
+STATUS_NO_RESPONSE_FROM_CARD = (0x64, 0x01)
+STATUS_DUPLICATE_SESSION = (0x69, 0x8A)
+SW_SUCCESS = bytes([0x90, 0x00]) # apduレスポンス末尾のSW1 SW2
+
+TYPEA_READ = 0x30
+FELICA_POLLING = 0x00
+
+
+class SimulatedCard:
+    """
+    シミュレータに置くカード
+    """
+
+    __slots__ = ("technology", "uid", "pmm", "atqa", "sak")
+
+    def __init__(self, technology: TagTechnology, uid: bytes, pmm: bytes=bytes(8), atqa: bytes=b"\x44\x00", sak: int=0x00):
+        self.technology = technology
+        self.uid = uid # TypeAはUID(7byte), FeliCaはIDm(8byte)
+        self.pmm = pmm
+        self.atqa = atqa
+        self.sak = sak
+
+    @classmethod
+    def typeA(cls, uid_hex: str) -> "SimulatedCard":
+        return cls(TagTechnology.TYPEA_14443_3A, bytes.fromhex(uid_hex))
+
+    @classmethod
+    def felica(cls, idm_hex: str, pmm_hex: str="0120220427674EFF") -> "SimulatedCard":
+        return cls(TagTechnology.FELICA, bytes.fromhex(idm_hex), bytes.fromhex(pmm_hex))
+
+    def typeA_page0(self) -> bytes:
+        """
+        NFC Forum Type2のpage0~3 (READ 0x30 0x00の16byte)
+        UID0 UID1 UID2 BCC0 | UID3 UID4 UID5 UID6 | BCC1 内部 ロック ロック | CC
+        """
+        uid = self.uid
+        bcc0 = 0x88 ^ uid[0] ^ uid[1] ^ uid[2]
+        bcc1 = uid[3] ^ uid[4] ^ uid[5] ^ uid[6]
+        return uid[0:3] + bytes([bcc0]) + uid[3:7] + bytes([bcc1, 0x48, 0x00, 0x00, 0xE1, 0x10, 0x12, 0x00])
+
+    def felica_polling_response(self) -> bytes:
+        """
+        pollingレスポンス: 長さ 01 IDm PMm
+        """
+        return bytes([18, 0x01]) + self.uid + self.pmm
+
+
+class ReaderState:
+    """
+    MUXの先のリーダ1台分の状態 (チャンネルごとに別のリーダ)
+    """
+
+    __slots__ = ("is_session", "technology", "is_rf_on")
+
+    def __init__(self):
+        self.is_session = False
+        self.technology: TagTechnology|None = None
+        self.is_rf_on = False
+
+
+class RCS660SSimulator(PtyRCS660S):
+    """
+    RCS660Sのシミュレータ
+    """
+
+    def __init__(
+        self,
+        mapping: dict|None=None,
+        gpio=None,
+        baudrate: int|None=115200,
+        latencies: dict[str, float]|None=None,
+        latency_scale: float=1.0,
+        settle_times: dict[str, float]|None=None,
+    ):
+        """
+        :param mapping: TC4052Bのmapping. gpioのピン状態から, いまどのチャンネルのリーダと繋がっているかを決める
+            Noneなら常にDEFAULT_CHANNELと繋がっている
+        :param gpio: FakeGPIO. TC4052Bに渡したものと同じインスタンス
+        :param baudrate: UARTの転送時間の計算に使う. Noneなら転送時間は0
+        :param latencies: コマンドごとの処理時間 [s]. 指定したものだけDEFAULT_LATENCIESを上書きする
+        :param latency_scale: 処理時間の倍率. 0にすると転送時間だけになる
+        :param settle_times: {チャンネル名: MUXを切り替えてから応答できるようになるまでの時間[s]} (待ち時間の測定の確認用)
+        """
+        super().__init__()
+        self.mapping = mapping
+        self.baudrate = baudrate
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.latency_scale = latency_scale
+        self.settle_times = settle_times or {}
+
+        self.lock = threading.Lock()
+        self.cards: dict[str, list[SimulatedCard]] = {}
+        self.card_script: list[tuple[float, str, list[SimulatedCard]]] = []
+        self.readers: dict[str, ReaderState] = {}
+        self.start_time = time.perf_counter()
+
+        self.current_channel: str|None = DEFAULT_CHANNEL if mapping is None else None
+        self.switch_time = 0.0 # current_channelが変わった時刻 (time.perf_counter)
+        self.settle_drop_count = 0 # 切り替え直後で応答しなかったコマンドの数
+        if gpio is not None and mapping is not None:
+            gpio.add_listener(self.__on_pin_change)
+
+
+    # -------------------------------------- カードの配置 --------------------------------------
+    def set_cards(self, channel_name: str, cards: list[SimulatedCard]) -> None:
+        """
+        チャンネルに置くカード. 空リストでカード無し. 複数枚なら重なっている
+        """
+        with self.lock:
+            self.cards[channel_name] = list(cards)
+
+    def set_card_script(self, script: list[tuple[float, str, list[SimulatedCard]]]) -> None:
+        """
+        :param script: [(start()からの経過時間[s], チャンネル名, カード), ...]. 時刻を過ぎたらset_cardsする
+        """
+        with self.lock:
+            self.card_script = sorted(script, key=lambda event: event[0])
+
+    def start(self) -> "RCS660SSimulator":
+        self.start_time = time.perf_counter()
+        return super().start()
+
+
+    # -------------------------------------- 応答 --------------------------------------
+    def respond(self, frame: bytes) -> None:
+        channel_name = self.current_channel
+        if channel_name is None:
+            return # MUXがどのリーダとも繋がっていない. 何も返らない
+        if time.perf_counter() - self.switch_time < self.settle_times.get(channel_name, 0.0):
+            self.settle_drop_count += 1
+            return # 切り替え直後で信号が落ち着いていない. コマンドが届かなかったことにする
+
+        self.__sleep(self.transfer_time(len(frame))) # ホスト→リーダの転送
+        self.__write_paced(ACK_FRAME)
+
+        kind, apdu_response = self.__process(channel_name, frame)
+        self.command_count += 1
+        self.__sleep(self.latencies[kind]*self.latency_scale)
+        self.__write_paced(build_response_frame(frame[COMMAND_SEQ_INDEX], apdu_response))
+
+    def transfer_time(self, n_bytes: int) -> float:
+        if self.baudrate is None:
+            return 0.0
+        return n_bytes*BITS_PER_BYTE/self.baudrate
+
+
+    # -------------------------------------- private methods --------------------------------------
+    def __on_pin_change(self, pin_states: dict[int, int]) -> None:
+        """
+        FakeGPIOのピンが変わったら, mappingと一致するチャンネルを探す
+        """
+        for channel_name, row in self.mapping.items():
+            is_match = True
+            for pin, key in row.items():
+                high_low = CHECK_HIGH_LOW(key)
+                if high_low is not None and pin_states.get(int(pin)) != high_low:
+                    is_match = False
+                    break
+            if is_match:
+                self.__set_current_channel(channel_name)
+                return
+        self.__set_current_channel(None)
+
+    def __set_current_channel(self, channel_name: str|None) -> None:
+        if channel_name != self.current_channel:
+            self.switch_time = time.perf_counter()
+        self.current_channel = channel_name
+
+    def __write_paced(self, data: bytes) -> None:
+        self.__sleep(self.transfer_time(len(data)))
+        self.write(data)
+
+    @staticmethod
+    def __sleep(seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def __current_cards(self, channel_name: str, technology: TagTechnology) -> list[SimulatedCard]:
+        with self.lock:
+            elapsed = time.perf_counter() - self.start_time
+            while self.card_script and self.card_script[0][0] <= elapsed:
+                _, script_channel, cards = self.card_script.pop(0)
+                self.cards[script_channel] = list(cards)
+            cards = self.cards.get(channel_name, [])
+        return [card for card in cards if card.technology == technology]
+
+    def __process(self, channel_name: str, frame: bytes) -> tuple[str, bytes]:
+        """
+        :return: (処理時間の種類, apduレスポンス)
+        """
+        apdu = frame[COMMAND_APDU_INDEX:-2]
+        reader = self.readers.setdefault(channel_name, ReaderState())
+
+        if apdu[:4] == RESET_DEVICE_APDU:
+            self.readers[channel_name] = ReaderState()
+            return "reset_device", self.__status(STATUS_SUCCESS)
+
+        if len(apdu) < 5 or apdu[1] != INS_TRANSPARENT:
+            return "manage_session", self.__status(STATUS_SUCCESS)
+        data = apdu[5:5+apdu[4]]
+
+        if apdu[3] == P2_MANAGE_SESSION:
+            return "manage_session", self.__manage_session(reader, data)
+        if apdu[3] == P2_SWITCH_PROTOCOL:
+            return "switch_protocol", self.__switch_protocol(channel_name, reader, data)
+        return "transparent_exchange", self.__transparent_exchange(channel_name, reader, data)
+
+    def __manage_session(self, reader: ReaderState, data: bytes) -> bytes:
+        status = STATUS_SUCCESS
+        for tag in iter_manage_session_tags(data):
+            if tag == 0x81: # START_TRANSPARENT_SESSION
+                if reader.is_session:
+                    status = STATUS_DUPLICATE_SESSION # セッションはそのまま
+                reader.is_session = True
+            elif tag == 0x82: # END_TRANSPARENT_SESSION
+                reader.is_session = False
+                reader.technology = None
+            elif tag == 0x83: # RF OFF
+                reader.is_rf_on = False
+            elif tag == 0x84: # RF ON
+                reader.is_rf_on = True
+        return self.__status(status)
+
+    def __switch_protocol(self, channel_name: str, reader: ReaderState, data: bytes) -> bytes:
+        if not reader.is_session:
+            return self.__status(STATUS_INVALID_PROCESS_ORDER)
+        for tag, value in iter_tlv(data):
+            if tag != 0x8F or len(value) < 2: continue
+            technology, layer = value[0], value[1]
+
+            if technology == 0x00: # TypeA
+                reader.technology = TagTechnology.TYPEA_14443_3A
+                cards = self.__current_cards(channel_name, reader.technology)
+                if len(cards) != 1: # カードが無い or 衝突
+                    return self.__status(STATUS_NO_RESPONSE_FROM_CARD)
+                return self.__status(STATUS_SUCCESS, tlv(0x8F, bytes([cards[0].sak]))) # Switch Protocol Response: Final SAK
+
+            if technology == 0x03: # FeliCa
+                reader.technology = TagTechnology.FELICA
+                if layer != 0x01: # pollingしない
+                    return self.__status(STATUS_SUCCESS)
+                cards = self.__current_cards(channel_name, reader.technology)
+                if len(cards) != 1:
+                    return self.__status(STATUS_NO_RESPONSE_FROM_CARD)
+                return self.__status(STATUS_SUCCESS, tlv(0x97, cards[0].felica_polling_response()))
+
+        return self.__status(STATUS_SUCCESS)
+
+    def __transparent_exchange(self, channel_name: str, reader: ReaderState, data: bytes) -> bytes:
+        if not reader.is_session:
+            return self.__status(STATUS_INVALID_PROCESS_ORDER)
+        for tag, value in iter_tlv(data):
+            if tag != 0x95: continue # TRANSCEIVE以外(TIMER, フラグなど)は設定するだけ
+            icc_response = self.__transceive(channel_name, reader, value)
+            if icc_response is None:
+                return self.__status(STATUS_NO_RESPONSE_FROM_CARD)
+            return self.__status(
+                STATUS_SUCCESS, tlv(0x92, b"\x00") + tlv(0x96, b"\x00\x00") + tlv(0x97, icc_response)
+            )
+        return self.__status(STATUS_SUCCESS)
+
+    def __transceive(self, channel_name: str, reader: ReaderState, command: bytes) -> bytes|None:
+        """
+        カードへのコマンドに対するカードの応答. 応答が無ければNone
+        """
+        if reader.technology is None:
+            return None
+        cards = self.__current_cards(channel_name, reader.technology)
+        if len(cards) == 0:
+            return None
+
+        if reader.technology == TagTechnology.TYPEA_14443_3A and command[:1] == bytes([TYPEA_READ]):
+            return cards[0].typeA_page0() if len(cards) == 1 else None
+
+        if reader.technology == TagTechnology.FELICA and len(command) >= 6 and command[1] == FELICA_POLLING:
+            time_slots = command[5] + 1
+            if len(cards) > 1 and time_slots == 1:
+                return None # 同じスロットで衝突
+            return b"".join(card.felica_polling_response() for card in cards[:time_slots])
+
+        return None
+
+    @staticmethod
+    def __status(status: tuple[int, int], data_objects: bytes=b"") -> bytes:
+        error_index = 0x00 if status == STATUS_SUCCESS else 0x01
+        return bytes([0xC0, 0x03, error_index, *status]) + data_objects + SW_SUCCESS
+
+
+def iter_tlv(data: bytes) -> Iterator[tuple[int, bytes]]:
+    """
+    コマンドのデータオブジェクト(BER-TLV)を (tag, value) で順に返す
+    ManageSessionのデータオブジェクトは長さを省略して送っている(81だけ, など)ので, 長さが無ければ0とする
+    """
+    idx = 0
+    while idx < len(data):
+        tag = data[idx]
+        idx += 1
+        if tag & 0x1F == 0x1F and idx < len(data): # 2バイトタグ
+            tag = (tag << 8) | data[idx]
+            idx += 1
+        length = data[idx] if idx < len(data) else 0
+        idx += 1
+        yield tag, data[idx:idx+length]
+        idx += length
+
+
+def iter_manage_session_tags(data: bytes) -> Iterator[int]:
+    """
+    ManageSessionのデータオブジェクトのタグを順に返す
+    81~84は値を持たないので, 長さ(00)は有っても無くても良い. 83 82(RF OFF + END)のように続けて送られる
+    """
+    idx = 0
+    while idx < len(data):
+        tag = data[idx]
+        idx += 1
+        if 0x81 <= tag <= 0x84:
+            if idx < len(data) and data[idx] == 0x00: idx += 1
+            yield tag
+            continue
+        length = data[idx] if idx < len(data) else 0 # 値を持つタグ(GET/SET PARAMETERSなど)は読み飛ばす
+        idx += 1 + length
+
+
+def tlv(tag: int, value: bytes) -> bytes:
+    return bytes([tag, len(value)]) + value
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baudrate", default=115200, type=int)
+    parser.add_argument("--latency_scale", default=1.0, type=float)
+    parser.add_argument(
+        "--card", action="append", default=[],
+        help="置くカード. {Felica, TypeA_14443-3A}:UID(16進数). 複数指定で重ねる"
+    )
+    args = parser.parse_args()
+
+    simulator = RCS660SSimulator(baudrate=args.baudrate, latency_scale=args.latency_scale)
+    cards = []
+    for card in args.card:
+        technology, uid_hex = card.split(":")
+        cards.append(SimulatedCard(TagTechnology(technology), bytes.fromhex(uid_hex)))
+    simulator.set_cards(DEFAULT_CHANNEL, cards)
+
+    with simulator:
+        print(f"port: {simulator.port}", flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(f"commands: {simulator.command_count}")
+
+
+if __name__ == "__main__":
+    main()
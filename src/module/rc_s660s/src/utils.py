@@ -8,9 +8,3 @@ def print_hex(label: str, data: list[int]) -> None:
     hexstr = ' '.join(f'{b:02X}' for b in data)
     print(f"{label}: {hexstr}")
 
-
-def extract_bytes(data: bytes, start_index: int, end_index: int) -> bytes:
-    """
-    バイト列の指定した範囲を抽出する
-    """
-    return data[start_index:end_index]
\ No newline at end of file
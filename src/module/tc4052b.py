@@ -4,8 +4,10 @@
 (と思われる. I2CやSPI用のようにUARTは専用のMUXがあんまり見当たらないため)
 """
 
-from RPi import GPIO
-import pandas as pd
+import time
+
+from ..utils.latency_histogram import LatencyHistogram
+from .gpio_backend import GPIOBackendAbc, create_gpio_backend
 
 
 # マッピングテーブルに入力されるであろうキーリスト
@@ -14,11 +16,11 @@ HIGH=1
 LOW=0
 KEY_LIST_HIGH=["HIGH","HI","H","ON","TRUE","T",1,True]
 KEY_LIST_LOW=["Low","LO","L","OFF","FALSE","F",0,False]
-KEY_LIST_NONE=["NONE","N","N/A","","NAN",None] # pd.NAは含めない.含めるとinによる検索でエラー吐く
+KEY_LIST_NONE=["NONE","N","N/A","","NAN",None] # NaNは含めない. NaN!=NaNなのでinで検索できない
 def CHECK_HIGH_LOW(key) -> int|None:
 
     key=key.upper() if type(key) is str else key
-    if pd.isna(key):
+    if isinstance(key,float) and key!=key: # NaN (DataFrameの空欄)
         return None
     elif key in KEY_LIST_NONE:
         return None
@@ -35,59 +37,68 @@ class AddressPin:
     """
     GPIOのwrapperクラス
     """
-    def __init__(self, pin:int):
+    def __init__(self, pin:int, gpio:GPIOBackendAbc):
         self.pin=int(pin)
-        GPIO.setup(self.pin, GPIO.OUT)
-    
-    def set_high(self):
-        GPIO.output(self.pin, GPIO.HIGH)
-    
-    def set_low(self):
-        GPIO.output(self.pin, GPIO.LOW)
-
-    def noop(self):
-        """
-        何もしない(noop:no operation)
-        多段MUXで特にH/Lの指定が必要ないときに使う
-        """
-        pass
+        self.gpio=gpio
+        self.gpio.setup(self.pin, self.gpio.OUT)
     
     def __del__(self):
-        GPIO.cleanup(self.pin)
+        self.gpio.cleanup(self.pin)
 
 
 class TC4052B:
     """
     TC4052Bを制御するクラス
     mappingテーブルを受け取って, 指定のchannelを開けるだけ
+
+    チャンネルごとのHIGH/LOWは, ピンの並びをbitにしたマスクとして先に作っておく.
+    今のピンの状態を覚えておき, 切り替え先と違うピンだけを1回のGPIO.output(ピンのリスト, 値のリスト)で書く
     """
 
 
-    def __init__(self, mapping:pd.DataFrame):
+    def __init__(self, mapping:dict, gpio:GPIOBackendAbc|None=None):
         """
-        :param mapping: 
-            index: channel_name (開けるチャンネル名)
-            columns: gpio_pins (アドレス指定に使うgpioのピン番号)
-            rows: LOW, HIGH, LOW, LOW,... (各GPIOのHIGH/LOW)
+        :param mapping: {channel_name: {gpio_pin: HIGH/LOW}} の辞書 (conf.yamlのmappingそのまま)
+            channel_name: 開けるチャンネル名
+            gpio_pin: アドレス指定に使うgpioのピン番号
+            HIGH/LOW: 各GPIOのHIGH/LOW/NONE
 
             ex)
-                 5, 6, 13, 19,
-            ch0: LOW, HIGH, LOW, LOW,
-            ch1: LOW, LOW, HIGH, LOW,
+            ch0: {5: L, 6: H, 13: L, 19: L}
+            ch1: {5: L, 6: L, 13: H, 19: L}
             ...
+            index=channel_name, columns=gpio_pinsのpandas.DataFrameも受け付ける
+        :param gpio: GPIOのバックエンド (gpio_backend.create_gpio_backendで作る). NoneならRPi.GPIO (シミュレータではFakeGPIOを渡す)
         """
-        GPIO.setmode(GPIO.BCM) # GPIOのピン番号を指定するモード(!!物理的な配置番号じゃないから注意!!)
+        if not isinstance(mapping, dict):
+            mapping=mapping.to_dict(orient="index") # pandas.DataFrame
 
-        # gpioピン
-        address_pins=[
-            AddressPin(pin) for pin in mapping.columns
-        ] 
+        self.gpio=gpio if gpio is not None else create_gpio_backend()
+        self.mapping=mapping
+        self.gpio.setmode(self.gpio.BCM) # GPIOのピン番号を指定するモード(!!物理的な配置番号じゃないから注意!!)
 
-        # channel切り替え用のswitchを作成
-        self.channel_switch=self.__create_channel_switch(
-            address_pins=address_pins,
-            mapping=mapping,
-        )
+        # gpioピン (全チャンネルに出てくるピンを登場順に). i番目のピンがマスクのi bit目
+        self.pins=[int(pin) for pin in dict.fromkeys(pin for row in mapping.values() for pin in row)]
+        self.address_pins=[
+            AddressPin(pin, self.gpio) for pin in self.pins
+        ]
+
+        # channel_name → (指定のあるピンのマスク, HIGHにするピンのマスク)
+        self.channel_masks=self.__create_channel_masks(mapping)
+
+        # 今のピンの状態. known_maskのbitが立っていないピンは, まだ書いていないので状態が分からない
+        self.pin_state=0
+        self.known_mask=0
+        self.current_channel:str|None=None
+
+        # (pin_state, known_mask, channel_name) → 書くピンと値. 状態の組み合わせは少ないので覚えておく
+        self.switch_cache:dict[tuple[int,int,str], tuple[list[int],list[int]]]={}
+
+        # 計測値
+        self.switch_count=0 # switch_channelの呼び出し回数
+        self.skip_count=0 # 書くピンが無かった(同じチャンネルのまま)回数
+        self.pin_write_count=0 # 書いたピンの延べ数
+        self.switch_histogram=LatencyHistogram() # switch_channel 1回の時間
 
 
 
@@ -96,51 +107,92 @@ class TC4052B:
         channel切り替え関数.
         mappingCSVに書いていたchannel_nameを指定するだけ
         """
-        try:
-            # 各GPIOのHIGH/LOWを指定
-            set_address_pins=[set_high_low() for set_high_low in self.channel_switch[channel_name]]
-        except KeyError:
-            raise ValueError(f"Invalid channel name: {channel_name}")
-        except Exception as e:
-            raise ValueError(f"Error switching channel: {e}")
+        switch_start=time.perf_counter()
+        key=(self.pin_state, self.known_mask, channel_name)
+        diff=self.switch_cache.get(key)
+        if diff is None:
+            diff=self.__create_diff(channel_name)
+            self.switch_cache[key]=diff
+
+        pins, values=diff
+        if len(pins)>0:
+            try:
+                self.gpio.output(pins, values) # 変わるピンだけを1回で書く
+            except Exception as e:
+                raise ValueError(f"Error switching channel: {e}")
+            care_mask, high_mask=self.channel_masks[channel_name]
+            self.pin_state=(self.pin_state & ~care_mask) | high_mask
+            self.known_mask|=care_mask
+            self.pin_write_count+=len(pins)
+        else:
+            self.skip_count+=1
+        self.current_channel=channel_name
+
+        self.switch_count+=1
+        self.switch_histogram.observe(time.perf_counter()-switch_start)
+
+
+    def invalidate_pin_state(self) -> None:
+        """
+        覚えているピンの状態を捨てる. 他からGPIOを書いた場合などに呼ぶと, 次の切り替えで全ピンを書き直す
+        """
+        self.pin_state=0
+        self.known_mask=0
+        self.current_channel=None
+
+
+    def get_metrics(self) -> dict:
+        """
+        切り替えの回数と時間. 読み取り中に別スレッドから呼んでも良い
+        """
+        return {
+            "switch_count":self.switch_count,
+            "skip_count":self.skip_count,
+            "pin_write_count":self.pin_write_count,
+            "switch_time":self.switch_histogram.to_dict(),
+        }
 
 
     # def __del__(self):
     #     GPIO.cleanup()
 
 
-    def __create_channel_switch(
-        self, 
-        address_pins:list[AddressPin], 
-        mapping:pd.DataFrame,
-    ) -> dict:
+    def __create_channel_masks(self, mapping:dict) -> dict[str, tuple[int,int]]:
         """
-        csvのmappingから, 関数でchannel切り替えができるswitchを作成する.
-        usage:
-            # ch0を開ける. こんな感じで対応するchannelをdictのキーで指定して, 中の関数を実行すれば良い 
-            [func() for func in channel_switch["ch0"]] 
-            ...
+        mappingから, チャンネルごとの(指定のあるピンのマスク, HIGHにするピンのマスク)を作る
+        NONEのピン(多段MUXで指定が要らないピン)はどちらのマスクにも入れず, 切り替えで触らない
         """
-        channel_switch={}
-        for idx, row in mapping.iterrows():
-
-            channel_name=idx
-            high_low_arrangement=[]
-            for address_pin,key in zip(address_pins,row.values):
-                # 関数のmapping
-                func_map={
-                    None: address_pin.noop,
-                    HIGH: address_pin.set_high,
-                    LOW: address_pin.set_low,
-                }
-                
+        channel_masks={}
+        for channel_name, row in mapping.items():
+            care_mask=0
+            high_mask=0
+            for i, pin in enumerate(self.pins):
+                key=row.get(pin, row.get(str(pin))) # 指定が無いピンはNONE扱い
                 high_low=CHECK_HIGH_LOW(key)
-                try:
-                    high_low_arrangement.append(func_map[high_low])
-                except Exception as e:
-                    raise ValueError(f"Invalid high/low: {high_low} : {e}")
-            
-            channel_switch[channel_name]=high_low_arrangement
-        
-        return channel_switch
+                if high_low is None:
+                    continue
+                care_mask|=1<<i
+                if high_low==HIGH:
+                    high_mask|=1<<i
+            channel_masks[channel_name]=(care_mask, high_mask)
+        return channel_masks
+
+
+    def __create_diff(self, channel_name:str) -> tuple[list[int],list[int]]:
+        """
+        今のピンの状態から, channel_nameにするために書くピンと値
+        """
+        try:
+            care_mask, high_mask=self.channel_masks[channel_name]
+        except KeyError:
+            raise ValueError(f"Invalid channel name: {channel_name}")
 
+        # 値が違うピンと, まだ書いていないピン
+        diff_mask=((self.pin_state ^ high_mask) | ~self.known_mask) & care_mask
+        pins=[]
+        values=[]
+        for i, pin in enumerate(self.pins):
+            if diff_mask>>i & 1:
+                pins.append(pin)
+                values.append(self.gpio.HIGH if high_mask>>i & 1 else self.gpio.LOW)
+        return pins, values
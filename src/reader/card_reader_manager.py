@@ -8,9 +8,13 @@ from enum import Enum
 from copy import deepcopy
 
 from ..module.tc4052b import TC4052B
+from ..module.rc_s660s.src.rcs660s import RCS660STimeoutError
 from ..module.rc_s660s.src.rcs660s_manager import RCS660SManager
 from ..module.color_sensor import ColorSensor
 from ..module.photo_diode import PhotoDiode
+from .uid_cache import UIDCache
+from .nfc_scheduler import NFCScheduler
+from .reader_group import ReaderGroup
 
 
 class ColorSensorIRReadType(Enum):
@@ -25,35 +29,59 @@ class CardReaderManager:
 
     def __init__(
         self,
-        tc4052b:TC4052B,
-        rcs660s_manager:RCS660SManager,
         color_sensor:ColorSensor,
         photo_diode:PhotoDiode,
         channel_names:list[str],
         delta_time:float=0.00,
         photo_diode_read_type:PhotoDiodeReadType=PhotoDiodeReadType.RAW,
         color_sensor_ir_read_type:ColorSensorIRReadType=ColorSensorIRReadType.RAW,
+        is_presence_gated:bool=False,
+        presence_ir_threshold:float=0.0,
+        uid_cache:UIDCache|None=None,
+        nfc_scheduler:NFCScheduler|None=None,
+        reader_groups:list[ReaderGroup]|None=None,
+        tc4052b:TC4052B|None=None,
+        rcs660s_manager:RCS660SManager|None=None,
     ):
         """
-        :param tc4052b: TC4052B, RCS660Sのチャンネル選択用MUX
-        :param rcs660s_manager: RCS660SManager
         :param color_sensor: ColorSensor
         :param photo_diode: PhotoDiode
         :param channel_names: チャンネル名のリスト(全センサ種類間で共通とする), ex) ['ch0', 'ch1', 'ch2',...]
         :param delta_time: 各センサの読み取り間隔 [s]
         :param photo_diode_read_type: PhotoDiodeReadType
         :param color_sensor_ir_read_type: ColorSensorIRReadType
+        :param is_presence_gated: Trueなら先にcolor sensor/photo diodeを読み, 
+            IRがpresence_ir_threshold以上変化したチャンネルだけNFCを読む (それ以外はid=None)
+        :param presence_ir_threshold: カードありと判定するIRの閾値 (CardStateAnalyzerのirと同じ値)
+        :param uid_cache: UIDCache. 指定すると先にcolor sensor/photo diodeを読み, 
+            値が前回NFCで読めたときから変わっていないチャンネルはNFCを読まずにキャッシュのUIDを使う
+        :param nfc_scheduler: NFCScheduler. 指定するとセンサ値が変わったチャンネルから優先してNFCを読み, 
+            フレームの時間予算を超えるチャンネルは最後に読んだidを使う
+        :param reader_groups: ReaderGroupのリスト. RCS660Sを複数のUARTに分けて繋ぐ場合に指定し,
+            グループごとのスレッドで並列にNFCを読む. Noneならtc4052b/rcs660s_managerで全チャンネルを読む
+        :param tc4052b: reader_groupsを指定しないときの, RCS660Sのチャンネル選択用MUX (MUXが無ければNone)
+        :param rcs660s_manager: reader_groupsを指定しないときのRCS660SManager
         """
 
         # RCS660Sの初期化(終わってない場合)
-        self.tc4052b=tc4052b
-        self.rcs660s_manager=rcs660s_manager
-        if not self.rcs660s_manager.is_setup: # 繋がってるポートみんなresetとsetupする
-            for channel_name in channel_names:
-                self.tc4052b.switch_channel(channel_name)
-                time.sleep(delta_time)
-                self.rcs660s_manager.reset_device()
-                self.rcs660s_manager.setup_device()
+        if reader_groups is None:
+            if rcs660s_manager is None:
+                raise ValueError("Either reader_groups or rcs660s_manager is required")
+            reader_groups=[ReaderGroup(tc4052b, rcs660s_manager, channel_names)]
+        elif tc4052b is not None or rcs660s_manager is not None:
+            raise ValueError("tc4052b/rcs660s_manager are taken from reader_groups; do not pass both")
+        self.reader_groups=reader_groups
+        for group in self.reader_groups:
+            if not group.rcs660s_manager.is_setup:
+                for channel_name in group.channel_names: # 繋がってるポートみんなresetとsetupする
+                    group.switch_channel(channel_name)
+                    time.sleep(delta_time)
+                    try:
+                        group.rcs660s_manager.reset_device()
+                        group.rcs660s_manager.setup_device()
+                    except RCS660STimeoutError as e:
+                        print(f"[CardReaderManager] {channel_name}: {e}")
+                        group.mark_failed(channel_name) # 読み取りループの中で復旧を試す
 
         self.color_sensor=color_sensor
         self.color_sensor_ir_read_type=color_sensor_ir_read_type
@@ -66,6 +94,14 @@ class CardReaderManager:
         self.channel_names=channel_names
         self.delta_time=delta_time
 
+        self.is_presence_gated=is_presence_gated
+        self.presence_ir_threshold=presence_ir_threshold
+        self.uid_cache=uid_cache
+        self.nfc_scheduler=nfc_scheduler
+        self.is_sensor_first=(
+            self.is_presence_gated or self.uid_cache is not None or self.nfc_scheduler is not None
+        )
+
 
         # read_typeがdifferenceの場合はbaselineを取得する
         self.is_difference_read=(
@@ -80,13 +116,89 @@ class CardReaderManager:
 
     def read(self) -> dict:
 
-        # バスごとにスレッドで並列実行する
+        if self.is_sensor_first:
+            # 先に安いcolor sensor/photo diodeを読み, NFCが必要なチャンネルだけNFCを読む
+            sensor_values=self.__read_in_parallel([
+                self.__read_color_sensor,
+                self.__read_photo_diode
+            ])
+            polling_channels=[]
+            for ch_name in self.channel_names:
+                sensor_dict=sensor_values[ch_name]
+                sensor_dict["id"]=None # NFCを読まないチャンネル(カードが無い)はNone
+                if self.is_presence_gated and not self.__is_card_present(ch_name, sensor_dict):
+                    if self.uid_cache is not None: self.uid_cache.invalidate(ch_name)
+                    continue # カードが無い
+                if self.uid_cache is not None:
+                    id_hex=self.uid_cache.get(
+                        ch_name, sensor_dict["color_sensor"]["IR"], sensor_dict["photo_diode"]
+                    )
+                    if id_hex is not None:
+                        sensor_dict["id"]=id_hex # センサ値が変わっていないので前回のUIDを使う
+                        ids=self.uid_cache.get_ids(ch_name)
+                        if ids is not None: sensor_dict["ids"]=ids # 重なった全カードも前回のまま
+                        continue
+                polling_channels.append(ch_name)
+
+            if self.nfc_scheduler is not None:
+                # 優先度順に並べ替え, 今フレームで読まないチャンネルは最後に読んだidを使う
+                self.nfc_scheduler.start_frame(sensor_values)
+                for ch_name in polling_channels:
+                    sensor_values[ch_name]["id"]=self.nfc_scheduler.get_last_id(ch_name)
+                    ids=self.nfc_scheduler.get_last_ids(ch_name)
+                    if ids is not None: sensor_values[ch_name]["ids"]=ids
+                polling_channels=self.nfc_scheduler.schedule(polling_channels)
+
+            for ch_name, sensor_dict in self.__read_rcs660s(polling_channels).items():
+                sensor_values[ch_name].pop("ids", None) # schedulerの前回のidsは, 読んだ結果で置き換える
+                sensor_values[ch_name].update(sensor_dict)
+                if self.uid_cache is not None and sensor_dict.get("is_unknown", False):
+                    self.uid_cache.invalidate(ch_name) # 読めなかっただけなので, 次に読めるまでキャッシュを使わない
+                elif self.uid_cache is not None:
+                    self.uid_cache.update(
+                        ch_name, sensor_dict["id"],
+                        sensor_values[ch_name]["color_sensor"]["IR"], sensor_values[ch_name]["photo_diode"],
+                        ids=sensor_dict.get("ids")
+                    )
+        else:
+            sensor_values=self.__read_in_parallel([
+                self.__read_rcs660s,
+                self.__read_color_sensor,
+                self.__read_photo_diode
+            ])
+
+
+        # 差分計算が必要な場合はbaselineを取得し、差分を計算する
+        if self.is_difference_read:
+            self.__get_value_baseline(sensor_values) # baselineを取得
+            sensor_values=self.__calculate_value_difference(sensor_values) # 差分を計算
+
+        
+        return sensor_values
+
+
+    def get_rcs660s_metrics(self) -> list[dict]:
+        """
+        グループ(RCS660S)ごとのRCS660SMetrics.snapshot(). 読み取り中に別スレッドから呼んでも良い
+        """
+        return [group.rcs660s_manager.rcs660s.metrics.snapshot() for group in self.reader_groups]
+
+
+    def get_mux_metrics(self) -> list[dict|None]:
+        """
+        グループ(MUX)ごとのTC4052B.get_metrics(). MUXの無いグループはNone
+        """
+        return [group.tc4052b.get_metrics() if group.tc4052b is not None else None for group in self.reader_groups]
+
+
+    def __read_in_parallel(self, read_funcs:list) -> dict:
+        """
+        バスごとにスレッドで並列実行し, チャンネルごとに結果をまとめる
+        """
         future_results=[]
-        with ThreadPoolExecutor(max_workers=3) as executor:
+        with ThreadPoolExecutor(max_workers=len(read_funcs)) as executor:
             future=[
-                executor.submit(self.__read_rcs660s),
-                executor.submit(self.__read_color_sensor),
-                executor.submit(self.__read_photo_diode)
+                executor.submit(read_func) for read_func in read_funcs
             ]
             for future in as_completed(future):
                 out=future.result()
@@ -99,27 +211,74 @@ class CardReaderManager:
             for ch_name, sensor_dict in result.items():
                 for sensor, value in sensor_dict.items():
                     sensor_values[ch_name][sensor] = value
-        sensor_values=dict(sensor_values)
+        return dict(sensor_values)
 
 
-        # 差分計算が必要な場合はbaselineを取得し、差分を計算する
-        if self.is_difference_read:
-            self.__get_value_baseline(sensor_values) # baselineを取得
-            sensor_values=self.__calculate_value_difference(sensor_values) # 差分を計算
+    def __is_card_present(self, ch_name:str, sensor_dict:dict) -> bool:
+        """
+        color sensorのIRでカードの有無を判定する (CardStateAnalyzerと同じ判定)
+        """
+        ir=sensor_dict["color_sensor"]["IR"]
+        if self.color_sensor_ir_read_type==ColorSensorIRReadType.DIFFERENCE:
+            ir-=self.color_sensor_ir_baseline[ch_name]
+        return abs(ir)>=self.presence_ir_threshold
 
-        
-        return sensor_values
 
+    def __read_rcs660s(self, channel_names:list[str]|None=None):
+        """
+        :param channel_names: NFCを読むチャンネル(読む順). Noneなら全チャンネル
+            nfc_schedulerがある場合, フレームの時間予算を超えるチャンネルは読まずに結果から除く
+        グループが複数あれば, グループごとのスレッドで並列に読んで結果をまとめる
+        """
+        if channel_names is None: channel_names=self.channel_names
+
+        group_channels=[
+            (group, [ch_name for ch_name in channel_names if ch_name in group.channel_names])
+            for group in self.reader_groups
+        ]
+        group_channels=[(group, ch_names) for group, ch_names in group_channels if len(ch_names)>0]
+        if len(group_channels)==1:
+            return self.__read_reader_group(*group_channels[0])
 
-    def __read_rcs660s(self):
+        futures=[group.submit(self.__read_reader_group, group, ch_names) for group, ch_names in group_channels]
         out={}
-        for channel_name in self.channel_names:
-            self.tc4052b.switch_channel(channel_name) # RCS660Sのチャンネル選択
-            time.sleep(self.delta_time) # ちょっとだけ待つ
-            id_hex=self.rcs660s_manager.polling()["id"] # ここで取れるのは16進数表記のバイトごとのリスト
+        for future in futures:
+            out.update(future.result())
+        return out
+
+    def __read_reader_group(self, group:ReaderGroup, channel_names:list[str]) -> dict:
+        """
+        1つのグループ(RCS660S)で, 担当チャンネルを順に読む
+        応答しないチャンネルはid=None, is_unknown=Trueにしてグループの復旧待ちに回す
+        """
+        out={}
+        if self.nfc_scheduler is None:
+            channel_names=group.order_channels(channel_names) # MUXのピンの変化が少ない順 (schedulerがあればその優先度順)
+        for i, channel_name in enumerate(channel_names):
+            if group.is_failed(channel_name) and not group.try_recover(channel_name):
+                out[channel_name]={"id":None, "is_unknown":True} # 復旧待ち. カードの有無が分からない
+                continue
+            if self.nfc_scheduler is not None and not self.nfc_scheduler.has_budget(channel_name, is_first=i==0):
+                continue # 時間予算切れ
+            poll_start=time.perf_counter()
+            group.switch_channel(channel_name) # RCS660Sのチャンネル選択
+            time.sleep(group.settle_time(channel_name, self.delta_time)) # 測った待ち時間. 無ければdelta_time
+            try:
+                response=group.rcs660s_manager.polling(channel_name)
+            except RCS660STimeoutError as e:
+                print(f"[CardReaderManager] {channel_name}: {e}")
+                group.mark_failed(channel_name) # 他のチャンネルはそのまま読み続ける
+                out[channel_name]={"id":None, "is_unknown":True}
+                continue
+            id_hex=response["id"] # ここで取れるのは16進数表記のバイトごとのリスト
             out[channel_name]={
                 "id":id_hex
             }
+            if "ids" in response: out[channel_name]["ids"]=response["ids"] # 複数枚読めるmanager(FeliCaのタイムスロット)
+            if self.nfc_scheduler is not None:
+                self.nfc_scheduler.record_poll(
+                    channel_name, id_hex, time.perf_counter()-poll_start, ids=response.get("ids")
+                )
         return out
 
     def __read_color_sensor(self):
@@ -144,6 +303,7 @@ class CardReaderManager:
     def __get_value_baseline(self, sensor_values:dict) -> None:
         """
         カードが無いときのphoto diode値をbaselineとして保持する. デフォルトは0.
+        NFCが応答しなかったチャンネル(is_unknown)は, カードの有無が分からないのでbaselineを変えない
         :param sensor_values: {
             ch0: {
                 id: XXXX, 
@@ -152,7 +312,7 @@ class CardReaderManager:
             }, ...
         """
         for ch_name, sensor_dict in sensor_values.items():
-            if sensor_dict["id"] is None:
+            if sensor_dict["id"] is None and not sensor_dict.get("is_unknown", False):
                 if self.photo_diode_read_type==PhotoDiodeReadType.DIFFERENCE:
                     self.photo_diode_baseline[ch_name]=sensor_dict["photo_diode"]
                 if self.color_sensor_ir_read_type==ColorSensorIRReadType.DIFFERENCE:
@@ -173,5 +333,6 @@ class CardReaderManager:
     
 
     def __del__(self):
-        self.rcs660s_manager.close()
+        for group in self.reader_groups:
+            group.close()
         self.color_sensor.close_bus()
\ No newline at end of file
@@ -30,6 +30,8 @@ class CardStateAnalyzer:
             {
                 ch0:{
                     id: XXXX,
+                    ids: [XXXX, ...], (無ければidから作る)
+                    is_unknown: bool, (リーダが応答せず読めなかった. 無ければFalse)
                     color_sensor:{
                         R:XX, G:XX, B:XX, IR:XX
                     },
@@ -44,9 +46,13 @@ class CardStateAnalyzer:
             is_vertical=self.__analyze_photo_diode(value["photo_diode"]) if is_card else None # カードがあれば縦横判定
             id_str="".join(id_raw_value) if not id_raw_value is None else "0000000000000000"
             id_int=int(id_str,16) if not id_raw_value is None else 0 # 16進数を10進数に変換
+            ids_raw_value=value.get("ids", [] if id_raw_value is None else [id_raw_value])
+            card_ids=tuple(int("".join(ids),16) for ids in ids_raw_value) # 重なった複数枚のカード. trajectoryで最頻値を取るのでtuple
             card_states[key]={
                 "is_card":id_raw_value is not None and is_card,
                 "card_id":id_int,
+                "card_ids":card_ids,
+                "is_unknown":value.get("is_unknown", False), # リーダの故障などでNFCを読めていない
                 "is_front":is_front,
                 "is_vertical":is_vertical
             }
@@ -0,0 +1,151 @@
+"""
+UART用MUX(TC4052B)の切り替え順と, 切り替え後の待ち時間の調整
+- optimize_scan_order: 1フレームで切り替わるピンの数が少なくなるチャンネルの順 (グレイコード順)
+- calibrate_settle_times: チャンネルごとに, 切り替えてからリーダがきれいに応答するまでの最小の待ち時間を測る
+"""
+import json
+import time
+from itertools import permutations
+from pathlib import Path
+
+from ..module.tc4052b import TC4052B
+from ..module.rc_s660s.src.ccid_command.get_firmware_version import GetFirmwareVersion
+from ..module.rc_s660s.src.command_frame import compile_command_frame
+from ..module.rc_s660s.src.rcs660s import RCS660STimeoutError
+from ..module.rc_s660s.src.response import SUCCESS
+
+
+MAX_BRUTE_FORCE_CHANNELS=8 # これ以下のチャンネル数なら全部の順番を試す. 多ければ近いものから貪欲に並べる
+
+SETTLE_TIME_CANDIDATES=(0.0, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01) # [s] 短い順に試す待ち時間
+SETTLE_TIME_TRIALS=5 # 1つの待ち時間で続けて成功しなければならない回数
+CALIBRATION_COMMAND_TIMEOUT=0.05 # [s] 測定中のコマンドの期限. 失敗した試行で長く待たない
+
+
+# -------------------------------------- 切り替え順 --------------------------------------
+def count_transitions(tc4052b:TC4052B, order:list[str]) -> int:
+    """
+    orderの順に巡回して切り替え続けたときの, 1周で変わるピンの延べ数
+    NONEのピンは前の状態のままなので, 2周まわして2周目だけを数える
+    """
+    state=0
+    transitions=0
+    for lap in range(2):
+        for channel_name in order:
+            care_mask, high_mask=tc4052b.channel_masks[channel_name]
+            next_state=(state & ~care_mask) | high_mask
+            if lap==1: transitions+=bin(state ^ next_state).count("1")
+            state=next_state
+    return transitions
+
+
+def optimize_scan_order(tc4052b:TC4052B, channel_names:list[str]) -> list[str]:
+    """
+    巡回したときに切り替わるピンが一番少ないチャンネルの順を返す
+    巡回なので先頭は固定し, 残りの並びを全部試す (同じ数なら先に見つかった順)
+    """
+    if len(channel_names)<=2:
+        return list(channel_names)
+    if len(channel_names)>MAX_BRUTE_FORCE_CHANNELS:
+        return _greedy_scan_order(tc4052b, channel_names)
+
+    first, rest=channel_names[0], channel_names[1:]
+    best_order=list(channel_names)
+    best_transitions=count_transitions(tc4052b, best_order)
+    for perm in permutations(rest):
+        order=[first, *perm]
+        transitions=count_transitions(tc4052b, order)
+        if transitions<best_transitions:
+            best_order, best_transitions=order, transitions
+    return best_order
+
+
+def _greedy_scan_order(tc4052b:TC4052B, channel_names:list[str]) -> list[str]:
+    """
+    今のチャンネルから一番ピンの変化が少ないチャンネルを順に選ぶ
+    """
+    order=[channel_names[0]]
+    rest=list(channel_names[1:])
+    while rest:
+        next_channel=min(rest, key=lambda channel_name: count_transitions(tc4052b, [order[-1], channel_name]))
+        order.append(next_channel)
+        rest.remove(next_channel)
+    return order
+
+
+# -------------------------------------- 待ち時間 --------------------------------------
+def calibrate_settle_times(
+    group,
+    candidates:tuple[float, ...]=SETTLE_TIME_CANDIDATES,
+    trials:int=SETTLE_TIME_TRIALS,
+) -> dict[str, float]:
+    """
+    グループのチャンネルごとに, 切り替えてから最初のコマンドがきれいに返るまでの最小の待ち時間を測る
+    ひとつ前のチャンネル(scan_orderで前のもの)から切り替え, 待って, Get Firmware Versionを送る.
+    期限内に成功が返り, resync/チェックサムエラーが無い試行がtrials回続いた最小の待ち時間を探し,
+    境界ぎりぎりでは揺らぎで失敗するので, その1つ長い候補を値とする.
+    どの候補でもだめなチャンネルは一番長い候補にする. 復旧待ちのチャンネルは測らない
+
+    :param group: ReaderGroup
+    :return {channel_name: 待ち時間[s]}
+    """
+    rcs660s=group.rcs660s_manager.rcs660s
+    order=group.scan_order
+    command_timeout=rcs660s.command_timeout
+    rcs660s.command_timeout=CALIBRATION_COMMAND_TIMEOUT
+    settle_times={}
+    try:
+        for i, channel_name in enumerate(order):
+            if group.is_failed(channel_name): continue
+            previous_channel=order[i-1]
+            settle_times[channel_name]=candidates[-1]
+            for j, settle_time in enumerate(candidates):
+                if all(
+                    _is_clean_switch(group, previous_channel, channel_name, settle_time) for _ in range(trials)
+                ):
+                    settle_times[channel_name]=candidates[min(j+1, len(candidates)-1)]
+                    break
+    finally:
+        rcs660s.command_timeout=command_timeout
+        rcs660s.flush_buffer()
+    return settle_times
+
+
+def _is_clean_switch(group, previous_channel:str, channel_name:str, settle_time:float) -> bool:
+    rcs660s=group.rcs660s_manager.rcs660s
+    group.switch_channel(previous_channel)
+    time.sleep(CALIBRATION_COMMAND_TIMEOUT) # 前の試行の残りを捨てる
+    rcs660s.flush_buffer()
+
+    group.switch_channel(channel_name)
+    if settle_time>0: time.sleep(settle_time)
+    resync_count=rcs660s.frame_parser.resync_count
+    corruption_count=rcs660s.frame_parser.corruption_count
+    rcs660s.send_frame(compile_command_frame(GetFirmwareVersion()))
+    try:
+        response=rcs660s.read_response()
+    except RCS660STimeoutError:
+        return False
+    return (
+        response.ccid_status[0]==SUCCESS
+        and rcs660s.frame_parser.resync_count==resync_count
+        and rcs660s.frame_parser.corruption_count==corruption_count
+    )
+
+
+def load_settle_times(path:str|Path) -> dict[str, float]:
+    """
+    保存した待ち時間. ファイルが無ければ空
+    """
+    path=Path(path)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return {channel_name:float(settle_time) for channel_name, settle_time in json.load(f).items()}
+
+
+def save_settle_times(path:str|Path, settle_times:dict[str, float]) -> None:
+    path=Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(settle_times, f, indent=2)
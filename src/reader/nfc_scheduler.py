@@ -0,0 +1,134 @@
+"""
+NFCの読み取り順と読み取るチャンネルを決めるスケジューラ
+"""
+import time
+
+
+class ChannelSchedule:
+    __slots__=("last_id","last_ids","confirm_count","last_poll_time","poll_duration","ir","photo_diode","is_changed")
+
+    def __init__(self, poll_duration:float):
+        self.last_id:list[str]|None=None # 最後にNFCで読んだid
+        self.last_ids:list[list[str]]|None=None # 最後にNFCで読んだ, 重なった全カードのid (無ければNone)
+        self.confirm_count=0 # 同じidが連続で読めた回数
+        self.last_poll_time=0.0 # 最後にNFCを読んだ時刻 [s] (time.monotonic)
+        self.poll_duration=poll_duration # 1回のNFC読み取りにかかる時間の推定値 [s]
+        self.ir:float|None=None # 前フレームのIR
+        self.photo_diode:float|None=None # 前フレームのphoto diode
+        self.is_changed=True # 前フレームからセンサ値が変わったか
+
+
+class NFCScheduler:
+    """
+    チャンネルごとに優先度をつけてNFCの読み取り枠を割り当てる.
+    1. センサ値が前フレームから変わったチャンネル
+    2. idがまだ確定していない(同じidがconfirm_count回続けて読めていない)チャンネル
+    3. 安定しているチャンネル/カードが無いチャンネル: min_poll_rateで読む
+    の順に読み, フレームの時間予算(1/frequency * budget_ratio)を超えそうになったら, そのフレームは打ち切る.
+    読まなかったチャンネルは, 最後に読んだidを使う.
+    """
+
+    def __init__(
+        self,
+        channel_names:list[str],
+        frequency:float,
+        min_poll_rate:float=1.0,
+        budget_ratio:float=0.8,
+        ir_band:float=1.0,
+        photo_diode_band:float=0.003,
+        confirm_count:int=2,
+        initial_poll_duration:float=0.07,
+    ):
+        """
+        :param channel_names: チャンネル名のリスト
+        :param frequency: 読み取りループの周波数 [Hz] (conf.yamlのfrequency)
+        :param min_poll_rate: 安定しているチャンネルを読む最低頻度 [Hz]
+        :param budget_ratio: 1フレームのうちNFCに使ってよい時間の割合
+        :param ir_band: これを超えてIRが変化したら「変化した」とみなす
+        :param photo_diode_band: これを超えてphoto diodeが変化したら「変化した」とみなす [V]
+        :param confirm_count: 同じidがこの回数続けて読めたら確定とする
+        :param initial_poll_duration: 1回のNFC読み取り時間の初期推定値 [s]. 以降は実測で更新する
+        """
+        self.frame_budget=budget_ratio/frequency
+        self.min_poll_interval=1.0/min_poll_rate
+        self.ir_band=ir_band
+        self.photo_diode_band=photo_diode_band
+        self.confirm_count=confirm_count
+        self.schedules={ch_name:ChannelSchedule(initial_poll_duration) for ch_name in channel_names}
+
+        self.frame_start_time=time.monotonic()
+
+
+    def start_frame(self, sensor_values:dict) -> None:
+        """
+        フレームの開始. 時間予算の起点を記録し, 前フレームからのセンサ値の変化を調べる
+        変化したフラグはNFCを読むまで(record_poll)残す. 予算切れで読めなかったチャンネルも次のフレームで優先する
+        :param sensor_values: {ch_name: {color_sensor: {..., IR: XX}, photo_diode: XX}}
+        """
+        self.frame_start_time=time.monotonic()
+        for ch_name, sensor_dict in sensor_values.items():
+            schedule=self.schedules[ch_name]
+            ir=sensor_dict["color_sensor"]["IR"]
+            photo_diode=sensor_dict["photo_diode"]
+            if schedule.ir is not None:
+                schedule.is_changed=schedule.is_changed or (
+                    abs(ir-schedule.ir)>self.ir_band
+                    or abs(photo_diode-schedule.photo_diode)>self.photo_diode_band
+                )
+            schedule.ir=ir
+            schedule.photo_diode=photo_diode
+
+
+    def schedule(self, channel_names:list[str]) -> list[str]:
+        """
+        NFCを読むチャンネルを優先度順に並べて返す. 今フレームで読む必要のないチャンネルは含めない
+        """
+        now=time.monotonic()
+        priorities=[]
+        for ch_name in channel_names:
+            schedule=self.schedules[ch_name]
+            elapsed=now-schedule.last_poll_time
+            if schedule.is_changed:
+                priority=0
+            elif schedule.confirm_count<self.confirm_count:
+                priority=1
+            elif elapsed>=self.min_poll_interval:
+                priority=2
+            else:
+                continue # 安定していて, まだ読む時期ではない
+            priorities.append((priority, -elapsed, ch_name)) # 同じ優先度なら長く読んでいない順
+        return [ch_name for _, _, ch_name in sorted(priorities)]
+
+
+    def has_budget(self, channel_name:str, is_first:bool=False) -> bool:
+        """
+        このチャンネルを読んでもフレームの時間予算に収まるか. フレームの最初の1チャンネルは必ず読む
+        """
+        if is_first:
+            return True
+        elapsed=time.monotonic()-self.frame_start_time
+        return elapsed+self.schedules[channel_name].poll_duration<=self.frame_budget
+
+
+    def record_poll(
+        self, channel_name:str, id_hex:list[str]|None, poll_duration:float, ids:list[list[str]]|None=None
+    ) -> None:
+        """
+        NFCを読んだ結果と, かかった時間を記録する
+        :param ids: 重なった全カードのid (managerの戻り値のids). 無ければNone
+        """
+        schedule=self.schedules[channel_name]
+        schedule.confirm_count=schedule.confirm_count+1 if id_hex==schedule.last_id else 1
+        schedule.last_id=id_hex
+        schedule.last_ids=ids
+        schedule.last_poll_time=time.monotonic()
+        schedule.poll_duration=0.8*schedule.poll_duration+0.2*poll_duration # 移動平均
+        schedule.is_changed=False
+
+
+    def get_last_id(self, channel_name:str) -> list[str]|None:
+        return self.schedules[channel_name].last_id
+
+
+    def get_last_ids(self, channel_name:str) -> list[list[str]]|None:
+        return self.schedules[channel_name].last_ids
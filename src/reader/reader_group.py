@@ -0,0 +1,141 @@
+"""
+1台のRCS660Sと, その前段のMUX, 担当するチャンネルをまとめたもの
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from ..module.tc4052b import TC4052B
+from ..module.rc_s660s.src.metrics import RECOVERIES
+from ..module.rc_s660s.src.rcs660s import RCS660STimeoutError
+from ..module.rc_s660s.src.rcs660s_manager import RCS660SManager
+from .mux_tuning import optimize_scan_order, calibrate_settle_times
+
+
+RECOVERY_INITIAL_BACKOFF=0.1 # [s] 応答しなくなったチャンネルの最初の復旧までの間隔
+RECOVERY_MAX_BACKOFF=5.0 # [s] 失敗するたびに倍にする間隔の上限
+RECOVERY_PROBE_TIMEOUT=0.03 # [s] 復旧待ちのリーダに送るGet Firmware Versionの期限. 往復は数msなので短くて良い
+
+
+class ReaderGroup:
+    """
+    UARTごとのRCS660Sのグループ
+    グループごとに専用のスレッドを1本持ち, 別グループのpollingと並列に担当チャンネルを読む
+    (同じUART/MUXを複数スレッドから触らないよう, グループ内は直列)
+
+    応答しなくなったチャンネルは復旧待ちにし, 間隔を倍々に空けながらflush/reset/setupを1回ずつ試す.
+    復旧はpollingと同じスレッドで行うので, まずRECOVERY_PROBE_TIMEOUTの短い往復だけを確かめ,
+    応答が無ければ遅れた応答も待たずに諦める (他のチャンネルを止めるのは1回あたりRECOVERY_PROBE_TIMEOUT程度).
+
+    scan_orderはMUXのピンの変化が少ないチャンネルの読む順, settle_timesは切り替えてから待つ時間 (mux_tuningで決める)
+    """
+
+    def __init__(self, tc4052b:TC4052B|None, rcs660s_manager:RCS660SManager, channel_names:list[str]):
+        """
+        :param tc4052b: RCS660Sのチャンネル選択用MUX. MUXを介さず1チャンネルだけ繋ぐならNone
+        :param rcs660s_manager: このグループのRCS660SManager
+        :param channel_names: このグループが担当するチャンネル名のリスト
+        """
+        self.tc4052b=tc4052b
+        self.rcs660s_manager=rcs660s_manager
+        self.channel_names=channel_names
+        self.executor:ThreadPoolExecutor|None=None
+        self.recovery_times:dict[str,float]={} # 復旧待ちのチャンネル → 次に復旧を試す時刻 (time.perf_counter)
+        self.recovery_backoffs:dict[str,float]={} # 復旧待ちのチャンネル → 今の復旧の間隔 [s]
+        self.scan_order=list(channel_names) # チャンネルを読む順
+        self.settle_times:dict[str,float]={} # チャンネル → 切り替えてから最初のコマンドまで待つ時間 [s]
+
+
+    def switch_channel(self, channel_name:str) -> None:
+        if self.tc4052b is not None:
+            self.tc4052b.switch_channel(channel_name)
+        self.rcs660s_manager.rcs660s.metrics.channel=channel_name # 以降の計測はこのチャンネルの値
+
+
+    def order_channels(self, channel_names:list[str]) -> list[str]:
+        """
+        channel_namesをscan_orderの順に並べる. scan_orderに無いチャンネルは最後に元の順で
+        """
+        rank={ch_name:i for i, ch_name in enumerate(self.scan_order)}
+        return sorted(channel_names, key=lambda ch_name: rank.get(ch_name, len(rank)))
+
+
+    def settle_time(self, channel_name:str, default:float) -> float:
+        """
+        チャンネルに切り替えてから待つ時間. 測っていなければdefault
+        """
+        return self.settle_times.get(channel_name, default)
+
+
+    def optimize_scan_order(self) -> list[str]:
+        """
+        MUXのピンの変化が一番少ない順にscan_orderを並べ替える
+        """
+        if self.tc4052b is not None:
+            self.scan_order=optimize_scan_order(self.tc4052b, self.channel_names)
+        return self.scan_order
+
+
+    def calibrate_settle_times(self) -> dict[str,float]:
+        """
+        チャンネルごとの待ち時間を測ってsettle_timesにする. 復旧待ちのチャンネルは前の値のまま
+        """
+        if self.tc4052b is not None:
+            self.settle_times.update(calibrate_settle_times(self))
+        return self.settle_times
+
+
+    def mark_failed(self, channel_name:str) -> None:
+        """
+        チャンネルを復旧待ちにする. 続けて失敗するたびに次の復旧までの間隔を倍にする
+        """
+        backoff=self.recovery_backoffs.get(channel_name)
+        backoff=RECOVERY_INITIAL_BACKOFF if backoff is None else min(backoff*2, RECOVERY_MAX_BACKOFF)
+        self.recovery_backoffs[channel_name]=backoff
+        self.recovery_times[channel_name]=time.perf_counter()+backoff
+
+
+    def is_failed(self, channel_name:str) -> bool:
+        return channel_name in self.recovery_times
+
+
+    def try_recover(self, channel_name:str) -> bool:
+        """
+        復旧の時刻になっていれば, チャンネルのリーダの往復を確かめ, flush/reset/setupを1回だけ試す
+        :return: 復旧できたらTrue. 時刻前/失敗ならFalse (失敗したら間隔を倍にして復旧待ちのまま)
+        """
+        if time.perf_counter()<self.recovery_times[channel_name]:
+            return False
+        rcs660s_manager=self.rcs660s_manager
+        rcs660s=rcs660s_manager.rcs660s
+        try:
+            self.switch_channel(channel_name)
+            rcs660s.metrics.count(RECOVERIES)
+            rcs660s.flush_buffer()
+            if not rcs660s.ping(RECOVERY_PROBE_TIMEOUT): # 応答が無いうちはresetの待ち時間をかけない
+                raise RCS660STimeoutError(f"{channel_name}: no response to probe")
+            rcs660s_manager.reset_device()
+            rcs660s_manager.setup_device()
+        except RCS660STimeoutError as e:
+            print(f"[ReaderGroup] recovery failed: {e}")
+            self.mark_failed(channel_name)
+            return False
+        print(f"[ReaderGroup] recovered: {channel_name}")
+        del self.recovery_times[channel_name]
+        del self.recovery_backoffs[channel_name]
+        return True
+
+
+    def submit(self, func, *args) -> Future:
+        """
+        このグループ専用のスレッドでfuncを実行する
+        """
+        if self.executor is None:
+            self.executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="reader_group")
+        return self.executor.submit(func, *args)
+
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor=None
+        self.rcs660s_manager.close()
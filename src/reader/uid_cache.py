@@ -0,0 +1,98 @@
+"""
+チャンネルごとに最後に読めたUIDを保持するキャッシュ
+"""
+import time
+
+
+class UIDCacheEntry:
+    __slots__=("uid","ids","ir","photo_diode","read_time")
+
+    def __init__(self, uid:list[str], ids:list[list[str]]|None, ir:float, photo_diode:float, read_time:float):
+        self.uid=uid
+        self.ids=ids # 重なった全カードのid (FeliCaのタイムスロットで読めたとき). それ以外はNone
+        self.ir=ir # NFCで読めたときのcolor sensorのIR
+        self.photo_diode=photo_diode # NFCで読めたときのphoto diodeの値
+        self.read_time=read_time # NFCで読めた時刻 [s] (time.monotonic)
+
+
+class UIDCache:
+    """
+    最後にNFCでUIDが読めたときのIR/photo diodeの値を覚えておき,
+    値がその周り(band)に収まっている間は, NFCを読まずに同じUIDを返す.
+    bandを超えた or max_ageを過ぎたらmissとして, NFCを読み直させる.
+    """
+
+    def __init__(self, channel_names:list[str], ir_band:float, photo_diode_band:float, max_age:float):
+        """
+        :param channel_names: チャンネル名のリスト
+        :param ir_band: IRの許容変化量 (これを超えたら読み直す)
+        :param photo_diode_band: photo diodeの許容変化量 [V]
+        :param max_age: キャッシュの最大寿命 [s]. これを過ぎたら変化がなくても読み直す
+        """
+        self.ir_band=ir_band
+        self.photo_diode_band=photo_diode_band
+        self.max_age=max_age
+        self.entries:dict[str,UIDCacheEntry|None]={ch_name:None for ch_name in channel_names}
+
+        self.hit_count=0
+        self.miss_count=0
+
+
+    def get(self, channel_name:str, ir:float, photo_diode:float) -> list[str]|None:
+        """
+        キャッシュが使えればUIDを返す. 使えなければNone(NFCで読み直す)
+        """
+        entry=self.entries[channel_name]
+        if entry is None or not self.__is_stable(entry, ir, photo_diode):
+            self.miss_count+=1
+            return None
+        self.hit_count+=1
+        return entry.uid
+
+
+    def get_ids(self, channel_name:str) -> list[list[str]]|None:
+        """
+        キャッシュしている, 重なった全カードのid. getが使えたときに一緒に使う
+        """
+        entry=self.entries[channel_name]
+        return entry.ids if entry is not None else None
+
+
+    def update(
+        self, channel_name:str, uid:list[str]|None, ir:float, photo_diode:float, ids:list[list[str]]|None=None
+    ) -> None:
+        """
+        NFCで読んだ結果を登録する. UIDが読めなかった場合はキャッシュを消す
+        :param ids: 重なった全カードのid (managerの戻り値のids). 無ければNone
+        """
+        if uid is None:
+            self.entries[channel_name]=None
+        else:
+            self.entries[channel_name]=UIDCacheEntry(uid, ids, ir, photo_diode, time.monotonic())
+
+
+    def invalidate(self, channel_name:str|None=None) -> None:
+        """
+        :param channel_name: Noneなら全チャンネル
+        """
+        if channel_name is None:
+            self.entries={ch_name:None for ch_name in self.entries}
+        else:
+            self.entries[channel_name]=None
+
+
+    def get_stats(self) -> dict:
+        total=self.hit_count+self.miss_count
+        return {
+            "hit":self.hit_count,
+            "miss":self.miss_count,
+            "hit_rate":self.hit_count/total if total>0 else 0.0,
+        }
+
+
+    def __is_stable(self, entry:UIDCacheEntry, ir:float, photo_diode:float) -> bool:
+        return (
+            time.monotonic()-entry.read_time<=self.max_age
+            and abs(ir-entry.ir)<=self.ir_band
+            and abs(photo_diode-entry.photo_diode)<=self.photo_diode_band
+        )
@@ -0,0 +1,6 @@
+"""
+処理時間の固定バケットのヒストグラム
+rc_s660sは単体のライブラリとして使えるよう, 実体はrc_s660sのmetrics.pyに置き, ここからはそれを使う.
+MUXの切り替えの計測(tc4052b.py)もRCS660Sの送受信の計測と同じバケットで数える
+"""
+from ..module.rc_s660s.src.metrics import LatencyHistogram, LATENCY_BUCKETS
@@ -15,6 +15,7 @@ class Raspi2UnityAdapter:
         # 内部データのキー変換
         self.key_map = {
             'card_id': 'id',
+            'card_ids': 'ids',
             # 他に変換したいキーがあれば追記
         }
 
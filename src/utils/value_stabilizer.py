@@ -18,7 +18,7 @@ class ValueStabilizer():
         self.trajectory = [] #[trajectory_nums x port_nums]
 
         self.state_keys=[
-            "is_card","card_id","is_front","is_vertical"
+            "is_card","card_id","card_ids","is_unknown","is_front","is_vertical"
         ]
 
 
@@ -0,0 +1,66 @@
+"""
+FeliCaのpolling方式の速度比較
+- transceive: START_TRANSPARENT_SESSION → TIMER+TRANSCEIVE(polling) (従来)
+- fast: START_TRANSPARENT_SESSION → SWITCH_TO_FELICA_POLLING (is_fast_polling)
+--portにシミュレータのptyを指定すれば, 実機なしでも比較できる
+"""
+
+from pathlib import Path
+ROOT=Path(__file__).parent.parent.parent
+import sys
+sys.path.append(str(ROOT))
+
+import argparse
+import statistics
+import time
+
+from src.module.rc_s660s.src.rcs660s import RCS660S
+from src.module.rc_s660s.src.rcs660s_manager import RCS660SManager
+
+
+def benchmark(manager:RCS660SManager, n:int) -> tuple[list[float], int]:
+    """
+    :return: (1回のpollingにかかった時間[s]のリスト, idが読めた回数)
+    """
+    durations=[]
+    read_count=0
+    for _ in range(n):
+        t0=time.perf_counter()
+        response=manager.polling()
+        durations.append(time.perf_counter()-t0)
+        if response["id"] is not None: read_count+=1
+    return durations, read_count
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--port", default="/dev/ttyAMA0", type=str, help="実機のUART or シミュレータのpty")
+    parser.add_argument("--baudrate", default=115200, type=int)
+    parser.add_argument("--timeout_fps", default=200, type=int)
+    parser.add_argument("--n", default=200, type=int, help="各方式のpolling回数")
+    parser.add_argument("--pipelined", action="store_true", help="両方式ともis_pipelinedで比較する")
+    args=parser.parse_args()
+
+    rcs660s=RCS660S(port=args.port, baudrate=args.baudrate, timeout_fps=args.timeout_fps)
+
+    for name, is_fast_polling in [("transceive", False), ("fast", True)]:
+        manager=RCS660SManager(
+            rcs660s=rcs660s, is_pipelined=args.pipelined, is_fast_polling=is_fast_polling
+        )
+        manager.reset_device()
+        manager.setup_device()
+
+        durations,read_count=benchmark(manager, args.n)
+        durations_ms=sorted(d*1e3 for d in durations)
+        median=statistics.median(durations_ms)
+        p95=durations_ms[int(len(durations_ms)*0.95)-1]
+        print(
+            f"{name:<10}: median {median:6.2f} ms, p95 {p95:6.2f} ms, "
+            f"{1e3/median:5.1f} Hz, read {read_count}/{args.n}"
+        )
+
+    rcs660s.uart.close()
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+RCS660Sシミュレータ上でのベンチマーク
+実機なしで, コマンドフレームの組み立て/受信フレームのパース/pollingの各方式の速度を再現性のある数値で比べる.
+pollingはTC4052B(FakeGPIO)でチャンネルを切り替えながら, チャンネルごとにカードを置いて測る
+"""
+
+from pathlib import Path
+ROOT=Path(__file__).parent.parent.parent
+import sys
+sys.path.append(str(ROOT))
+
+import argparse
+import statistics
+import time
+
+from src.module.fake_gpio import FakeGPIO
+from src.module.tc4052b import TC4052B
+from src.module.rc_s660s.src.rcs660s import RCS660S
+from src.module.rc_s660s.src.command_frame import compile_command_frame
+from src.module.rc_s660s.src.frame_parser import FrameParser
+from src.module.rc_s660s.src.pty_device import ACK_FRAME, build_response_frame
+from src.module.rc_s660s.src.rcs660s_manager import RCS660SManager
+from src.module.rc_s660s.src.manager.rcs660s_manager_typeA_14443_3A import RCS660SManagerTypeA144433A
+from src.module.rc_s660s.src.ccid_command.manage_session import ManageSession, ManageSessionDataObjectTag
+from src.module.rc_s660s.src.simulator import RCS660SSimulator, SimulatedCard
+
+
+MAPPING={
+    "ch0": {5: "L", 6: "L", 13: "N", 19: "N"},
+    "ch1": {5: "H", 6: "L", 13: "N", 19: "N"},
+    "ch2": {5: "L", 6: "H", 13: "N", 19: "N"},
+    "ch3": {5: "H", 6: "H", 13: "L", 19: "L"},
+    "ch4": {5: "H", 6: "H", 13: "H", 19: "L"},
+    "ch5": {5: "H", 6: "H", 13: "L", 19: "H"},
+}
+
+# (名前, managerのクラス, kwargs, カードの種類)
+POLLING_MODES=[
+    ("typeA", RCS660SManagerTypeA144433A, {}, "typeA"),
+    ("typeA pipelined", RCS660SManagerTypeA144433A, {"is_pipelined":True}, "typeA"),
+    ("typeA persistent", RCS660SManagerTypeA144433A, {"is_persistent_session":True}, "typeA"),
+    ("felica", RCS660SManager, {}, "felica"),
+    ("felica pipelined", RCS660SManager, {"is_pipelined":True}, "felica"),
+    ("felica fast", RCS660SManager, {"is_fast_polling":True}, "felica"),
+]
+
+
+def benchmark_build(n:int) -> float:
+    """
+    :return: コマンドフレーム1つのコンパイル時間 [us]
+    """
+    t0=time.perf_counter()
+    for _ in range(n):
+        compile_command_frame(ManageSession(data_object_tag=ManageSessionDataObjectTag.START_TRANSPARENT_SESSION))
+    return (time.perf_counter()-t0)/n*1e6
+
+
+def benchmark_parse(n:int) -> float:
+    """
+    :return: ACK+レスポンスフレーム1組のパース時間 [us]
+    """
+    data=ACK_FRAME+build_response_frame(1, bytes([0xC0,0x03,0x00,0x90,0x00,0x97,0x10])+bytes(16)+b"\x90\x00")
+    frame_parser=FrameParser()
+    t0=time.perf_counter()
+    for _ in range(n):
+        frame_parser.feed(data)
+        frame_parser.pop_frame()
+    return (time.perf_counter()-t0)/n*1e6
+
+
+def benchmark_polling(simulator:RCS660SSimulator, tc4052b:TC4052B, rcs660s:RCS660S, channels:list[str], n:int):
+    print(f"polling ({len(channels)}ch, {n}frames):")
+    for name, manager_class, kwargs, card_type in POLLING_MODES:
+        for i, ch_name in enumerate(channels):
+            card=SimulatedCard.typeA(f"04{i:02X}B2C3D4E5F6") if card_type=="typeA" else SimulatedCard.felica(f"0101{i:02X}12345678AB")
+            simulator.set_cards(ch_name, [card])
+
+        manager=manager_class(rcs660s=rcs660s, **kwargs)
+        for ch_name in channels:
+            tc4052b.switch_channel(ch_name)
+            manager.reset_device()
+            manager.setup_device()
+
+        durations=[]
+        read_count=0
+        tc4052b.gpio.reset_timeline()
+        for _ in range(n):
+            t0=time.perf_counter()
+            for ch_name in channels:
+                tc4052b.switch_channel(ch_name)
+                if manager.polling(ch_name)["id"] is not None: read_count+=1
+            durations.append(time.perf_counter()-t0)
+        median=statistics.median(durations)
+        print(
+            f"  {name:<18}: {median*1e3:7.2f} ms/frame, {median/len(channels)*1e3:6.2f} ms/ch, "
+            f"{1/median:5.1f} Hz, read {read_count}/{n*len(channels)}, "
+            f"pin transitions {tc4052b.gpio.transition_count/n:.1f}/frame"
+        )
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--baudrate", default=115200, type=int, help="シミュレータのUARTのボーレート")
+    parser.add_argument("--latency_scale", default=1.0, type=float, help="コマンドの処理時間の倍率. 0で転送時間だけ")
+    parser.add_argument("--channels", default=2, type=int, help="pollingするチャンネル数 (1~6)")
+    parser.add_argument("--n", default=20, type=int, help="pollingのフレーム数")
+    args=parser.parse_args()
+
+    print(f"build: {benchmark_build(10000):.2f} us/frame")
+    print(f"parse: {benchmark_parse(10000):.2f} us/frame")
+
+    gpio=FakeGPIO()
+    simulator=RCS660SSimulator(
+        mapping=MAPPING, gpio=gpio, baudrate=args.baudrate, latency_scale=args.latency_scale
+    ).start()
+    tc4052b=TC4052B(mapping=MAPPING, gpio=gpio)
+    rcs660s=RCS660S(port=simulator.port, baudrate=args.baudrate, timeout_fps=200)
+
+    try:
+        benchmark_polling(simulator, tc4052b, rcs660s, list(MAPPING)[:args.channels], args.n)
+    finally:
+        rcs660s.uart.close()
+        simulator.stop()
+
+
+if __name__=="__main__":
+    main()
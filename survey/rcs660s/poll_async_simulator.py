@@ -0,0 +1,146 @@
+"""
+RCS660Sシミュレータ上で, managerのpoll()(asyncio版)を確かめる
+TC4052B(FakeGPIO)でチャンネルを切り替えながら, チャンネルごとに違うカードを置いてpoll()し,
+1. 読めたidがそのチャンネルのカードか
+2. 1つのチャンネルの応答を期限より遅らせたとき, そのpoll()がRCS660STimeoutErrorになり,
+   遅れた応答を次のチャンネルのpoll()が受け取らないか
+を確かめる
+"""
+
+from pathlib import Path
+ROOT=Path(__file__).parent.parent.parent
+import sys
+sys.path.append(str(ROOT))
+
+import argparse
+import asyncio
+
+from src.module.fake_gpio import FakeGPIO
+from src.module.tc4052b import TC4052B
+from src.module.rc_s660s.src.rcs660s import RCS660S, RCS660STimeoutError
+from src.module.rc_s660s.src.metrics import TIMEOUTS, STALE_FRAMES
+from src.module.rc_s660s.src.rcs660s_manager import RCS660SManager
+from src.module.rc_s660s.src.manager.rcs660s_manager_typeA_14443_3A import RCS660SManagerTypeA144433A
+from src.module.rc_s660s.src.simulator import RCS660SSimulator, SimulatedCard
+
+
+MAPPING={
+    "ch0": {5: "L", 6: "L"},
+    "ch1": {5: "H", 6: "L"},
+    "ch2": {5: "L", 6: "H"},
+}
+
+# (名前, managerのクラス, kwargs, カードの種類)
+POLL_MODES=[
+    ("typeA", RCS660SManagerTypeA144433A, {}, "typeA"),
+    ("typeA pipelined", RCS660SManagerTypeA144433A, {"is_pipelined":True}, "typeA"),
+    ("felica", RCS660SManager, {}, "felica"),
+    ("felica pipelined", RCS660SManager, {"is_pipelined":True}, "felica"),
+]
+
+
+def create_card(card_type:str, i:int) -> SimulatedCard:
+    if card_type=="typeA":
+        return SimulatedCard.typeA(f"04{i:02X}B2C3D4E5F6")
+    return SimulatedCard.felica(f"0101{i:02X}12345678AB")
+
+
+async def poll_channel(tc4052b:TC4052B, manager, channel_name:str) -> str:
+    """
+    :return: 読めたidの16進数表記. 読めなければ"None", 期限切れなら"timeout"
+    """
+    tc4052b.switch_channel(channel_name)
+    try:
+        response=await manager.poll(channel_name)
+    except RCS660STimeoutError:
+        return "timeout"
+    return "".join(response["id"]) if response["id"] is not None else "None"
+
+
+async def survey_mode(
+    simulator:RCS660SSimulator, tc4052b:TC4052B, rcs660s:RCS660S, mode:tuple, n:int, slow_latency:float
+) -> bool:
+    """
+    :return: 全部のpoll()が期待どおりだったか
+    """
+    name, manager_class, kwargs, card_type=mode
+    channels=list(MAPPING)
+    expected={}
+    for i, ch_name in enumerate(channels):
+        card=create_card(card_type, i)
+        simulator.set_cards(ch_name, [card])
+        expected[ch_name]=card.uid.hex().upper()
+
+    manager=manager_class(rcs660s=rcs660s, **kwargs)
+    for ch_name in channels:
+        tc4052b.switch_channel(ch_name)
+        manager.reset_device()
+        manager.setup_device()
+    rcs660s.metrics.reset()
+
+    is_ok=True
+    for _ in range(n):
+        for ch_name in channels:
+            id_hex=await poll_channel(tc4052b, manager, ch_name)
+            if id_hex!=expected[ch_name]:
+                print(f"  {name}: {ch_name} read {id_hex}, expected {expected[ch_name]}")
+                is_ok=False
+
+    # ch0の応答だけ期限より遅らせる. 遅れた応答は読み捨て, 次のch1は自分のカードを読めなければならない
+    latency=simulator.latencies["transparent_exchange"]
+    simulator.latencies["transparent_exchange"]=slow_latency
+    id_hex=await poll_channel(tc4052b, manager, channels[0])
+    simulator.latencies["transparent_exchange"]=latency
+    if id_hex!="timeout":
+        print(f"  {name}: slow {channels[0]} read {id_hex}, expected timeout")
+        is_ok=False
+    for ch_name in channels[1:]+channels[:1]:
+        id_hex=await poll_channel(tc4052b, manager, ch_name)
+        if id_hex!=expected[ch_name]:
+            print(f"  {name}: {ch_name} after timeout read {id_hex}, expected {expected[ch_name]}")
+            is_ok=False
+
+    counters=rcs660s.metrics.counters # {(名前, チャンネル名): 回数}
+    timeouts=sum(n for (counter_name, _), n in counters.items() if counter_name==TIMEOUTS)
+    stale_frames=sum(n for (counter_name, _), n in counters.items() if counter_name==STALE_FRAMES)
+    print(f"  {name:<18}: {'ok' if is_ok else 'NG'}, timeouts {timeouts}, stale frames {stale_frames}")
+    manager.async_rcs660s.close()
+    return is_ok
+
+
+async def survey(simulator:RCS660SSimulator, tc4052b:TC4052B, rcs660s:RCS660S, n:int, slow_latency:float) -> bool:
+    is_ok=True
+    for mode in POLL_MODES:
+        is_ok=await survey_mode(simulator, tc4052b, rcs660s, mode, n, slow_latency) and is_ok
+    return is_ok
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--baudrate", default=115200, type=int, help="シミュレータのUARTのボーレート")
+    parser.add_argument("--n", default=5, type=int, help="全チャンネルをpoll()する回数")
+    parser.add_argument("--command_timeout", default=0.1, type=float, help="1コマンドのレスポンス待ちの上限 [s]")
+    parser.add_argument(
+        "--slow_latency", default=0.15, type=float,
+        help="遅らせたチャンネルのTRANSCEIVEの処理時間 [s]. command_timeoutより長く, 2倍より短くする"
+    )
+    args=parser.parse_args()
+
+    gpio=FakeGPIO()
+    simulator=RCS660SSimulator(mapping=MAPPING, gpio=gpio, baudrate=args.baudrate).start()
+    tc4052b=TC4052B(mapping=MAPPING, gpio=gpio)
+    rcs660s=RCS660S(
+        port=simulator.port, baudrate=args.baudrate, timeout_fps=200, command_timeout=args.command_timeout
+    )
+
+    print(f"poll ({len(MAPPING)}ch, {args.n}frames, slow latency {args.slow_latency*1e3:.0f}ms):")
+    try:
+        is_ok=asyncio.run(survey(simulator, tc4052b, rcs660s, args.n, args.slow_latency))
+    finally:
+        rcs660s.uart.close()
+        simulator.stop()
+    sys.exit(0 if is_ok else 1)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+rcs660s.captureで記録したUARTのキャプチャを再生する
+実機なしで, 本番で起きた通信をそのままパーサ/managerに流してプロファイルやデバッグをする.
+
+usage:
+    python survey/rcs660s/replay_capture.py log/capture/ttyAMA0.rcscap --dump
+    python survey/rcs660s/replay_capture.py log/capture/ttyAMA0.rcscap --tag_type TypeA_14443-3A --channels ch0 ch1 ch2
+"""
+
+from pathlib import Path
+ROOT=Path(__file__).parent.parent.parent
+import sys
+sys.path.append(str(ROOT))
+
+import argparse
+import time
+
+from src.module.rc_s660s.src.capture import read_capture, ReplayUART, CaptureRecord, TX, RX
+from src.module.rc_s660s.src.response import SEQ_INDEX
+from src.module.rc_s660s.src.frame_parser import FrameParser
+from src.module.rc_s660s.src.rcs660s import RCS660S
+from src.module.rc_s660s.src.rcs660s_manager import RCS660SManager
+from src.module.rc_s660s.src.manager.rcs660s_manager_typeA_14443_3A import RCS660SManagerTypeA144433A
+from src.module.rc_s660s.src.manager.rcs660s_manager_mixed import RCS660SManagerMixed
+
+
+MANAGER_CLASSES={
+    "Felica": RCS660SManager,
+    "TypeA_14443-3A": RCS660SManagerTypeA144433A,
+    "Mixed": RCS660SManagerMixed,
+}
+
+
+def replay_parser(records:list[CaptureRecord], n:int) -> None:
+    """
+    受信したバイト列を, 受信したときの区切りのままFrameParserに流す
+    """
+    chunks=[record.data for record in records if record.direction==RX]
+    frame_parser=FrameParser()
+    t0=time.perf_counter()
+    for _ in range(n):
+        frame_parser.reset()
+        for chunk in chunks:
+            frame_parser.feed(chunk)
+            while frame_parser.pop_frame() is not None: pass
+    elapsed=(time.perf_counter()-t0)/n
+    n_bytes=sum(len(chunk) for chunk in chunks)
+    print(
+        f"parse: {len(chunks)} chunks, {n_bytes} bytes, {elapsed*1e3:.3f} ms/replay, "
+        f"resync {frame_parser.resync_count}, corruption {frame_parser.corruption_count}"
+    )
+
+
+def replay_manager(records:list[CaptureRecord], args) -> None:
+    """
+    キャプチャをReplayUARTで流しながら, 記録時と同じ順にmanagerでpollingする
+    """
+    uart=ReplayUART(records, is_realtime=args.realtime)
+    rcs660s=RCS660S(port=None, baudrate=None, timeout_fps=None, uart=uart)
+    tx_records=[record for record in records if record.direction==TX and len(record.data)>SEQ_INDEX]
+    if tx_records: rcs660s.seq=tx_records[0].data[SEQ_INDEX] # 記録時と同じb_seqから送る (リングが一周していても合う)
+    kwargs={"is_pipelined":args.pipelined, "is_persistent_session":args.persistent_session}
+    manager=MANAGER_CLASSES[args.tag_type](rcs660s=rcs660s, **kwargs)
+
+    durations=[]
+    ids:dict[str, set]={ch_name:set() for ch_name in args.channels}
+    try:
+        if not args.skip_setup:
+            for _ in args.channels:
+                manager.reset_device()
+                manager.setup_device()
+        while True:
+            for ch_name in args.channels:
+                t0=time.perf_counter()
+                result=manager.polling(ch_name)
+                durations.append(time.perf_counter()-t0)
+                if result["id"] is not None: ids[ch_name].add("".join(result["id"]))
+    except EOFError:
+        pass
+    finally:
+        uart.close()
+
+    if len(durations)==0:
+        print("polling: no polling in capture")
+        return
+    durations.sort()
+    print(
+        f"polling: {len(durations)} polls, median {durations[len(durations)//2]*1e3:.3f} ms, "
+        f"max {durations[-1]*1e3:.3f} ms, mismatched tx {uart.mismatch_count}"
+    )
+    for ch_name, ch_ids in ids.items():
+        print(f"  {ch_name}: {sorted(ch_ids)}")
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("path", type=Path, help="キャプチャファイル")
+    parser.add_argument("--dump", action="store_true", help="レコードを表示するだけ")
+    parser.add_argument("--tag_type", default="TypeA_14443-3A", choices=list(MANAGER_CLASSES))
+    parser.add_argument("--channels", nargs="+", default=["ch0"], help="記録時にpollingしていたチャンネルの順")
+    parser.add_argument("--pipelined", action="store_true", help="記録時のis_pipelined")
+    parser.add_argument("--persistent_session", action="store_true", help="記録時のis_persistent_session")
+    parser.add_argument("--skip_setup", action="store_true", help="リングが一周してreset/setupが残っていない場合")
+    parser.add_argument("--realtime", action="store_true", help="記録時の応答の間隔で再生する. 指定しなければ最速")
+    parser.add_argument("--n", default=100, type=int, help="パーサの再生回数")
+    args=parser.parse_args()
+
+    records=read_capture(args.path)
+    print(f"{args.path}: {len(records)} records, {records[-1].timestamp-records[0].timestamp if records else 0:.3f}s")
+    if args.dump:
+        for record in records: print(record)
+        return
+
+    replay_parser(records, args.n)
+    replay_manager(records, args)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+起動時間の計測
+- import時間: app/run.pyが使うモジュールを `python -X importtime` で読み込み, 重いモジュールを一覧する
+- 最初のUDP送信までの時間: --runでapp/run.pyを起動し, "[Startup] first packet" の出力までを測る (実機用)
+"""
+
+from pathlib import Path
+ROOT=Path(__file__).parent.parent.parent
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+
+# app/run.pyが起動時にimportするモジュール
+RUNTIME_MODULES=[
+    "yaml",
+    "src.reader.card_state_analyzer",
+    "src.reader.card_reader_manager",
+    "src.module.tc4052b",
+    "src.module.rc_s660s.src.rcs660s",
+    "src.module.rc_s660s.src.rcs660s_manager",
+    "src.module.rc_s660s.src.manager.rcs660s_manager_typeA_14443_3A",
+    "src.module.color_sensor",
+    "src.module.photo_diode",
+    "src.utils.sleep",
+    "src.utils.value_stabilizer",
+    "src.utils.raspi2unity_adapter",
+]
+
+
+def measure_import(modules:list[str]) -> tuple[float, dict[str,int]]:
+    """
+    :return: (import全体の時間[s], {トップレベルのパッケージ名: 累積import時間[us]})
+    """
+    code="import time; t=time.perf_counter(); "+"; ".join(f"import {m}" for m in modules)+"; print(time.perf_counter()-t)"
+    result=subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode!=0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # import time: self [us] | cumulative | imported package
+    cumulative={}
+    for line in result.stderr.splitlines():
+        match=re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match is None: continue
+        depth=len(match.group(3))
+        if depth!=1: continue # トップレベルのimportだけ数える
+        package=match.group(4).split(".")[0]
+        cumulative[package]=cumulative.get(package,0)+int(match.group(2))
+
+    return float(result.stdout.strip()), cumulative
+
+
+def measure_first_packet(timeout:float) -> float|None:
+    """
+    app/run.pyを起動し, 最初のUDPパケットを送信するまでの時間[s]を返す
+    """
+    t0=time.perf_counter()
+    process=subprocess.Popen(
+        [sys.executable, "-u", str(ROOT/"app"/"run.py")],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        for line in process.stdout:
+            if line.startswith("[Startup]"): print(line.rstrip())
+            if line.startswith("[Startup] first packet"):
+                return time.perf_counter()-t0
+            if time.perf_counter()-t0>timeout:
+                return None
+    finally:
+        process.kill()
+    return None
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=5, help="import時間の計測回数")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いパッケージの数")
+    parser.add_argument("--run", action="store_true", help="app/run.pyを起動して最初のUDP送信までを測る(実機用)")
+    parser.add_argument("--timeout", type=float, default=60, help="--runのタイムアウト[s]")
+    args=parser.parse_args()
+
+    totals=[]
+    cumulative={}
+    for _ in range(args.n):
+        total,cumulative=measure_import(RUNTIME_MODULES)
+        totals.append(total)
+    print(f"import: median {statistics.median(totals)*1e3:.1f} ms (min {min(totals)*1e3:.1f} ms, n={args.n})")
+    for package,us in sorted(cumulative.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"  {package:<24} {us/1e3:8.1f} ms")
+
+    if args.run:
+        elapsed=measure_first_packet(args.timeout)
+        if elapsed is None:
+            print("first packet: timeout")
+        else:
+            print(f"first packet (process start -> sendto): {elapsed:.3f}s")
+
+
+if __name__=="__main__":
+    main()